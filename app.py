@@ -1,40 +1,174 @@
 # app.py
+# 常駐的觸發服務 (Cloud Run Service)：Cloud Scheduler 以 POST /run 觸發匯入。
+#
+# - 同一時間最多只有一個匯入在執行；執行中收到的觸發 (例如 Scheduler 的重試) 會併入進行中的那一次
+# - 整個服務只有一個背景事件迴圈與一個已登入的 Telethon 客戶端，連線與所有頻道的實體在兩次運行之間保留，
+#   暖機後的觸發不必再付出 connect、get_me、get_entity 的成本
+# - GET /status 回報是否正在執行，以及上一次運行的耗時與結果
+# - import app 沒有副作用：.env、背景事件迴圈與執行緒在第一次收到請求時才建立 (get_runner())
+#
+# 單一執行流程的保證只在同一個程序內有效，部署時請使用單一 worker
+# (例如 gunicorn --workers 1 --threads 8 app:app，並將 Cloud Run 的最大執行個體數設為 1)。
 
-from flask import Flask
 import asyncio
+import datetime
+import os
 import threading
+import time
 
-# 從您現有的腳本中導入 run 函數
-from main import run as run_telegram_script
+from flask import Flask, jsonify
 
+import config
+import everypy
+
+# 設定在每次運行時由 config.ImporterConfig 讀取；Telethon 在第一次觸發時才載入，讓服務盡快開始接收請求
 app = Flask(__name__)
 
-# 建立一個路由，例如 /run，用來觸發您的腳本
+
+class ImportRunner:
+    """在專屬的背景事件迴圈中執行 everypy.main()，並保證同一時間只有一次運行。"""
+
+    def __init__(self, session_name: str = 'anon'):
+        self.session_name = session_name
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="import-loop", daemon=True)
+        self._thread.start()
+        self._lock = threading.Lock()
+        self._client = None
+        self._entities = {} # 頻道名稱 → Telethon 實體，由 everypy.main() 解析後寫入
+        self.current = None # 進行中的運行 {"run_id", "triggered_at", "merged_triggers", "future"}
+        self.last_run = None # 上一次運行的結果
+        self.runs_started = 0
+
+    async def _ensure_client(self, cfg):
+        """在背景事件迴圈中建立並保持 Telethon 連線。"""
+        if self._client is None:
+            from telethon import TelegramClient
+            # Telethon 客戶端必須在它所使用的事件迴圈中建立
+            self._client = TelegramClient(self.session_name, everypy.check_required_env(cfg), cfg.api_hash)
+        if not self._client.is_connected():
+            await self._client.connect()
+            if not await self._client.is_user_authorized():
+                raise RuntimeError(f"Telethon Session ({self.session_name}.session) 未授權，請重新產生 Session 檔案。")
+        return self._client
+
+    async def _reset_client(self):
+        """中斷並丟棄目前的 Telethon 客戶端，下次觸發時重新連線 (不沿用可能已損壞的連線狀態)。"""
+        client, self._client = self._client, None
+        if client is None:
+            return
+        try:
+            await client.disconnect()
+        except Exception as e:
+            print(f"警告：中斷 Telegram 連線失敗: {e}")
+
+    async def _run(self, run):
+        started = time.perf_counter()
+        run["started_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        report, error = None, None
+        try:
+            cfg = config.ImporterConfig()
+            client = await self._ensure_client(cfg)
+            run["warm_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            # 頻道實體只在第一次運行 (或新增頻道後) 解析一次
+            report = await everypy.main(client, cfg=cfg, entities=self._entities)
+        except (Exception, SystemExit) as e: # check_required_env() 以 exit(1) 回報設定錯誤
+            error = f"{type(e).__name__}: {e}"
+            print(f"匯入運行失敗: {error}")
+            # 連線或實體可能已失效，下次觸發時重新建立
+            self._entities.clear()
+            await self._reset_client()
+        finally:
+            finished = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            with self._lock:
+                self.last_run = {
+                    "run_id": run["run_id"],
+                    "triggered_at": run["triggered_at"],
+                    "started_at": run["started_at"],
+                    "finished_at": finished,
+                    "duration_seconds": round(time.perf_counter() - started, 3),
+                    "connect_ms": run.get("warm_ms"),
+                    "merged_triggers": run["merged_triggers"],
+                    "ok": bool(report and report.get("ok")),
+                    "error": error,
+                    "stages": report.get("stages") if report else None,
+                    "counters": report.get("counters") if report else None,
+                }
+                self.current = None
+        return report
+
+    def trigger(self):
+        """開始一次運行；已有運行在進行中時併入該次運行。返回 (run_id, 是否為新運行)。"""
+        with self._lock:
+            if self.current is not None:
+                self.current["merged_triggers"] += 1
+                return self.current["run_id"], False
+            self.runs_started += 1
+            run = {
+                "run_id": self.runs_started,
+                "triggered_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "merged_triggers": 0,
+            }
+            self.current = run
+            run["future"] = asyncio.run_coroutine_threadsafe(self._run(run), self.loop)
+            return run["run_id"], True
+
+    def status(self) -> dict:
+        with self._lock:
+            current = None
+            if self.current is not None:
+                current = {key: value for key, value in self.current.items() if key != "future"}
+            return {
+                "running": current is not None,
+                "current": current,
+                "last_run": self.last_run,
+                "telegram_connected": bool(self._client and self._client.is_connected()),
+                "channels_resolved": sorted(self._entities),
+            }
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> ImportRunner:
+    """返回服務唯一的 ImportRunner，第一次呼叫時才載入 .env 並啟動背景事件迴圈。"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            config.load_env()
+            _runner = ImportRunner()
+        return _runner
+
+
+# 建立一個路由，例如 /run，用來觸發匯入
 @app.route("/run", methods=['POST'])
 def trigger_script():
     # Cloud Scheduler 發送的請求會包含特定的 Header，我們可以檢查它以增加安全性
     # if not request.headers.get('User-Agent') == 'Google-Cloud-Scheduler':
     #     return "Unauthorized", 401
 
-    print("收到觸發請求，將在背景執行 Telegram 腳本...")
+    run_id, started = get_runner().trigger()
+    if started:
+        print(f"收到觸發請求，已在背景開始第 {run_id} 次匯入。")
+        message = "Accepted: Import started in the background."
+    else:
+        print(f"收到觸發請求，第 {run_id} 次匯入仍在進行中，本次觸發已併入。")
+        message = "Accepted: An import is already running; this trigger was merged into it."
+
+    # 立刻返回 202 Accepted，告訴 Scheduler「我收到任務了，正在處理」
+    return jsonify({"message": message, "run_id": run_id, "started": started}), 202
 
-    # 因為 main 腳本是異步且可能耗時長，我們不能直接在請求中運行它
-    # 否則會導致請求超時。我們將它放在一個新的線程中執行。
-    def run_in_background():
-        # 為新線程創建並設置事件循環
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(run_telegram_script())
-        loop.close()
-        print("背景 Telegram 腳本執行完畢。")
 
-    thread = threading.Thread(target=run_in_background)
-    thread.start()
+@app.route("/status", methods=['GET'])
+def status():
+    return jsonify(get_runner().status()), 200
 
-    # 立刻返回 202 Accepted，告訴 Scheduler「我收到任務了，正在處理」
-    return "Accepted: Script is running in the background.", 202
 
 if __name__ == "__main__":
+    # 啟動時先檢查必要的環境變數，設定錯誤時立即失敗
+    config.load_env()
+    everypy.check_required_env()
     # 從環境變數獲取端口，這是 Cloud Run 的要求
     port = int(os.environ.get("PORT", 8080))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, threaded=True)
@@ -0,0 +1,463 @@
+# backfill.py
+# 歷史回補：把一段訊息 ID (或日期) 範圍切成 N 個連續的分區，每個分區由一個 Cloud Run Job task
+# (CLOUD_RUN_TASK_INDEX / CLOUD_RUN_TASK_COUNT) 或本地的 worker process 獨立處理，最後再合併：
+#   1. 分區  以 everypy.main() 的回補模式 (cfg.message_id_range) 抓取自己的範圍並處理圖片，
+#            寫入自己工作目錄中的資料庫、watermark 與圖片索引 (task 被終止後重跑時從 watermark 繼續)；
+#            完成後在 BACKFILL_DIR 輸出部分分片：
+#              <頻道>/part-0003-of-0008.jsonl          該分區的貼文，每行一則，依訊息 ID 升序
+#              <頻道>/part-0003-of-0008.images.json    該分區的圖片索引
+#              <頻道>/part-0003-of-0008.json           完成標記 (範圍、筆數、SHA-256、仍待重試的圖片)，最後寫入
+#            已有相同範圍完成標記的分區直接略過。
+#   2. 合併  確認 N 個分區都已完成且內容與標記相符後，依訊息 ID 逐筆合併所有部分分片
+#            (同一個 ID 出現在多個分區時固定保留分區編號最大的版本，結果與分區完成的先後無關)，
+#            寫入頻道的資料庫、併入圖片索引、推進 watermark，再以 everypy.export_outputs() 重新產生所有輸出。
+# 分區之間不共用任何可寫入的檔案，回補時間隨 task 數量縮短。
+#
+# 用法：
+#   python cli.py backfill --from-id 1 --to-id 200000 --workers 8       本地 8 個 worker process，完成後合併
+#   python cli.py backfill --since 2020-01-01 --until 2024-12-31 --workers 8
+#   python cli.py backfill --fake-messages 5000 --workers 4             以假的訊息來源與本地 ImgBB 替身測試
+#   Cloud Run Job (每個 task)：python cli.py backfill --from-id 1 --to-id 200000
+#   所有 task 完成後：          python cli.py backfill --merge
+
+import argparse
+import asyncio
+import copy
+import datetime
+import glob
+import heapq
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+import config
+import everypy
+import image_cache
+import import_state
+import post_store
+import run_metrics
+from publish_artifacts import file_digest
+
+PARTIAL_FORMAT_VERSION = 1
+MERGE_BATCH_SIZE = 1000
+_MARKER_PATTERN = re.compile(r"^part-(\d{4})-of-(\d{4})\.json$")
+
+
+def partition_range(first_id: int, last_id: int, count: int, index: int):
+    """把 [first_id, last_id] 平均切成 count 個連續分區，返回第 index 個分區的 (起點, 終點) (皆含)。
+
+    分區沒有任何訊息時終點小於起點。
+    """
+    total = max(0, last_id - first_id + 1)
+    return first_id + total * index // count, first_id + total * (index + 1) // count - 1
+
+
+def task_partition(environ=None):
+    """Cloud Run Job 的 task 編號與 task 數量 (未在 Cloud Run 上執行時為 0 與 1)。"""
+    env = os.environ if environ is None else environ
+    return int(env.get("CLOUD_RUN_TASK_INDEX", "0")), int(env.get("CLOUD_RUN_TASK_COUNT", "1"))
+
+
+def partition_name(index: int, count: int) -> str:
+    return f"part-{index:04d}-of-{count:04d}"
+
+
+def _channel(cfg, username: str = None):
+    if not username:
+        return cfg.channels[0]
+    for channel in cfg.channels:
+        if channel.username == username:
+            return channel
+    raise config.ConfigError(f"頻道 {username} 不在 CHANNEL_USERNAMES 中")
+
+
+def _load_json(path: str):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        print(f"警告：{path} 不是有效的 JSON，將視為不存在。")
+        return None
+
+
+def _write_json(path: str, data) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def partition_config(cfg, channel, index: int, count: int, first_id: int, last_id: int, rehost: bool = False):
+    """分區使用的設定：只處理 [first_id, last_id]，資料庫、watermark、圖片索引與運行報告都在分區的工作目錄中。"""
+    work_dir = os.path.join(cfg.backfill_work_dir, channel.slug, partition_name(index, count))
+    os.makedirs(work_dir, exist_ok=True)
+    part_cfg = copy.copy(cfg)
+    part_cfg.post_store_file = os.path.join(work_dir, post_store.POST_STORE_FILE)
+    part_cfg.import_state_file = os.path.join(work_dir, import_state.IMPORT_STATE_FILE)
+    part_cfg.channel_username = channel.username
+    part_cfg.channels = [config.ChannelConfig(channel.username, True, cfg.channels_dir,
+                                              part_cfg.post_store_file, part_cfg.import_state_file)]
+    part_cfg.image_index_file = os.path.join(work_dir, image_cache.IMAGE_INDEX_FILE)
+    part_cfg.run_metrics_file = os.path.join(work_dir, run_metrics.RUN_METRICS_FILE)
+    part_cfg.run_metrics_openmetrics_file = ""
+    part_cfg.message_id_range = (first_id, last_id)
+    # 分區的工作目錄只屬於這個 task，不與 bucket 中頻道的狀態檔同步 (由合併步驟統一上傳)
+    part_cfg.state_bucket_name = ""
+    # 回補的範圍都是舊訊息，不需要回看最近的編輯
+    part_cfg.edit_lookback_messages = 0
+    # 以目前的圖片索引為起點，已託管的圖片不再重新上傳 (--rehost 時全部重新上傳)
+    if not rehost and not os.path.exists(part_cfg.image_index_file) and os.path.exists(cfg.image_index_file):
+        shutil.copyfile(cfg.image_index_file, part_cfg.image_index_file)
+    return part_cfg
+
+
+async def run_partition(client, cfg, index: int, count: int, first_id: int, last_id: int, channel_name: str = None,
+                        rehost: bool = False, upload_image=None) -> bool:
+    """處理第 index 個分區並輸出部分分片與完成標記。返回是否成功。"""
+    channel = _channel(cfg, channel_name)
+    lo, hi = partition_range(first_id, last_id, count, index)
+    name = partition_name(index, count)
+    output_dir = os.path.join(cfg.backfill_dir, channel.slug)
+    os.makedirs(output_dir, exist_ok=True)
+    base = os.path.join(output_dir, name)
+    marker = _load_json(f"{base}.json")
+    if marker and (marker.get("first_id"), marker.get("last_id")) == (lo, hi):
+        print(f"[{channel.username}] 分區 {name} (訊息 ID {lo}–{hi}) 已完成，略過。")
+        return True
+
+    pending_ids, images_path = [], None
+    print(f"[{channel.username}] 分區 {name}：訊息 ID {lo}–{hi}")
+    part_cfg = partition_config(cfg, channel, index, count, lo, hi, rehost)
+    if hi >= lo:
+        report = await everypy.main(client, upload_image=upload_image, cfg=part_cfg)
+        if not report.get("ok"):
+            print(f"錯誤：[{channel.username}] 分區 {name} 沒有完成，重新執行時會從它的 watermark 繼續。")
+            return False
+        pending_ids = import_state.pending_image_ids(import_state.load_state(part_cfg.import_state_file))
+        if os.path.exists(part_cfg.image_index_file):
+            images_path = f"{base}.images.json"
+            shutil.copyfile(part_cfg.image_index_file, f"{images_path}.tmp")
+            os.replace(f"{images_path}.tmp", images_path)
+
+    # 部分分片：依訊息 ID 升序，每行一則 (合併時逐行讀取，不需要載入整個分片)
+    posts_count = 0
+    with post_store.PostStore(part_cfg.post_store_file) as store, \
+            open(f"{base}.jsonl.tmp", "w", encoding="utf-8") as f:
+        for post in store.iter_posts(by_id=True):
+            f.write(json.dumps(post, ensure_ascii=False, separators=(",", ":")) + "\n")
+            posts_count += 1
+    os.replace(f"{base}.jsonl.tmp", f"{base}.jsonl")
+
+    _write_json(f"{base}.json", {
+        "version": PARTIAL_FORMAT_VERSION,
+        "channel": channel.username,
+        "index": index,
+        "count": count,
+        "first_id": lo,
+        "last_id": hi,
+        "posts": posts_count,
+        "sha256": file_digest(f"{base}.jsonl"),
+        "images": os.path.basename(images_path) if images_path else None,
+        "pending_image_ids": pending_ids,
+        "finished_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    })
+    print(f"[{channel.username}] 分區 {name} 完成：{posts_count} 則貼文已寫入 {base}.jsonl。")
+    return True
+
+
+def _iter_partial(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def find_partitions(cfg, channel, count: int = None):
+    """返回 (分區數, 依編號排序的完成標記)；找不到、分區數不一致或有分區未完成時印出原因並返回 (None, None)。"""
+    output_dir = os.path.join(cfg.backfill_dir, channel.slug)
+    found = {}
+    for path in glob.glob(os.path.join(output_dir, "part-*-of-*.json")):
+        match = _MARKER_PATTERN.match(os.path.basename(path))
+        if match:
+            found.setdefault(int(match.group(2)), {})[int(match.group(1))] = path
+    if count is None:
+        if len(found) != 1:
+            print(f"錯誤：{output_dir} 中{'沒有' if not found else '有多組'}回補分區"
+                  f"{'' if not found else '：' + '、'.join(map(str, sorted(found)))}，請以 --task-count 指定分區數。")
+            return None, None
+        count = next(iter(found))
+    paths = found.get(count, {})
+    missing = [index for index in range(count) if index not in paths]
+    if missing:
+        print(f"錯誤：[{channel.username}] 共 {count} 個分區，以下分區尚未完成：{', '.join(map(str, missing))}")
+        return None, None
+    markers = []
+    for index in range(count):
+        marker = _load_json(paths[index])
+        partial = os.path.join(output_dir, f"{partition_name(index, count)}.jsonl")
+        if not marker or marker.get("version") != PARTIAL_FORMAT_VERSION or not os.path.exists(partial) \
+                or file_digest(partial) != marker.get("sha256"):
+            print(f"錯誤：[{channel.username}] 分區 {partition_name(index, count)} 的部分分片與完成標記不符，請重新執行該分區。")
+            return None, None
+        marker["path"] = partial
+        markers.append(marker)
+    return count, markers
+
+
+def merge_partitions(cfg, count: int = None, channel_name: str = None) -> int:
+    """合併所有分區的部分分片並重新產生輸出檔案。返回結束碼。"""
+    channel = _channel(cfg, channel_name)
+    count, markers = find_partitions(cfg, channel, count)
+    if markers is None:
+        return 1
+    metrics = run_metrics.RunMetrics()
+    # 合併到頻道目前的資料庫與 watermark：先從 bucket 取回 (Cloud Run 的容器不保留本地檔案)
+    try:
+        synced_state = everypy.restore_state(cfg, metrics)
+    except Exception as e:
+        print(f"錯誤：無法從 gs://{cfg.state_bucket_name}/ 載入狀態檔: {e}")
+        return 1
+    print(f"[{channel.username}] 正在合併 {count} 個分區 (訊息 ID {markers[0]['first_id']}–{markers[-1]['last_id']}) ...")
+
+    # 各分片都依 ID 升序：heapq.merge 在 ID 相同時依串流順序 (分區編號) 排列，每個 ID 取最後一個版本
+    merged = heapq.merge(*(_iter_partial(marker["path"]) for marker in markers), key=lambda post: post["id"])
+    if not channel.primary:
+        os.makedirs(os.path.dirname(channel.post_store_file), exist_ok=True)
+    posts_count = duplicates = changed = 0
+    with post_store.PostStore(channel.post_store_file) as store:
+        batch = []
+        for _, versions in itertools.groupby(merged, key=lambda post: post["id"]):
+            versions = list(versions)
+            duplicates += len(versions) - 1
+            batch.append(versions[-1])
+            if len(batch) >= MERGE_BATCH_SIZE:
+                changed += store.upsert(batch)
+                posts_count += len(batch)
+                batch = []
+        changed += store.upsert(batch)
+        posts_count += len(batch)
+
+        # 推進 watermark 到回補範圍的終點，之後的一般匯入從這裡繼續；分區中仍失敗的圖片交給一般匯入重試
+        state = import_state.load_state(channel.import_state_file, store.max_id())
+    state["last_message_id"] = max(state["last_message_id"], markers[-1]["last_id"])
+    pending_ids = sorted({msg_id for marker in markers for msg_id in marker.get("pending_image_ids") or []})
+    import_state.update_pending(state, pending_ids, [], cfg.image_retry_runs)
+    import_state.save_state(state, channel.import_state_file)
+    print(f"[{channel.username}] 已合併 {posts_count} 則貼文 (重複的 ID {duplicates} 個，資料庫中新增或更新 {changed} 筆)，"
+          f"watermark 為訊息 ID {state['last_message_id']}。")
+    if pending_ids:
+        print(f"警告：[{channel.username}] {len(pending_ids)} 則訊息的圖片在回補中未能處理，下次匯入會重新處理。")
+
+    images = image_cache.ImageCache(
+        cfg.image_index_file, max_entries=cfg.image_index_max_entries, max_age_days=cfg.image_index_max_age_days
+    ).load()
+    output_dir = os.path.join(cfg.backfill_dir, channel.slug)
+    for marker in markers:
+        if marker.get("images"):
+            images.merge(image_cache.ImageCache(os.path.join(output_dir, marker["images"])).load())
+    if images.changed:
+        images.save()
+    metrics.incr("backfill_partitions", count)
+    metrics.incr("backfill_posts", posts_count)
+    metrics.incr("backfill_duplicates", duplicates)
+    metrics.incr("posts_changed", changed)
+    metrics.checkpoint("merge")
+
+    # 以所有頻道的資料庫重新產生合併後的輸出 (與一般匯入相同)
+    stores = {}
+    try:
+        for each in cfg.channels:
+            if not each.primary:
+                os.makedirs(os.path.dirname(each.post_store_file), exist_ok=True)
+            stores[each.username] = post_store.PostStore(each.post_store_file)
+        metrics.ok = everypy.export_outputs(cfg, stores, metrics)
+    finally:
+        for store in stores.values():
+            store.close()
+    if not everypy.save_state(synced_state, metrics, cfg, outputs_ok=metrics.ok):
+        metrics.ok = False
+    try:
+        metrics.write(cfg.run_metrics_file, cfg.run_metrics_openmetrics_file)
+    except OSError as e:
+        print(f"警告：寫入運行報告失敗: {e}")
+    print(json.dumps(metrics.report(), ensure_ascii=False))
+    return 0 if metrics.ok else 1
+
+
+# --- 訊息來源 ---
+def _telegram_client(cfg, session_path: str = "anon"):
+    """以 anon.session 建立 Telethon 客戶端。本地的 worker process 各自使用 session 檔的複本，避免 SQLite 鎖定。"""
+    from telethon import TelegramClient
+    api_id = everypy.check_required_env(cfg)
+    if session_path != "anon" and os.path.exists("anon.session") and not os.path.exists(f"{session_path}.session"):
+        shutil.copyfile("anon.session", f"{session_path}.session")
+    return TelegramClient(session_path, api_id, cfg.api_hash)
+
+
+def _parse_date(value: str) -> datetime.datetime:
+    """YYYY-MM-DD 解讀為台灣時間當天 00:00 (與貼文的 date 欄位相同的時區)。"""
+    return datetime.datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=everypy.TW_TZ)
+
+
+async def resolve_range(client, cfg, args, channel_name: str = None):
+    """把 --from-id/--to-id 或 --since/--until 轉為訊息 ID 範圍 (皆含)。未指定終點時使用頻道最新的訊息。"""
+    entity = await client.get_entity(_channel(cfg, channel_name).username)
+
+    async def last_id_before(offset_date=None):
+        async for msg in client.iter_messages(entity, offset_date=offset_date, limit=1):
+            return msg.id
+        return 0
+
+    first_id = args.from_id or (await last_id_before(_parse_date(args.since)) + 1 if args.since else 1)
+    if args.to_id:
+        last_id = args.to_id
+    elif args.until:
+        last_id = await last_id_before(_parse_date(args.until) + datetime.timedelta(days=1))
+    else:
+        last_id = await last_id_before()
+    return first_id, last_id
+
+
+def _fake_environment() -> None:
+    """--fake-messages：改用壓測的假訊息來源與本地 ImgBB 替身 (不需要任何憑證)。在建立設定前呼叫。"""
+    import bench_import
+    os.environ.setdefault("CHANNEL_USERNAME", bench_import.FakeTelegramClient.primary_channel)
+    os.environ.setdefault("TELEGRAM_REQUESTS_PER_SECOND", "0")
+    os.environ.setdefault("IMGBB_REQUESTS_PER_SECOND", "0")
+    # 假的貼文不會同步到真正的 bucket 或 Firestore
+    os.environ["STATE_BUCKET_NAME"] = ""
+    if not os.environ.get("STORAGE_EMULATOR_HOST"):
+        os.environ["STORAGE_BUCKET_NAME"] = ""
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        os.environ["FIRESTORE_SYNC"] = "0"
+
+
+def _fake_client(args):
+    import bench_import
+    return bench_import.FakeTelegramClient(args.fake_messages)
+
+
+async def _with_client(client, coro_factory):
+    if hasattr(client, "__aenter__"):
+        async with client:
+            return await coro_factory()
+    return await coro_factory()
+
+
+def _run_task(args, cfg, index: int, count: int) -> int:
+    """執行單一分區 (Cloud Run 的一個 task 或本地的一個 worker process)。"""
+    if count > 1 and not (args.to_id or args.until):
+        print("錯誤：多個分區時必須以 --to-id 或 --until 固定範圍的終點，否則各分區看到的「最新訊息」可能不同。")
+        return 1
+    stand_in = None
+    if args.fake_messages:
+        import bench_import
+        client = _fake_client(args)
+        stand_in = bench_import.ImgbbStandIn().__enter__()
+        cfg.imgbb_upload_url = stand_in.url
+    else:
+        work_dir = os.path.join(cfg.backfill_work_dir, _channel(cfg, args.channel).slug, partition_name(index, count))
+        os.makedirs(work_dir, exist_ok=True)
+        client = _telegram_client(cfg, os.path.join(work_dir, "anon"))
+
+    async def task():
+        first_id, last_id = await resolve_range(client, cfg, args, args.channel)
+        return await run_partition(client, cfg, index, count, first_id, last_id, args.channel, args.rehost)
+
+    try:
+        ok = asyncio.run(_with_client(client, task))
+    finally:
+        if stand_in is not None:
+            stand_in.__exit__(None, None, None)
+    if ok and count == 1:
+        return merge_partitions(cfg, count, args.channel)
+    return 0 if ok else 1
+
+
+def _run_workers(args, cfg) -> int:
+    """本地模式：解析一次範圍後啟動 N 個 worker process (各處理一個分區)，全部成功後合併。"""
+    client = _fake_client(args) if args.fake_messages else _telegram_client(cfg)
+    first_id, last_id = asyncio.run(_with_client(client, lambda: resolve_range(client, cfg, args, args.channel)))
+    channel = _channel(cfg, args.channel)
+    count = args.workers
+    print(f"[{channel.username}] 回補訊息 ID {first_id}–{last_id}，分成 {count} 個分區，啟動 {count} 個 worker process ...")
+
+    log_dir = os.path.join(cfg.backfill_work_dir, channel.slug)
+    os.makedirs(log_dir, exist_ok=True)
+    here = os.path.dirname(os.path.abspath(__file__))
+    started = time.perf_counter()
+    workers = []
+    for index in range(count):
+        command = [sys.executable, os.path.join(here, "cli.py"), "backfill", "--task-index", str(index),
+                   "--task-count", str(count), "--from-id", str(first_id), "--to-id", str(last_id)]
+        if args.channel:
+            command += ["--channel", args.channel]
+        if args.rehost:
+            command.append("--rehost")
+        if args.fake_messages:
+            command += ["--fake-messages", str(args.fake_messages)]
+        log_path = os.path.join(log_dir, f"{partition_name(index, count)}.log")
+        log = open(log_path, "w", encoding="utf-8")
+        workers.append((index, subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT), log, log_path))
+
+    failed = []
+    for index, process, log, log_path in workers:
+        returncode = process.wait()
+        log.close()
+        if returncode != 0:
+            failed.append(index)
+            print(f"錯誤：分區 {partition_name(index, count)} 失敗 (結束碼 {returncode})，記錄在 {log_path}。")
+    print(f"[{channel.username}] {count - len(failed)}/{count} 個分區完成，耗時 {time.perf_counter() - started:.1f} 秒。")
+    if failed:
+        print("重新執行相同的指令時，已完成的分區會直接略過。")
+        return 1
+    return merge_partitions(cfg, count, args.channel)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="cli.py backfill", description="分區平行回補頻道的歷史訊息")
+    parser.add_argument("--from-id", type=int, help="範圍起點的訊息 ID (含，預設 1)")
+    parser.add_argument("--to-id", type=int, help="範圍終點的訊息 ID (含，預設為頻道最新的訊息)")
+    parser.add_argument("--since", help="以日期指定範圍起點 (YYYY-MM-DD，台灣時間)")
+    parser.add_argument("--until", help="以日期指定範圍終點 (YYYY-MM-DD，含當天)")
+    parser.add_argument("--channel", help="要回補的頻道 (預設為主頻道)")
+    parser.add_argument("--workers", type=int, help="在本地啟動 N 個 worker process，完成後自動合併")
+    parser.add_argument("--task-index", type=int, help="只處理這個分區 (預設為 CLOUD_RUN_TASK_INDEX)")
+    parser.add_argument("--task-count", type=int, help="分區數 (預設為 CLOUD_RUN_TASK_COUNT)")
+    parser.add_argument("--merge", action="store_true", help="只合併已完成的分區並重新產生輸出檔案")
+    parser.add_argument("--rehost", action="store_true", help="不沿用圖片索引，重新下載並上傳所有圖片")
+    parser.add_argument("--fake-messages", type=int, help="改用 N 則假訊息與本地 ImgBB 替身 (本地測試用)")
+    args = parser.parse_args(argv)
+    if args.from_id and args.since or args.to_id and args.until:
+        parser.error("--from-id/--since 與 --to-id/--until 只能各擇一")
+
+    index, count = task_partition()
+    index = index if args.task_index is None else args.task_index
+    count = count if args.task_count is None else args.task_count
+    if not 0 <= index < count:
+        parser.error(f"分區編號 {index} 超出範圍 (共 {count} 個分區)")
+
+    config.load_env()
+    if args.fake_messages:
+        _fake_environment()
+    try:
+        cfg = config.ImporterConfig()
+        if args.merge:
+            return merge_partitions(cfg, args.task_count, args.channel)
+        if args.workers:
+            return _run_workers(args, cfg)
+        return _run_task(args, cfg, index, count)
+    except config.ConfigError as e:
+        print(f"錯誤：{e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,405 @@
+# bench_import.py
+# 離線壓測工具：不連線 Telegram 與 ImgBB，以合成的訊息跑完整的「匯入 → 合併 → 輸出」流程。
+#
+# 用法：
+#   python bench_import.py                         # 預設 2000、20000、200000 則
+#   python bench_import.py --sizes 2000,20000 --photo-ratio 0.3
+#
+# - 假的 Telegram 客戶端 (FakeTelegramClient) 依固定亂數種子產生文字與圖片混合的訊息
+# - 本地的 ImgBB 替身伺服器 (ImgbbStandIn) 走真正的 HTTP 上傳路徑 (media_pipeline.upload_to_imgbb)
+# - --channels N 同時匯入 N 個頻道 (共用一個假的客戶端，每個頻道各有 size 則訊息)，驗證多頻道的合併輸出
+# - --flood-wait-ratio / --throttle-ratio 讓部分下載拋出 FloodWait、部分上傳回應 HTTP 429，用於驗證重試與速率控制
+# - 每個規模在獨立的子程序與暫存目錄中執行，峰值 RSS 互不影響；
+#   先做一次完整匯入，再追加少量新訊息做一次增量匯入
+# 結果追加到 bench_results.jsonl，並與上一次相同設定的結果比較，方便看出匯入路徑的效能退步。
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+BENCH_RESULTS_FILE = os.getenv("BENCH_RESULTS_FILE", "bench_results.jsonl")
+DEFAULT_SIZES = "2000,20000,200000"
+
+# 合成文字使用的常用漢字 (含標點)，讓分詞、搜尋索引與 JSON 編碼的成本接近真實貼文
+_CHARS = "濟公活佛慈悲聖賢語錄道德仁義禮智信修心養性善惡因果天地人和平安喜樂光明智慧" \
+         "我們你他的是在有了不這個中大來上時說要就會也到可以對生能而子那得於著下自之年過發後作裡用" \
+         "，。！？、：「」"
+
+
+class FakePhoto:
+    def __init__(self, photo_id: int, content_key: int):
+        self.id = photo_id
+        self.content_key = content_key # 相同 content_key 的圖片內容相同 (模擬重複轉貼)
+
+
+class FakeMessage:
+    def __init__(self, msg_id: int, date, text: str, photo=None):
+        self.id = msg_id
+        self.date = date
+        self.text = text
+        self.photo = photo
+        self.edit_date = None
+
+
+class FakeFloodWaitError(Exception):
+    """與 telethon.errors.FloodWaitError 相同的介面 (類別名稱含 FloodWait，seconds 為需要等待的秒數)。"""
+
+    def __init__(self, seconds: int):
+        super().__init__(f"A wait of {seconds} seconds is required")
+        self.seconds = seconds
+
+
+class FakeTelegramClient:
+    """提供 everypy.main() 需要的 get_me / get_entity / iter_messages / get_messages / download_media。
+
+    訊息 ID 從 1 到 total，ID 越大越新 (從 first_date 起每小時一則)；內容由 (seed, 頻道, ID) 決定，
+    因此增加 total 只會追加新訊息，既有訊息完全不變。主頻道 (primary_channel) 的內容與單一頻道時相同。
+    """
+
+    primary_channel = "bench"
+
+    def __init__(self, total: int, photo_ratio: float = 0.3, duplicate_ratio: float = 0.1,
+                 image_bytes: int = 30_000, download_latency: float = 0.0, seed: int = 42,
+                 first_date=datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc), real_images: bool = False,
+                 flood_wait_ratio: float = 0.0):
+        self.total = total
+        self.photo_ratio = photo_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.image_bytes = image_bytes
+        self.download_latency = download_latency
+        self.seed = seed
+        self.first_date = first_date
+        self.real_images = real_images # True 時產生可解碼的 JPEG (需要 Pillow)，用於壓測衍生圖片
+        self.flood_wait_ratio = flood_wait_ratio # 下載時拋出 FakeFloodWaitError 的比例
+        self._flood_rng = random.Random(seed)
+        self.flood_waits = 0
+        self.downloads = 0
+        self.bytes_downloaded = 0
+
+    def _channel_number(self, entity) -> int:
+        """主頻道為 0，其他頻道依名稱得到固定的編號 (讓 photo id 與圖片內容在頻道之間不重複)。"""
+        if entity in (None, self.primary_channel):
+            return 0
+        return zlib.crc32(str(entity).encode("utf-8")) % 1000 + 1
+
+    def make_message(self, msg_id: int, entity=None) -> FakeMessage:
+        channel = self._channel_number(entity)
+        rng = random.Random((self.seed + channel) * 1_000_003 + msg_id)
+        date = self.first_date + datetime.timedelta(hours=msg_id, minutes=channel % 60)
+        text = "".join(rng.choices(_CHARS, k=rng.randint(30, 600)))
+        photo = None
+        if rng.random() < self.photo_ratio:
+            content_key = rng.randint(1, max(1, msg_id - 1)) if rng.random() < self.duplicate_ratio else msg_id
+            photo = FakePhoto(photo_id=channel * 100_000_000 + 10_000_000 + msg_id,
+                              content_key=channel * 100_000_000 + content_key)
+        return FakeMessage(msg_id, date, text, photo)
+
+    async def get_me(self):
+        return SimpleNamespace(first_name="bench", last_name=None, id=0)
+
+    async def get_entity(self, name):
+        return name
+
+    def _last_id_before(self, offset_date, entity) -> int:
+        """日期早於 offset_date 的最大訊息 ID (訊息 ID 的日期為 first_date + ID 小時 + 頻道的分鐘偏移)。"""
+        offset = offset_date - self.first_date - datetime.timedelta(minutes=self._channel_number(entity) % 60)
+        return max(0, math.ceil(offset.total_seconds() / 3600) - 1)
+
+    async def iter_messages(self, entity, min_id: int = 0, max_id: int = 0, reverse: bool = False,
+                            offset_date=None, limit: int = None):
+        # 與 Telethon 相同：min_id、max_id 皆不含本身，max_id 為 0 表示沒有上限；offset_date 只取更早的訊息
+        upper = min(self.total, max_id - 1) if max_id else self.total
+        if offset_date is not None:
+            upper = min(upper, self._last_id_before(offset_date, entity))
+        ids = range(min_id + 1, upper + 1) if reverse else range(upper, min_id, -1)
+        for msg_id in ids[:limit]:
+            yield self.make_message(msg_id, entity)
+
+    async def get_messages(self, entity, ids):
+        return [self.make_message(msg_id, entity) if 0 < msg_id <= self.total else None for msg_id in ids]
+
+    async def download_media(self, photo, file):
+        if self.flood_wait_ratio and self._flood_rng.random() < self.flood_wait_ratio:
+            self.flood_waits += 1
+            raise FakeFloodWaitError(1)
+        if self.download_latency:
+            await asyncio.sleep(self.download_latency)
+        if self.real_images:
+            data = self._jpeg(photo.content_key)
+        else:
+            header = f"fake-jpeg-{photo.content_key}-".encode("ascii")
+            data = (header * (self.image_bytes // len(header) + 1))[:self.image_bytes]
+        file.write(data)
+        self.downloads += 1
+        self.bytes_downloaded += len(data)
+        return file
+
+
+    def _jpeg(self, content_key: int) -> bytes:
+        from PIL import Image, ImageDraw
+        rng = random.Random(content_key)
+        image = Image.new("RGB", (1280, 960), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x, y = rng.randrange(1280), rng.randrange(960)
+            draw.ellipse((x, y, x + rng.randrange(50, 400), y + rng.randrange(50, 400)),
+                         fill=tuple(rng.randrange(256) for _ in range(3)))
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=85)
+        return buffer.getvalue()
+
+
+class ImgbbStandIn:
+    """本地的 ImgBB 上傳替身：接受 multipart 上傳並回傳與 ImgBB 相同格式的 JSON。"""
+
+    def __init__(self, latency: float = 0.0, throttle_ratio: float = 0.0, seed: int = 42):
+        stand_in = self
+        self.uploads = 0
+        self.bytes_uploaded = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        rng = random.Random(seed)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if latency:
+                    time.sleep(latency)
+                with stand_in._lock:
+                    throttle = throttle_ratio and rng.random() < throttle_ratio
+                    if throttle:
+                        stand_in.throttled += 1
+                if throttle:
+                    # 與 ImgBB 被限流時相同：HTTP 429 並附上 Retry-After
+                    self.send_response(429)
+                    self.send_header("Retry-After", "1")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                with stand_in._lock:
+                    stand_in.uploads += 1
+                    stand_in.bytes_uploaded += len(body)
+                    n = stand_in.uploads
+                payload = json.dumps({"success": True, "data": {"url": f"https://i.ibb.co/bench/{n}.jpg"}})
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload.encode("utf-8"))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/1/upload"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def peak_rss_mb() -> float:
+    """本程序的峰值常駐記憶體 (MB)。Linux 的 ru_maxrss 單位為 KB，macOS 為位元組。"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_single(args) -> dict:
+    """在暫存目錄中執行一個規模的完整匯入與增量匯入 (於子程序中呼叫)。"""
+    with tempfile.TemporaryDirectory(prefix="bench_import_") as workdir, \
+            ImgbbStandIn(latency=args.upload_latency, throttle_ratio=args.throttle_ratio, seed=args.seed) as stand_in:
+        os.chdir(workdir)
+        # everypy.main() 從環境變數建立 config.ImporterConfig，因此先設定好環境變數
+        os.environ["IMGBB_UPLOAD_URL"] = stand_in.url
+        os.environ.setdefault("CHANNEL_USERNAME", FakeTelegramClient.primary_channel)
+        if args.channels > 1:
+            os.environ["CHANNEL_USERNAMES"] = ",".join(
+                [FakeTelegramClient.primary_channel] + [f"bench_{i}" for i in range(2, args.channels + 1)])
+        os.environ["IMAGE_DERIVATIVES"] = "1" if args.derivatives else "0"
+        os.environ.setdefault("RUN_METRICS_FILE", os.path.join(workdir, "run_metrics.jsonl"))
+        # 壓測量的是匯入路徑本身的吞吐量，預設不限速 (被注入的 FloodWait / 429 仍會觸發暫停與重試)
+        os.environ.setdefault("TELEGRAM_REQUESTS_PER_SECOND", "0")
+        os.environ.setdefault("IMGBB_REQUESTS_PER_SECOND", "0")
+        # 不會上傳到真正的 bucket：只有設定 STORAGE_EMULATOR_HOST 時才同步到本地的 GCS 替身 (量測 upload_outputs 階段)
+        if not os.environ.get("STORAGE_EMULATOR_HOST"):
+            os.environ["STORAGE_BUCKET_NAME"] = ""
+        # 每次壓測都從空的暫存目錄開始，不從 bucket 取回狀態檔
+        os.environ["STATE_BUCKET_NAME"] = ""
+        # Firestore 同樣只在設定 FIRESTORE_EMULATOR_HOST 時才同步 (到本地模擬器)
+        if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+            os.environ["FIRESTORE_SYNC"] = "0"
+        import everypy
+
+        client = FakeTelegramClient(
+            args.single, photo_ratio=args.photo_ratio, duplicate_ratio=args.duplicate_ratio,
+            image_bytes=args.image_bytes, download_latency=args.download_latency, seed=args.seed,
+            real_images=args.derivatives, flood_wait_ratio=args.flood_wait_ratio,
+        )
+        runs = {}
+        for phase, total in (("full", args.single), ("incremental", args.single + args.incremental)):
+            client.total = total
+            downloads_before, uploads_before = client.downloads, stand_in.uploads
+            with open(os.path.join(workdir, f"{phase}.log"), "w", encoding="utf-8") as log, \
+                    contextlib.redirect_stdout(log):
+                started = time.perf_counter()
+                report = asyncio.run(everypy.main(client))
+                wall = time.perf_counter() - started
+            processed = report["counters"].get("posts_processed", 0)
+            runs[phase] = {
+                "ok": report["ok"],
+                "processed": processed,
+                "total_posts": report["info"].get("total_posts"),
+                "wall_seconds": round(wall, 3),
+                "posts_per_second": round(processed / wall, 1) if wall > 0 else None,
+                "downloads": client.downloads - downloads_before,
+                "uploads": stand_in.uploads - uploads_before,
+                "retries": {name: value for name, value in report["counters"].items()
+                            if name.endswith(("_retries", "_flood_waits", "_rate_limited")) or name == "images_failed"},
+                "stages": report["stages"],
+                "timers": report["timers"],
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        sizes = {name: os.path.getsize(os.path.join(workdir, name))
+                 for name in ("posts.json", "posts.db", "search-index.json") if os.path.exists(os.path.join(workdir, name))}
+    return {"size": args.single, "runs": runs, "artifact_bytes": sizes}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(path: str, params: dict) -> dict:
+    """讀取結果檔，返回每個規模在相同參數下最近一次的結果。"""
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("params") == params:
+                previous[record["size"]] = record
+    return previous
+
+
+def _change(current, before):
+    if not current or not before:
+        return ""
+    return f"{(current - before) / before * 100:+.1f}%"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="離線壓測 everypy 的匯入 → 合併 → 輸出流程")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"以逗號分隔的訊息數 (預設 {DEFAULT_SIZES})")
+    parser.add_argument("--photo-ratio", type=float, default=0.3, help="含圖片的訊息比例")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1, help="圖片內容與較早訊息重複的比例")
+    parser.add_argument("--image-bytes", type=int, default=30_000, help="每張假圖片的大小")
+    parser.add_argument("--incremental", type=int, default=100, help="完整匯入後再追加的新訊息數")
+    parser.add_argument("--download-latency", type=float, default=0.0, help="每次下載的模擬延遲 (秒)")
+    parser.add_argument("--upload-latency", type=float, default=0.0, help="每次上傳的模擬延遲 (秒)")
+    parser.add_argument("--channels", type=int, default=1, help="同時匯入的頻道數 (每個頻道各有 size 則訊息)")
+    parser.add_argument("--flood-wait-ratio", type=float, default=0.0, help="下載時模擬 FloodWait (1 秒) 的比例")
+    parser.add_argument("--throttle-ratio", type=float, default=0.0, help="上傳時模擬 HTTP 429 (Retry-After 1 秒) 的比例")
+    parser.add_argument("--derivatives", action="store_true",
+                        help="下載可解碼的 JPEG 並產生衍生圖片 (需要 Pillow；--image-bytes 不適用)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--results", default=BENCH_RESULTS_FILE, help="結果檔 (JSON lines，追加寫入)")
+    parser.add_argument("--regression-threshold", type=float, default=0.15,
+                        help="吞吐量下降或峰值 RSS 上升超過此比例時視為退步")
+    parser.add_argument("--fail-on-regression", action="store_true", help="有退步時以結束碼 1 結束")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS) # 子程序內部使用
+    argv = sys.argv[1:] if argv is None else list(argv)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        result = run_single(args)
+        print(json.dumps(result, ensure_ascii=False))
+        return 0
+
+    params = {
+        "photo_ratio": args.photo_ratio, "duplicate_ratio": args.duplicate_ratio, "image_bytes": args.image_bytes,
+        "incremental": args.incremental, "download_latency": args.download_latency,
+        "upload_latency": args.upload_latency, "seed": args.seed, "derivatives": args.derivatives,
+    }
+    # 只有啟用錯誤注入時才記錄這兩個參數，讓既有的結果仍能作為比較基準
+    if args.flood_wait_ratio or args.throttle_ratio:
+        params.update({"flood_wait_ratio": args.flood_wait_ratio, "throttle_ratio": args.throttle_ratio})
+    if args.channels > 1:
+        params["channels"] = args.channels
+    previous = load_previous(args.results, params)
+    regressions = []
+    script = os.path.abspath(__file__)
+
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        print(f"正在壓測 {size} 則訊息...", flush=True)
+        proc = subprocess.run([sys.executable, script, *argv, "--single", str(size)],
+                              capture_output=True, text=True, cwd=os.path.dirname(script))
+        if proc.returncode != 0:
+            print(f"錯誤：{size} 則訊息的壓測失敗：\n{proc.stderr}")
+            return 1
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        record = {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "params": params,
+            **result,
+        }
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        before = previous.get(size)
+        for phase, run in record["runs"].items():
+            old = before["runs"].get(phase) if before else None
+            stages = "  ".join(f"{name} {seconds:.2f}s" for name, seconds in run["stages"].items())
+            print(f"  [{phase}] {run['processed']} 則，{run['wall_seconds']:.2f} 秒，"
+                  f"{run['posts_per_second']} 則/秒 {_change(run['posts_per_second'], old and old['posts_per_second'])}，"
+                  f"峰值 RSS {run['peak_rss_mb']} MB {_change(run['peak_rss_mb'], old and old['peak_rss_mb'])}")
+            print(f"      {stages}")
+            if any(run.get("retries", {}).values()):
+                print("      " + "  ".join(f"{name} {value}" for name, value in run["retries"].items()))
+            if old and run["posts_per_second"] and old["posts_per_second"]:
+                if run["posts_per_second"] < old["posts_per_second"] * (1 - args.regression_threshold):
+                    regressions.append(f"{size}/{phase} 吞吐量")
+                if run["peak_rss_mb"] > old["peak_rss_mb"] * (1 + args.regression_threshold):
+                    regressions.append(f"{size}/{phase} 峰值 RSS")
+
+    print(f"結果已追加到 {args.results}。")
+    if regressions:
+        print(f"警告：與上一次相同設定的結果相比有退步：{'、'.join(regressions)}")
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# cli.py
+# 所有工作的單一進入點：
+#   python cli.py import          從 Telegram 匯入並更新所有輸出檔案 (Cloud Run Job)
+#   python cli.py sort            以貼文資料庫為準重新輸出 posts.json
+#   python cli.py export          互動式登入 Telegram，印出 StringSession
+#   python cli.py push            以最新一則貼文觸發手動推播
+#   python cli.py bench [...]     離線匯入壓測 (參數同 bench_import.py)
+#   python cli.py backfill [...]  分區平行回補歷史訊息並合併 (參數見 backfill.py)
+#   python cli.py startup-check   量測每個工作從程序啟動到可以開始工作的時間，超過預算時以結束碼 1 結束
+#
+# 本檔案只 import 標準函式庫；各子命令的模組 (以及 Telethon、requests 等套件) 在執行該子命令時才載入，
+# 讓容器冷啟動時只付出實際工作需要的 import 成本。
+
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# 子命令 → (模組, 說明)
+COMMANDS = {
+    "import": ("everypy", "從 Telegram 匯入並更新所有輸出檔案"),
+    "sort": ("sort_posts", "以貼文資料庫為準重新輸出 posts.json"),
+    "export": ("export_session", "互動式登入 Telegram，印出 StringSession"),
+    "push": ("manual_push", "以最新一則貼文觸發手動推播"),
+    "bench": ("bench_import", "離線匯入壓測 (其餘參數交給 bench_import.py)"),
+    "backfill": ("backfill", "分區平行回補歷史訊息並合併 (其餘參數交給 backfill.py)"),
+}
+
+# startup-check 量測的對象：名稱 → (模組, 啟動時允許載入的重量級套件)
+# 常駐的觸發服務 (app.py) 必須載入 Flask 才能接收請求，其餘都應該延後到真正需要時。
+STARTUP_TARGETS = {
+    "import": ("everypy", ()),
+    "sort": ("sort_posts", ()),
+    "export": ("export_session", ()),
+    "push": ("manual_push", ()),
+    "backfill": ("backfill", ()),
+    "service": ("app", ("flask",)),
+}
+HEAVY_MODULES = ("telethon", "requests", "firebase_admin", "google.cloud", "PIL", "flask")
+# 每個工作從程序啟動到完成 import 的時間預算 (毫秒，包含直譯器本身的啟動時間)
+STARTUP_BUDGET_MS = int(os.getenv("STARTUP_BUDGET_MS", "400"))
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import cli
+cli.prepare({module!r})
+print(json.dumps({{
+    "import_ms": (time.perf_counter() - started) * 1000,
+    "heavy": [name for name in cli.HEAVY_MODULES if name in sys.modules],
+}}))
+"""
+
+
+def prepare(module: str) -> None:
+    """只 import 工作模組而不執行 (startup-check 在全新的直譯器中呼叫)。"""
+    importlib.import_module(module)
+
+
+def _run_command(name: str, extra) -> int:
+    module = importlib.import_module(COMMANDS[name][0])
+    if name == "import":
+        report = module.run()
+        return 0 if report and report.get("ok") else 1
+    if name in ("bench", "backfill"):
+        return module.main(extra)
+    return module.main() or 0
+
+
+def startup_check(budget_ms: int = STARTUP_BUDGET_MS, repeat: int = 3, targets=None) -> int:
+    """在全新的直譯器中量測每個工作的啟動時間 (取中位數) 與啟動時載入的重量級套件。"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    failures = []
+    results = {}
+    for name in targets or STARTUP_TARGETS:
+        module, allowed_heavy = STARTUP_TARGETS[name]
+        walls, imports, heavy = [], [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            proc = subprocess.run([sys.executable, "-c", _PROBE.format(module=module)],
+                                  capture_output=True, text=True, cwd=here)
+            wall_ms = (time.perf_counter() - started) * 1000
+            if proc.returncode != 0:
+                print(f"錯誤：無法載入 {module}：\n{proc.stderr}")
+                failures.append(f"{name} 無法載入")
+                break
+            probe = json.loads(proc.stdout.strip().splitlines()[-1])
+            walls.append(wall_ms)
+            imports.append(probe["import_ms"])
+            heavy = probe["heavy"]
+        if not walls:
+            continue
+
+        wall_ms, import_ms = statistics.median(walls), statistics.median(imports)
+        unexpected = [mod for mod in heavy if mod not in allowed_heavy]
+        results[name] = {"module": module, "startup_ms": round(wall_ms, 1), "import_ms": round(import_ms, 1),
+                         "heavy_modules": heavy}
+        status = "OK"
+        if wall_ms > budget_ms:
+            status = "超過預算"
+            failures.append(f"{name} 啟動 {wall_ms:.0f} ms")
+        if unexpected:
+            status = "啟動時載入了重量級套件"
+            failures.append(f"{name} 載入 {', '.join(unexpected)}")
+        print(f"  {name:<8} {module:<15} 啟動 {wall_ms:7.1f} ms (import {import_ms:6.1f} ms)  "
+              f"{'、'.join(heavy) or '-':<16} {status}")
+
+    print(json.dumps({"budget_ms": budget_ms, "results": results}, ensure_ascii=False))
+    if failures:
+        print(f"警告：以下工作未通過啟動檢查 (預算 {budget_ms} ms)：{'、'.join(failures)}")
+        return 1
+    print(f"所有工作的啟動時間都在 {budget_ms} ms 的預算內。")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="cli.py", description="濟公報的匯入、發布與維護工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    passthrough = ("bench", "backfill")
+    for name, (_, help_text) in COMMANDS.items():
+        # bench 與 backfill 的參數 (包含 -h) 全部交給 bench_import.py / backfill.py 解析
+        subparsers.add_parser(name, help=help_text, add_help=name not in passthrough)
+    check = subparsers.add_parser("startup-check", help="量測每個工作的啟動時間並與預算比較")
+    check.add_argument("--budget-ms", type=int, default=STARTUP_BUDGET_MS,
+                       help=f"啟動時間預算 (毫秒，預設 {STARTUP_BUDGET_MS}，可用 STARTUP_BUDGET_MS 設定)")
+    check.add_argument("--repeat", type=int, default=3, help="每個工作量測的次數 (取中位數)")
+    check.add_argument("targets", nargs="*", help=f"只檢查這些工作 ({', '.join(STARTUP_TARGETS)})")
+    args, extra = parser.parse_known_args(argv)
+    if extra and args.command not in passthrough:
+        parser.error(f"無法識別的參數：{' '.join(extra)}")
+
+    if args.command == "startup-check":
+        unknown = [name for name in args.targets if name not in STARTUP_TARGETS]
+        if unknown:
+            parser.error(f"未知的工作：{', '.join(unknown)}")
+        return startup_check(args.budget_ms, max(1, args.repeat), args.targets or None)
+
+    import config
+    try:
+        return _run_command(args.command, extra)
+    except config.ConfigError as e:
+        print(f"錯誤：{e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
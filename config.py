@@ -0,0 +1,239 @@
+# config.py
+# 所有腳本共用的設定：集中從環境變數 (與 .env 檔案) 讀取，建立明確的設定物件，
+# 取代各腳本在 import 時各自呼叫 load_dotenv、檢查變數並 exit(1) 的做法。
+#
+# 本模組與它 import 的專案模組都只依賴標準函式庫 (python-dotenv 在 load_env() 中才載入)，
+# 讓 cli.py 與 app.py 啟動時不必付出 Telethon、requests 等套件的 import 成本。
+
+import os
+import re
+
+import delta_feed
+import export_shards
+import firestore_sync
+import gcs_sync
+import image_cache
+import import_state
+import post_store
+import publish_artifacts
+import run_metrics
+import search_index
+import state_sync
+
+_env_loaded = False
+
+
+class ConfigError(Exception):
+    """必要的設定缺少或格式錯誤。"""
+
+
+def load_env() -> None:
+    """載入 .env 檔案 (每個程序只載入一次；未安裝 python-dotenv 時略過)。"""
+    global _env_loaded
+    if _env_loaded:
+        return
+    _env_loaded = True
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
+
+
+def _int(environ, name: str, default: int) -> int:
+    value = environ.get(name, "")
+    try:
+        return int(value) if value.strip() else default
+    except ValueError:
+        raise ConfigError(f"{name} 必須是整數 (目前為 '{value}')。")
+
+
+def _float(environ, name: str, default: float) -> float:
+    value = environ.get(name, "")
+    try:
+        return float(value) if value.strip() else default
+    except ValueError:
+        raise ConfigError(f"{name} 必須是數字 (目前為 '{value}')。")
+
+
+def telegram_credentials(environ=None):
+    """讀取 TELEGRAM_API_ID (整數) 與 TELEGRAM_API_HASH；缺少或格式錯誤時拋出 ConfigError。"""
+    environ = os.environ if environ is None else environ
+    api_id, api_hash = environ.get("TELEGRAM_API_ID"), environ.get("TELEGRAM_API_HASH")
+    if not all([api_id, api_hash]):
+        raise ConfigError("請在 .env 文件或系統環境變數中設定 TELEGRAM_API_ID 和 TELEGRAM_API_HASH。")
+    try:
+        return int(api_id), api_hash
+    except ValueError:
+        raise ConfigError("TELEGRAM_API_ID 必須是有效的數字。請檢查 .env 文件或環境變數中的值。")
+
+
+class ChannelConfig:
+    """單一頻道的資料檔案：貼文資料庫、watermark 狀態檔，以及該頻道自己的分片與 latest.json。
+
+    主頻道 (第一個頻道) 的資料庫與狀態檔沿用原本的位置，既有的部署不需要搬移資料；
+    其他頻道的檔案放在 <CHANNELS_DIR>/<slug>/ 下。
+    """
+
+    def __init__(self, username: str, primary: bool, channels_dir: str, post_store_file: str, import_state_file: str):
+        self.username = username
+        self.primary = primary
+        # 目錄名稱與合併輸出中 channel 欄位的值 (Telegram 使用者名稱只含英數字與底線)
+        self.slug = re.sub(r"[^A-Za-z0-9_-]", "_", username.rsplit("/", 1)[-1].lstrip("@")) or "channel"
+        channel_dir = os.path.join(channels_dir, self.slug)
+        self.post_store_file = post_store_file if primary else os.path.join(channel_dir, "posts.db")
+        self.import_state_file = import_state_file if primary else os.path.join(channel_dir, "import_state.json")
+        self.shards_dir = os.path.join(channel_dir, export_shards.SHARDS_DIR)
+        self.latest_json_file = os.path.join(channel_dir, export_shards.LATEST_JSON_FILE)
+
+    @property
+    def tag(self):
+        """合併輸出中標記貼文來源的 channel 欄位；主頻道的貼文不加此欄位，輸出與單一頻道時相同。"""
+        return None if self.primary else self.slug
+
+
+class ImporterConfig:
+    """everypy 匯入流程的設定。建立時讀取環境變數，之後不再變動。"""
+
+    REQUIRED = ("TELEGRAM_API_ID", "TELEGRAM_API_HASH", "IMGBB_API_KEY", "CHANNEL_USERNAME")
+
+    def __init__(self, environ=None):
+        env = os.environ if environ is None else environ
+        self._environ = env
+        self.api_hash = env.get("TELEGRAM_API_HASH")
+        self.imgbb_api_key = env.get("IMGBB_API_KEY")
+        # 要匯入的頻道：CHANNEL_USERNAMES (以逗號分隔) 優先，否則為 CHANNEL_USERNAME；第一個為主頻道
+        usernames = [name.strip() for name in env.get("CHANNEL_USERNAMES", "").split(",") if name.strip()]
+        if not usernames and env.get("CHANNEL_USERNAME"):
+            usernames = [env.get("CHANNEL_USERNAME")]
+        usernames = list(dict.fromkeys(usernames))
+        self.channel_username = usernames[0] if usernames else None
+        # 非主頻道的資料庫、狀態檔與分片所在的目錄
+        self.channels_dir = env.get("CHANNELS_DIR", "channels")
+
+        self.output_json_file = "posts.json"
+        # 貼文資料庫 (SQLite)：所有輸出檔案的唯一資料來源，第一次運行時會從既有的 posts.json 匯入
+        self.post_store_file = env.get("POST_STORE_FILE", post_store.POST_STORE_FILE)
+
+        # 按月分片的輸出目錄 (內含 manifest.json)，以及只含最新 N 則貼文的 latest.json
+        self.shards_dir = env.get("SHARDS_DIR", export_shards.SHARDS_DIR)
+        self.latest_json_file = env.get("LATEST_JSON_FILE", export_shards.LATEST_JSON_FILE)
+        self.latest_posts_count = _int(env, "LATEST_POSTS_COUNT", 20)
+        # 前端搜尋使用的 bigram 倒排索引
+        self.search_index_file = env.get("SEARCH_INDEX_FILE", search_index.SEARCH_INDEX_FILE)
+        # 版本號與增量更新：version.json、deltas/<N>.json，以及比對用的 delta_state.json (不對外發布)
+        self.version_json_file = env.get("VERSION_JSON_FILE", delta_feed.VERSION_JSON_FILE)
+        self.delta_dir = env.get("DELTA_DIR", delta_feed.DELTA_DIR)
+        self.delta_state_file = env.get("DELTA_STATE_FILE", delta_feed.DELTA_STATE_FILE)
+        self.delta_retention = _int(env, "DELTA_RETENTION", 100)
+        # 內容雜湊的不可變發布產物 (緊湊 JSON + gzip/brotli) 與指標檔 current.json；設為空字串即停用
+        self.publish_dir = env.get("PUBLISH_DIR", publish_artifacts.PUBLISH_DIR)
+        self.publish_retention = _int(env, "PUBLISH_RETENTION", publish_artifacts.DEFAULT_RETENTION)
+        # 匯出後把輸出檔案同步到 Cloud Storage bucket (未設定時只寫本地檔案)、物件名稱前綴與平行上傳數；
+        # 設定 STORAGE_EMULATOR_HOST 時連到本地的 GCS 相容替身
+        self.storage_bucket_name = env.get("STORAGE_BUCKET_NAME", "")
+        self.storage_object_prefix = env.get("STORAGE_OBJECT_PREFIX", "")
+        self.storage_upload_concurrency = _int(env, "STORAGE_UPLOAD_CONCURRENCY", gcs_sync.DEFAULT_UPLOAD_CONCURRENCY)
+        # 狀態檔 (貼文資料庫、watermark、圖片索引、delta 與 Firestore 同步狀態) 保存在這個 bucket 的物件名稱前綴下
+        # (預設與輸出相同的 bucket；輸出 bucket 公開時建議另外指定不公開的 bucket)。
+        # Cloud Run 的本地磁碟不會保留到下一次運行，因此運行開始時下載、checkpoint 與結束時上傳；設為空字串即只使用本地檔案
+        self.state_bucket_name = env.get("STATE_BUCKET_NAME", self.storage_bucket_name)
+        self.state_object_prefix = env.get("STATE_OBJECT_PREFIX", state_sync.STATE_OBJECT_PREFIX)
+        self.state_sync_interval_seconds = _float(env, "STATE_SYNC_INTERVAL_SECONDS",
+                                                  state_sync.DEFAULT_SYNC_INTERVAL_SECONDS)
+        # 增量同步到 Firestore (設為 1 啟用)：只寫入 content_hash 改變的貼文，上一次的雜湊保存在狀態檔；
+        # BulkWriter 從每秒 FIRESTORE_INITIAL_OPS_PER_SECOND 次寫入開始，每 5 分鐘增加 50% 直到上限
+        self.firestore_sync = env.get("FIRESTORE_SYNC", "0") == "1"
+        self.firestore_collection = env.get("FIRESTORE_COLLECTION", firestore_sync.FIRESTORE_COLLECTION)
+        self.firestore_sync_state_file = env.get("FIRESTORE_SYNC_STATE_FILE", firestore_sync.FIRESTORE_SYNC_STATE_FILE)
+        self.firestore_initial_ops_per_second = _int(env, "FIRESTORE_INITIAL_OPS_PER_SECOND",
+                                                     firestore_sync.DEFAULT_INITIAL_OPS_PER_SECOND)
+        self.firestore_max_ops_per_second = _int(env, "FIRESTORE_MAX_OPS_PER_SECOND",
+                                                 firestore_sync.DEFAULT_MAX_OPS_PER_SECOND)
+
+        # 媒體管線併發上限：每個頻道同時進行中的下載數與上傳數
+        self.download_concurrency = _int(env, "DOWNLOAD_CONCURRENCY", 4)
+        self.upload_concurrency = _int(env, "UPLOAD_CONCURRENCY", 4)
+        # 可覆寫 ImgBB 上傳端點 (例如指向本地的 HTTP 替身伺服器做測試)；None 表示使用 media_pipeline 的預設端點
+        self.imgbb_upload_url = env.get("IMGBB_UPLOAD_URL")
+        # 每個上游的初始請求速率 (每秒，0 表示不限速)；成功時逐步加速到 4 倍，被限流時減半
+        self.telegram_requests_per_second = _float(env, "TELEGRAM_REQUESTS_PER_SECOND", 5)
+        self.imgbb_requests_per_second = _float(env, "IMGBB_REQUESTS_PER_SECOND", 2)
+        # 暫時性錯誤與限流的重試：最多嘗試次數、指數退避的基準秒數，
+        # 以及願意等待的最長 FloodWait / Retry-After (更長時放棄，留到下次運行重試)
+        self.retry_max_attempts = _int(env, "RETRY_MAX_ATTEMPTS", 5)
+        self.retry_base_delay = _float(env, "RETRY_BASE_DELAY", 1.0)
+        self.flood_wait_max_seconds = _float(env, "FLOOD_WAIT_MAX_SECONDS", 300)
+        # 圖片失敗的訊息最多在幾次運行中重新處理
+        self.image_retry_runs = _int(env, "IMAGE_RETRY_RUNS", 10)
+        # 每累積 N 則訊息或每隔 N 秒，把處理完成的貼文寫入資料庫並推進 watermark
+        self.checkpoint_every = _int(env, "CHECKPOINT_EVERY", 200)
+        self.checkpoint_interval_seconds = _float(env, "CHECKPOINT_INTERVAL_SECONDS", 30)
+
+        # 匯入進度 (watermark) 檔案：記錄已處理的最大訊息 ID 與最近訊息的 edit_date
+        self.import_state_file = env.get("IMPORT_STATE_FILE", import_state.IMPORT_STATE_FILE)
+        # 每次額外回看 watermark 之前的訊息數，用於偵測最近貼文的編輯
+        self.edit_lookback_messages = _int(env, "EDIT_LOOKBACK_MESSAGES", 20)
+        # 回補模式 (backfill.py) 的分區：只處理這個訊息 ID 範圍 (含兩端)，不輸出任何檔案；一般匯入為 None
+        self.message_id_range = None
+        # 回補的部分分片與完成標記 (所有分區與合併步驟共用，Cloud Run 上應掛載 Cloud Storage volume)，
+        # 以及每個分區自己的工作目錄 (SQLite 資料庫、watermark、圖片索引，放在本地磁碟)
+        self.backfill_dir = env.get("BACKFILL_DIR", "backfill")
+        self.backfill_work_dir = env.get("BACKFILL_WORK_DIR", "backfill_work")
+
+        # 圖片索引 (photo id / 內容雜湊 → 圖片 URL)，以及其數量上限與存活天數
+        self.image_index_file = env.get("IMAGE_INDEX_FILE", image_cache.IMAGE_INDEX_FILE)
+        self.image_index_max_entries = _int(env, "IMAGE_INDEX_MAX_ENTRIES", 20000)
+        self.image_index_max_age_days = _float(env, "IMAGE_INDEX_MAX_AGE_DAYS", 365)
+
+        # 衍生圖片：為新下載的圖片產生縮圖/中尺寸版本與 BlurHash (需要 Pillow，設為 0 可停用)
+        self.image_derivatives = env.get("IMAGE_DERIVATIVES", "1") != "0"
+        # 衍生圖片的格式，以逗號分隔 (webp、jpeg)；由 image_derivatives.parse_formats 解析
+        self.image_derivative_formats = env.get("IMAGE_DERIVATIVE_FORMATS", "webp")
+        # 縮放圖片的 process pool 大小
+        self.image_derivative_workers = _int(env, "IMAGE_DERIVATIVE_WORKERS", os.cpu_count() or 1)
+
+        # 運行報告：每次運行追加一行 JSON，並覆寫 OpenMetrics 文字檔 (設為空字串即不輸出)
+        self.run_metrics_file = env.get("RUN_METRICS_FILE", run_metrics.RUN_METRICS_FILE)
+        self.run_metrics_openmetrics_file = env.get("RUN_METRICS_OPENMETRICS_FILE", run_metrics.OPENMETRICS_FILE)
+        # 單次運行的效能分析："cprofile" 或 "tracemalloc"，未設定則不啟用
+        self.run_profile = env.get("RUN_PROFILE", "")
+        self.run_profile_dir = env.get("RUN_PROFILE_DIR", ".")
+
+        self.channels = [
+            ChannelConfig(username, i == 0, self.channels_dir, self.post_store_file, self.import_state_file)
+            for i, username in enumerate(usernames)
+        ]
+
+    def missing(self):
+        """返回尚未設定的必要環境變數名稱。"""
+        return [name for name in self.REQUIRED if not self._environ.get(name)
+                and not (name == "CHANNEL_USERNAME" and self.channel_username)]
+
+    def require(self) -> int:
+        """確認必要的設定都存在，返回整數型態的 TELEGRAM_API_ID；否則拋出 ConfigError。"""
+        missing = self.missing()
+        if missing:
+            raise ConfigError("請確保已在 .env 文件或系統環境變數中設定以下所有必要變數："
+                              + "、".join(missing))
+        return telegram_credentials(self._environ)[0]
+
+
+class PushConfig:
+    """manual_push 的設定。"""
+
+    def __init__(self, environ=None):
+        env = os.environ if environ is None else environ
+        # posts.json 的公開 URL (everypy.py 成功執行後上傳到 Firebase Storage 的檔案)
+        self.posts_json_url = env.get("POSTS_JSON_URL")
+        # 只含最新 N 則貼文的 latest.json；推播只需要第一則貼文，未設定時依 POSTS_JSON_URL 推算
+        self.latest_json_url = env.get("LATEST_JSON_URL")
+        if not self.latest_json_url and self.posts_json_url and self.posts_json_url.endswith("posts.json"):
+            self.latest_json_url = self.posts_json_url[:-len("posts.json")] + "latest.json"
+        # Cloud Function API 與 PWA 網站的基礎 URL
+        self.cloud_function_base_url = env.get("CLOUD_FUNCTION_BASE_URL")
+        self.pwa_base_url = env.get("PWA_BASE_URL")
+
+    def require(self) -> None:
+        if not all([self.posts_json_url, self.cloud_function_base_url, self.pwa_base_url]):
+            raise ConfigError("請確保您的 .env 檔案中包含了 POSTS_JSON_URL, CLOUD_FUNCTION_BASE_URL 和 PWA_BASE_URL。")
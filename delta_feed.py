@@ -0,0 +1,181 @@
+# delta_feed.py
+# 版本化的增量更新 (delta) 發布：
+#   version.json        目前的歸檔版本號 (單調遞增)、完整內容的 SHA-256、可用的最舊 delta 版本
+#   deltas/<N>.json     從版本 N-1 到 N 新增或編輯的貼文，以及被刪除貼文的 post_key (見 post_store.post_key)
+# 持有版本 N 的客戶端 (或 Service Worker 的背景同步) 只需先讀 version.json (幾百位元組)，
+# 再依序套用 deltas/<N+1>.json ... 即可得到最新內容，不必重新下載整個 posts.json。
+#
+# 比對上一版內容用的「每篇貼文指紋」保存在不對外發布的 delta_state.json 中。
+# 版本號永遠不會倒退：delta_state.json 遺失或落後於已發布的 version.json (本地或呼叫端提供的遠端版本) 時，
+# 新版本接在已發布的版本之後，但因為沒有可靠的比較基準而不產生 delta (min_delta_version 從下一版開始)，
+# 持有舊版本的客戶端改為下載完整歸檔。
+
+import hashlib
+import json
+import os
+import datetime
+
+from post_store import output_order_key, post_key
+
+VERSION_JSON_FILE = "version.json"
+DELTA_DIR = "deltas"
+DELTA_STATE_FILE = "delta_state.json"
+DELTA_FORMAT_VERSION = 1
+
+
+def serialize_posts(posts) -> bytes:
+    return json.dumps(posts, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def archive_hash(posts) -> str:
+    """完整歸檔 (依輸出順序) 的 SHA-256，客戶端套用 delta 後可用來驗證結果。"""
+    return hashlib.sha256(serialize_posts(posts)).hexdigest()
+
+
+def post_signature(post) -> str:
+    return hashlib.sha256(serialize_posts(post)).hexdigest()[:16]
+
+
+def sort_posts(posts):
+    """與 posts.json 相同的順序：日期降序，日期相同則 ID 降序。"""
+    return sorted(posts, key=output_order_key, reverse=True)
+
+
+def _write_json(path: str, data, compact: bool = True) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        if compact:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        else:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _load_json(path: str, default=None):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        print(f"警告：{path} 不是有效的 JSON，將視為不存在。")
+        return default
+
+
+def compute_delta(previous_signatures: dict, posts):
+    """比對上一版的指紋，返回 (upserts, removed_ids, signatures, archive_sha256)。
+
+    posts 可以是任何依輸出順序排列的可迭代物件，只會走訪一次；
+    完整歸檔的雜湊以串流方式計算，結果與 archive_hash(list(posts)) 相同。
+    """
+    signatures = {}
+    upserts = []
+    hasher = hashlib.sha256(b"[")
+    for post in posts:
+        if signatures:
+            hasher.update(b",")
+        data = serialize_posts(post)
+        hasher.update(data)
+        key = str(post_key(post))
+        signatures[key] = post_signature(post)
+        if previous_signatures.get(key) != signatures[key]:
+            upserts.append(post)
+    hasher.update(b"]")
+    removed = [int(key) if key.isdigit() else key for key in previous_signatures if key not in signatures]
+    return upserts, removed, signatures, hasher.hexdigest()
+
+
+def published_version(version_path: str = VERSION_JSON_FILE) -> int:
+    """version.json 中的版本號 (檔案不存在時為 0)。"""
+    return int((_load_json(version_path) or {}).get("version") or 0)
+
+
+def publish(posts, version_path: str = VERSION_JSON_FILE, delta_dir: str = DELTA_DIR,
+            state_path: str = DELTA_STATE_FILE, retention: int = 100, remote_version: int = 0) -> dict:
+    """比對上一版並在內容有變化時發布新版本。
+
+    posts 須為最終輸出順序 (與 posts.json 相同)，可以是串流 (例如 PostStore.iter_posts())。
+    remote_version 為已經對外發布的版本號 (例如 bucket 中的 version.json)，新版本一定大於它。
+    沒有任何變化時不寫入任何檔案。返回 {"version", "changed", "upserts", "removed", "baseline_lost"}。
+    """
+    state = _load_json(state_path, {}) or {}
+    previous_version = int(state.get("version") or 0)
+    latest_version = max(remote_version, published_version(version_path))
+    # 比對基準與已發布的版本不一致 (例如全新的容器沒有 delta_state.json)：不能據此產生 delta
+    baseline_lost = latest_version > previous_version
+    previous_signatures = {} if baseline_lost else state.get("signatures") or {}
+    upserts, removed, signatures, digest = compute_delta(previous_signatures, posts)
+
+    if previous_version and not baseline_lost and not upserts and not removed and state.get("sha256") == digest:
+        return {"version": previous_version, "changed": False, "upserts": 0, "removed": 0, "baseline_lost": False}
+
+    version = max(previous_version, latest_version) + 1
+    # 最早可用的 delta 是基準版本的下一版：第一個版本與基準遺失後的第一個版本都不產生 delta
+    base_version = version if baseline_lost or not previous_version else int(state.get("base_version") or 1)
+    os.makedirs(delta_dir, exist_ok=True)
+
+    # 沒有可比較的基準時不產生 delta (客戶端一律下載完整歸檔)
+    if version > base_version:
+        _write_json(os.path.join(delta_dir, f"{version}.json"), {
+            "format": DELTA_FORMAT_VERSION,
+            "from": previous_version,
+            "to": version,
+            "sha256": digest,
+            "upserts": upserts,
+            "removed": removed,
+        })
+
+    # 只保留最近 retention 個 delta；落後更多版本的客戶端改為下載完整歸檔
+    min_delta_version = max(base_version + 1, version - retention + 1)
+    for name in os.listdir(delta_dir):
+        stem, ext = os.path.splitext(name)
+        if ext == ".json" and stem.isdigit() and int(stem) < min_delta_version:
+            os.remove(os.path.join(delta_dir, name))
+
+    _write_json(version_path, {
+        "format": DELTA_FORMAT_VERSION,
+        "version": version,
+        "sha256": digest,
+        "total": len(signatures),
+        "min_delta_version": min_delta_version if version > base_version else None,
+        "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }, compact=False)
+    _write_json(state_path, {"version": version, "base_version": base_version, "sha256": digest,
+                             "signatures": signatures})
+    return {"version": version, "changed": True, "upserts": len(upserts), "removed": len(removed),
+            "baseline_lost": baseline_lost}
+
+
+def apply_delta(posts, delta):
+    """將一個 delta 套用到貼文列表，返回依輸出順序排列的新列表。"""
+    by_id = {post_key(post): post for post in posts}
+    for post_id in delta.get("removed", []):
+        by_id.pop(post_id, None)
+    for post in delta.get("upserts", []):
+        by_id[post_key(post)] = post
+    return sort_posts(by_id.values())
+
+
+def apply_deltas(posts, from_version: int, delta_dir: str = DELTA_DIR, version_path: str = VERSION_JSON_FILE):
+    """從 from_version 依序套用所有 delta 到目前版本，並以 version.json 的雜湊驗證結果。
+
+    返回 (posts, version)。缺少需要的 delta 或驗證失敗時拋出 ValueError，呼叫端應改為下載完整歸檔。
+    """
+    current = _load_json(version_path)
+    if current is None:
+        raise ValueError(f"找不到 {version_path}")
+    target = current["version"]
+    if from_version == target:
+        return posts, target
+    if current.get("min_delta_version") is None or from_version + 1 < current["min_delta_version"]:
+        raise ValueError(f"版本 {from_version} 太舊，已沒有可用的 delta")
+
+    for version in range(from_version + 1, target + 1):
+        delta = _load_json(os.path.join(delta_dir, f"{version}.json"))
+        if delta is None or delta.get("from") != version - 1:
+            raise ValueError(f"缺少版本 {version} 的 delta")
+        posts = apply_delta(posts, delta)
+
+    if archive_hash(posts) != current["sha256"]:
+        raise ValueError("套用 delta 後的內容雜湊與 version.json 不符")
+    return posts, target
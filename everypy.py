@@ -4,277 +4,717 @@ import io
 import datetime
 from datetime import timezone, timedelta
 import asyncio 
-import re 
+import concurrent.futures
+import functools
 import time 
 
-# --- 導入 dotenv 庫來加載 .env 文件 ---
-from dotenv import load_dotenv 
-
-from telethon import TelegramClient
-from telethon.tl.types import MessageMediaPhoto 
-
-import requests 
+import config
+import delta_feed
+import export_shards
+import firestore_sync
+import gcs_sync
+import image_cache
+import image_derivatives
+import import_state
+import media_pipeline
+import post_store
+import publish_artifacts
+import rate_control
+import run_metrics
+import search_index
+import state_sync
 
 # --- 配置區 ---
-# 在最上方調用 load_dotenv() 來加載 .env 文件中的環境變數
-load_dotenv() 
-
-# 從環境變數讀取配置
-API_ID = os.getenv("TELEGRAM_API_ID")
-API_HASH = os.getenv("TELEGRAM_API_HASH")
-IMGBB_API_KEY = os.getenv("IMGBB_API_KEY")
-CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME")
-
-OUTPUT_JSON_FILE = "posts.json" # 輸出到這個 JSON 檔案
+# 所有設定集中在 config.ImporterConfig (由環境變數與 .env 文件建立)，在每次運行時讀取。
+# 本模組在 import 時不讀取設定、也不載入 Telethon，
+# 讓 cli.py、常駐的觸發服務 (app.py) 與壓測工具 (bench_import.py) 都可以直接 import 並注入自己的客戶端。
 
 # --- 必要的環境變數檢查 ---
-if not all([API_ID, API_HASH, IMGBB_API_KEY, CHANNEL_USERNAME]):
-    print("錯誤：請確保已在 .env 文件或系統環境變數中設定以下所有必要變數：")
-    print("  - TELEGRAM_API_ID")
-    print("  - TELEGRAM_API_HASH")
-    print("  - IMGBB_API_KEY")
-    print("  - CHANNEL_USERNAME")
-    print("\n請檢查您的 '.env' 文件是否與腳本在同一個目錄中，且變數名稱和值是否正確。")
-    print("例如：TELEGRAM_API_ID=12345678")
-    exit(1) 
-
-# 將 API_ID 轉換為整數
-try:
-    API_ID = int(API_ID)
-except ValueError:
-    print("錯誤：TELEGRAM_API_ID 必須是有效的數字。請檢查 .env 文件或環境變數中的值。")
-    exit(1)
-
-# Telethon 客戶端初始化
-# 'anon' 會是 session 檔案名 (anon.session)。
-# 確保這個 anon.session 檔案存在且有效，否則 Telethon 會嘗試重新登入（需要電話驗證）。
-# 傳遞的 API_ID 和 API_HASH 必須與生成 anon.session 時所用的憑證匹配。
-client = TelegramClient('anon', API_ID, API_HASH)
+def check_required_env(cfg=None):
+    """檢查必要的環境變數，返回整數型態的 TELEGRAM_API_ID；缺少或格式錯誤時結束程式。"""
+    try:
+        cfg = cfg or config.ImporterConfig()
+        return cfg.require()
+    except config.ConfigError as e:
+        print(f"錯誤：{e}")
+        print("\n請檢查您的 '.env' 文件是否與腳本在同一個目錄中，且變數名稱和值是否正確。")
+        print("例如：TELEGRAM_API_ID=12345678")
+        exit(1)
 
 # 台灣時區定義
 TW_TZ = timezone(timedelta(hours=8))
 
-# --- 定義今天要處理的日期範圍 (從今天開始，只處理今天一整天) ---
-CURRENT_RUN_DATE = datetime.datetime.now(TW_TZ).date() 
-MIN_DATE_TO_PROCESS = datetime.datetime(CURRENT_RUN_DATE.year, CURRENT_RUN_DATE.month, CURRENT_RUN_DATE.day, 0, 0, 0, tzinfo=TW_TZ)
-MAX_DATE_TO_PROCESS = MIN_DATE_TO_PROCESS + timedelta(days=1) # 處理到今天的結束 (即明天00:00:00)
-
 # --- 上傳到 ImgBB 函式 ---
-async def upload_to_imgbb(file_bytes_io: io.BytesIO, file_name: str, mime_type: str):
-    """將圖片從記憶體上傳到 ImgBB 並返回其 URL。錯誤時打印新行。"""
-    file_bytes_io.seek(0)
+def imgbb_uploader(cfg):
+    """返回依 cfg 上傳到 ImgBB 的函式：upload(file_bytes_io, file_name, mime_type) → URL，失敗時拋出例外。"""
+    async def upload_to_imgbb(file_bytes_io: io.BytesIO, file_name: str, mime_type: str):
+        """將圖片從記憶體上傳到 ImgBB 並返回其 URL (在執行緒中執行，不阻塞事件迴圈)。"""
+        return await media_pipeline.upload_to_imgbb(
+            file_bytes_io, file_name, mime_type, cfg.imgbb_api_key, upload_url=cfg.imgbb_upload_url or media_pipeline.IMGBB_UPLOAD_URL
+        )
+    return upload_to_imgbb
+
+# --- 連線檢查與頻道實體 ---
+async def resolve_channel(client, channel_username: str):
+    """確認 Telethon Session 已授權並取得頻道實體。失敗時拋出例外。
 
+    常駐的觸發服務 (app.py) 只在第一次運行時呼叫一次，之後重複使用同一個實體。
+    """
+    # 嘗試獲取自己的信息，這是確認 Telethon Session 是否成功載入並授權的最佳方式
+    me = await client.get_me()
+    print(f"Telethon 客戶端已成功登入為：{me.first_name} {me.last_name if me.last_name else ''} (ID: {me.id})")
+
+    entity = await client.get_entity(channel_username)
+    print(f"成功獲取頻道 '{channel_username}' 實體。")
+    return entity
+
+def restore_state(cfg, metrics):
+    """從 cfg.state_bucket_name 下載上一次運行的狀態檔 (必須在開啟資料庫之前呼叫)。
+
+    返回之後用來上傳的 state_sync.StateSync；未設定 bucket 時返回 None。下載失敗時拋出例外：
+    沒有上一次的 watermark 就開始匯入會重新抓取整個頻道。
+    """
+    if not cfg.state_bucket_name:
+        return None
+    synced = state_sync.StateSync(state_sync.state_files(cfg), cfg.state_bucket_name, cfg.state_object_prefix,
+                                  interval=cfg.state_sync_interval_seconds)
+    stats = synced.restore()
+    print(f"已從 gs://{cfg.state_bucket_name}/{cfg.state_object_prefix} 載入狀態檔：下載 {len(stats['downloaded'])} 個，"
+          f"與本地相同 {stats['unchanged']} 個，遠端尚不存在 {len(stats['missing'])} 個。")
+    metrics.incr("state_objects_downloaded", len(stats["downloaded"]))
+    return synced
+
+
+def save_state(synced, metrics, cfg=None, outputs_ok: bool = True) -> bool:
+    """運行結束時上傳有變化的狀態檔。返回是否成功 (被其他運行搶先更新不算失敗)。
+
+    outputs_ok 為 False (輸出沒有全部同步到 bucket) 時不上傳 cfg.delta_state_file：
+    它記錄的版本可能還沒有發布，下一次運行從上一個已發布的版本重新產生這個版本與它的 delta。
+    """
+    if synced is None:
+        return True
+    skip = () if outputs_ok or cfg is None else (cfg.delta_state_file,)
     try:
-        response = requests.post(
-            "https://api.imgbb.com/1/upload",
-            params={"key": IMGBB_API_KEY},
-            files={"image": (file_name, file_bytes_io, mime_type)} 
+        stats = synced.save(skip=skip)
+    except Exception as e:
+        print(f"錯誤：上傳狀態檔到 gs://{synced.bucket_name}/ 失敗: {e}")
+        print("下次運行會從最後一次成功上傳的 watermark 繼續。")
+        return False
+    print(f"狀態檔已保存到 gs://{synced.bucket_name}/：上傳 {len(stats['uploaded'])} 個 ({stats['bytes']:,} 位元組)。")
+    if stats["skipped"]:
+        print(f"警告：輸出沒有全部發布，{'、'.join(stats['skipped'])} 不上傳，下次運行會重新發布這個版本。")
+    metrics.incr("state_objects_uploaded", len(stats["uploaded"]))
+    metrics.incr("state_conflicts", 1 if stats["conflict"] else 0)
+    return True
+
+
+def export_outputs(cfg, stores, metrics, ingest_ok: bool = True) -> bool:
+    """由所有頻道的貼文資料庫重新產生合併後的輸出檔案，並依設定同步到 Cloud Storage 與 Firestore。
+
+    stores 為 {頻道名稱: PostStore}，需包含 cfg.channels 中的每個頻道。
+    ingest_ok 為 False (有頻道匯入失敗) 時不刪除 Firestore 中的文件。返回是否全部成功。
+    """
+    def merged_posts():
+        """所有頻道的貼文依輸出順序合併 (非主頻道的貼文帶有 channel 欄位)。"""
+        return post_store.merge_posts(*(stores[channel.username].iter_posts(channel=channel.tag)
+                                        for channel in cfg.channels))
+
+    # 所有輸出都由資料庫完整重新產生，這裡失敗時下次運行會再次輸出，不需要重新抓取訊息
+    ok = True
+    try:
+        # 所有輸出都依「日期降序、ID 降序」從資料庫串流讀出 (最新的在最上面)，多個頻道時逐筆合併
+        print(f"正在寫入 {cfg.output_json_file} ...")
+        written_count = post_store.write_posts_json(merged_posts(), cfg.output_json_file, indent=2)
+        print(f"完成！共 {written_count} 筆資料已儲存。")
+        metrics.info["total_posts"] = written_count
+        metrics.checkpoint("export_json")
+
+        print(f"正在更新 {cfg.shards_dir}/ 分片與 {cfg.latest_json_file} ...")
+        shard_stats = export_shards.write_shards(
+            merged_posts(), shards_dir=cfg.shards_dir, latest_path=cfg.latest_json_file, latest_count=cfg.latest_posts_count
         )
-        response.raise_for_status() 
-        data = response.json()
-        if data and data.get("success"):
-            return data["data"]["url"]
+        print(f"分片已更新：重寫 {len(shard_stats['written'])} 個，未變動 {shard_stats['unchanged']} 個，"
+              f"移除 {len(shard_stats['removed'])} 個。")
+        if len(cfg.channels) > 1:
+            # 每個頻道另外保留自己的分片與 latest.json (內容沒變的分片不會被改寫)
+            for channel in cfg.channels:
+                channel_stats = export_shards.write_shards(
+                    stores[channel.username].iter_posts(channel=channel.tag), shards_dir=channel.shards_dir,
+                    latest_path=channel.latest_json_file, latest_count=cfg.latest_posts_count
+                )
+                print(f"[{channel.username}] {channel.shards_dir}/ 分片：重寫 {len(channel_stats['written'])} 個，"
+                      f"未變動 {channel_stats['unchanged']} 個。")
+        metrics.checkpoint("export_shards")
+
+        index_stats = search_index.update_index_file(merged_posts(), cfg.search_index_file)
+        print(f"搜尋索引已更新：新增 {index_stats['added']} 篇，更新 {index_stats['updated']} 篇，"
+              f"移除 {index_stats['removed']} 篇{'（已完整重建）' if index_stats['rebuilt'] else ''}。")
+        metrics.checkpoint("search_index")
+
+        # 版本號必須大於 bucket 中已發布的版本 (本地的 delta_state.json 遺失或落後時也不會倒退)
+        published_version = gcs_sync.remote_version(cfg) if cfg.storage_bucket_name else 0
+        delta_stats = delta_feed.publish(
+            merged_posts(), version_path=cfg.version_json_file, delta_dir=cfg.delta_dir,
+            state_path=cfg.delta_state_file, retention=cfg.delta_retention, remote_version=published_version
+        )
+        if delta_stats["baseline_lost"]:
+            print(f"警告：{cfg.delta_state_file} 遺失或落後於已發布的版本，版本 {delta_stats['version']} 不產生 delta，"
+                  f"持有舊版本的客戶端會重新下載完整歸檔。")
+        if delta_stats["changed"]:
+            print(f"已發布歸檔版本 {delta_stats['version']}：新增/編輯 {delta_stats['upserts']} 篇，"
+                  f"刪除 {delta_stats['removed']} 篇。")
         else:
-            error_message = data.get('error', {}).get('message', '未知錯誤')
-            print(f"\nImgBB 上傳失敗 ({file_name}): {error_message}") # 錯誤時打印新行
-            return None
-    except requests.exceptions.RequestException as e:
-        print(f"\nImgBB 上傳請求失敗 ({file_name}): {e}") 
-        return None
+            print(f"內容沒有變化，歸檔版本維持 {delta_stats['version']}。")
+        metrics.checkpoint("delta_feed")
+
+        if cfg.publish_dir:
+            # 緊湊格式的完整歸檔先寫到暫存檔，內容雜湊與上一次相同時不會產生新檔案
+            os.makedirs(cfg.publish_dir, exist_ok=True)
+            minified_path = os.path.join(cfg.publish_dir, "posts.min.json.tmp")
+            post_store.write_posts_json(merged_posts(), minified_path, indent=None)
+            # 以 bucket 中已發布的 current.json 為比對基準 (全新的容器沒有本地的 publish/)，內容沒變時不產生新的指標檔
+            published_pointer = gcs_sync.remote_pointer(cfg) if cfg.storage_bucket_name else None
+            try:
+                publish_stats = publish_artifacts.publish(
+                    {"posts": minified_path, "latest": cfg.latest_json_file, "search_index": cfg.search_index_file},
+                    publish_dir=cfg.publish_dir, retention=cfg.publish_retention, remote_pointer=published_pointer,
+                )
+            finally:
+                os.remove(minified_path)
+            posts_artifact = publish_stats["artifacts"]["posts"]
+            sizes = "、".join(f"{encoding} {info['bytes']:,}" for encoding, info in posts_artifact["encodings"].items())
+            if publish_stats["published"]:
+                print(f"已發布 {cfg.publish_dir}/：{'、'.join(publish_stats['published'])} 有新版本；"
+                      f"posts 為 {posts_artifact['file']} ({posts_artifact['bytes']:,} 位元組，{sizes})。")
+            else:
+                print(f"發布產物內容沒有變化，{cfg.publish_dir}/{publish_artifacts.POINTER_FILE_NAME} 維持不變。")
+            metrics.incr("artifacts_published", len(publish_stats["published"]))
+            metrics.info["posts_artifact"] = posts_artifact["file"]
+            metrics.checkpoint("publish")
     except Exception as e:
-        print(f"\nImgBB 上傳過程中發生錯誤 ({file_name}): {e}") 
-        return None
+        print(f"錯誤：寫入 {cfg.output_json_file} 或衍生檔案 (分片、搜尋索引、delta、發布產物) 失敗: {e}")
+        print("貼文已保存在資料庫中，下次運行會重新輸出這些檔案。")
+        ok = False
+    else:
+        if cfg.storage_bucket_name:
+            # 內容沒變的物件不會重新上傳；失敗時本地檔案都還在，下次運行會重新比對並補上
+            try:
+                upload_stats = gcs_sync.sync_outputs(
+                    gcs_sync.collect_outputs(cfg, prefix=cfg.storage_object_prefix), cfg.storage_bucket_name,
+                    workers=cfg.storage_upload_concurrency,
+                )
+            except Exception as e:
+                print(f"錯誤：同步輸出檔案到 gs://{cfg.storage_bucket_name}/ 失敗: {e}")
+                ok = False
+            else:
+                print(f"已同步到 gs://{cfg.storage_bucket_name}/：上傳 {len(upload_stats['uploaded'])} 個物件 "
+                      f"({upload_stats['bytes']:,} 位元組)，更新中繼資料 {len(upload_stats['metadata'])} 個，"
+                      f"未變動 {upload_stats['unchanged']} 個。")
+                if upload_stats["pointers_skipped"]:
+                    print("警告：部分物件上傳失敗或被其他運行修改，本次不更新指標檔 (manifest、version、current 等)。")
+                metrics.incr("storage_objects_uploaded", len(upload_stats["uploaded"]))
+                metrics.incr("storage_objects_unchanged", upload_stats["unchanged"])
+                metrics.incr("storage_bytes_uploaded", upload_stats["bytes"])
+                metrics.incr("storage_conflicts", len(upload_stats["conflicts"]))
+                # 衝突表示另一個運行正在發布，不算失敗；上傳失敗則讓這次運行失敗
+                if upload_stats["failed"]:
+                    ok = False
+                elif cfg.publish_dir and not upload_stats["conflicts"]:
+                    # current.json 已指向新版本，刪除超過保留數量的舊發布產物 (失敗時下次運行再刪)
+                    try:
+                        deleted = gcs_sync.delete_stale_artifacts(cfg, publish_artifacts.load_pointer(cfg.publish_dir))
+                    except Exception as e:
+                        print(f"警告：刪除 gs://{cfg.storage_bucket_name}/ 中舊的發布產物失敗: {e}")
+                    else:
+                        if deleted:
+                            print(f"已從 gs://{cfg.storage_bucket_name}/ 刪除 {len(deleted)} 個舊的發布產物。")
+                        metrics.incr("storage_objects_deleted", len(deleted))
+            metrics.checkpoint("upload_outputs")
+
+    if cfg.firestore_sync:
+        # 直接與資料庫比對，不依賴上面的輸出檔案；失敗的文件不記入狀態檔，下次運行會重新寫入
+        try:
+            firestore_stats = firestore_sync.sync_posts(
+                merged_posts(), collection=cfg.firestore_collection, state_path=cfg.firestore_sync_state_file,
+                initial_ops_per_second=cfg.firestore_initial_ops_per_second,
+                max_ops_per_second=cfg.firestore_max_ops_per_second, max_attempts=cfg.retry_max_attempts,
+                allow_deletes=ingest_ok,
+            )
+        except Exception as e:
+            print(f"錯誤：同步 Firestore 的 {cfg.firestore_collection} 集合失敗: {e}")
+            ok = False
+        else:
+            print(f"Firestore {cfg.firestore_collection} 已同步：寫入 {firestore_stats['written']} 篇，"
+                  f"刪除 {firestore_stats['deleted']} 篇，未變動 {firestore_stats['unchanged']} 篇"
+                  f"{'（已從 Firestore 重建同步狀態）' if firestore_stats['bootstrapped'] else ''}。")
+            if firestore_stats["skipped"]:
+                print(f"警告：{firestore_stats['skipped']} 篇貼文缺少日期或 ID，未同步到 Firestore。")
+            if firestore_stats["deletes_deferred"]:
+                print(f"警告：本次匯入失敗，{firestore_stats['deletes_deferred']} 篇已不存在的貼文暫不從 Firestore 刪除。")
+            metrics.incr("firestore_written", firestore_stats["written"])
+            metrics.incr("firestore_deleted", firestore_stats["deleted"])
+            metrics.incr("firestore_unchanged", firestore_stats["unchanged"])
+            metrics.incr("firestore_failed", len(firestore_stats["failed"]))
+            if firestore_stats["failed"]:
+                ok = False
+        metrics.checkpoint("firestore_sync")
+    return ok
+
 
 # --- 主要處理流程函式 ---
-async def main():
+async def main(client, upload_image=None, entity=None, cfg=None, entities=None):
+    """執行一次匯入：Telegram → 圖片管線 → 每個頻道的貼文資料庫 → 合併後的所有輸出檔案。
+
+    client 只需要提供 get_me / get_entity / iter_messages / get_messages / download_media (壓測時傳入假的客戶端)；
+    upload_image 的簽名與 imgbb_uploader() 返回的函式相同 (預設上傳到 ImgBB)，失敗時應拋出例外；
+    已取得主頻道實體時可傳入 entity 以略過連線檢查；entities ({頻道名稱: 實體}) 中已有的頻道不再解析，
+    新解析的實體也會寫回其中；cfg 未提供時從目前的環境變數建立。
+    返回本次運行的報告 (run_metrics.RunMetrics.report())：
+    {"ok", "duration_seconds", "stages", "timers", "counters", ...}，stages 為各階段耗時 (秒)。
+    """
     print(f"--- 腳本開始運行於：{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
     start_time = time.time() # 記錄開始時間
+    cfg = cfg or config.ImporterConfig()
+    derivative_formats = image_derivatives.parse_formats(cfg.image_derivative_formats)
+    metrics = run_metrics.RunMetrics()
+    profiler = run_metrics.Profiler(cfg.run_profile, metrics, cfg.run_profile_dir).start()
+    derive_pool = None # 第一次需要縮放圖片時才建立
+
+    if cfg.image_derivatives and not image_derivatives.AVAILABLE:
+        print("提示：未安裝 Pillow，本次不產生縮圖與 BlurHash。")
+
+    # 每個上游一個速率控制器，所有下載/上傳 worker 共用；FloodWait 與 HTTP 429 會讓同一上游的所有請求一起暫停
+    telegram_limiter = rate_control.RateController("telegram", cfg.telegram_requests_per_second)
+    imgbb_limiter = rate_control.RateController("imgbb", cfg.imgbb_requests_per_second)
+
+    def with_retry(limiter, func, throttled_counter, label):
+        def record_retry(kind, error, delay):
+            metrics.incr(f"{limiter.name}_retries")
+            if kind == rate_control.THROTTLED:
+                metrics.incr(throttled_counter)
+                retry_after = rate_control.classify_error(error)[1]
+                if retry_after:
+                    metrics.incr(f"{throttled_counter}_seconds", retry_after)
+        return rate_control.call_with_retry(
+            limiter, func, max_attempts=cfg.retry_max_attempts, base_delay=cfg.retry_base_delay,
+            max_wait=cfg.flood_wait_max_seconds, on_retry=record_retry, label=label,
+        )
 
-    # 1. 讀取現有 posts.json 中的所有數據，並以 (date, text_key) 為鍵建立查找字典
-    existing_data_from_file = [] 
-    existing_posts_by_key = {} # 鍵為 (date_str, text_snippet)，值為完整的 post 字典
-    
-    if os.path.exists(OUTPUT_JSON_FILE):
-        print(f"正在讀取現有的 {OUTPUT_JSON_FILE} 以合併新數據...")
+    raw_upload_image = upload_image or imgbb_uploader(cfg)
+
+    async def upload_image(file_bytes_io, file_name, mime_type):
+        return await with_retry(imgbb_limiter, lambda: raw_upload_image(file_bytes_io, file_name, mime_type),
+                                "imgbb_rate_limited", f"上傳 {file_name}")
+
+    def get_derive_pool():
+        nonlocal derive_pool
+        if derive_pool is None:
+            derive_pool = concurrent.futures.ProcessPoolExecutor(max_workers=max(1, cfg.image_derivative_workers))
+        return derive_pool
+
+    def finish():
+        """停止效能分析並輸出運行報告 (寫入失敗不影響匯入結果)。"""
+        if derive_pool is not None:
+            derive_pool.shutdown()
+        profiler.stop()
         try:
-            with open(OUTPUT_JSON_FILE, "r", encoding="utf-8") as f:
-                existing_data_from_file = json.load(f) 
-            
-            for post in existing_data_from_file:
-                post_date = post.get("date")
-                post_text_key = (post.get("text") or "").strip()[:50] 
-                if post_date: 
-                    existing_posts_by_key[(post_date, post_text_key)] = post
-            print(f"已讀取 {len(existing_data_from_file)} 筆舊貼文，其中 {len(existing_posts_by_key)} 筆可通過日期+文本識別。")
-        except json.JSONDecodeError:
-            print(f"警告：{OUTPUT_JSON_FILE} 不是有效的 JSON 格式。將忽略其內容並創建新檔案。")
-            existing_data_from_file = [] 
-            existing_posts_by_key = {}
+            metrics.write(cfg.run_metrics_file, cfg.run_metrics_openmetrics_file)
+        except OSError as e:
+            print(f"警告：寫入運行報告失敗: {e}")
+        report = metrics.report()
+        # 單行 JSON 也印到標準輸出，Cloud Run Job 的日誌會把它解析成結構化記錄
+        print(json.dumps(report, ensure_ascii=False))
+        return report
+
+    # 0. Cloud Run 的容器不保留本地檔案：先從 bucket 取回上一次的資料庫、watermark 與圖片索引
+    #    (回補的分區使用自己的工作目錄，不下載)
+    synced_state = None
+    if cfg.message_id_range is None:
+        try:
+            synced_state = restore_state(cfg, metrics)
         except Exception as e:
-            print(f"讀取或處理 {OUTPUT_JSON_FILE} 失敗: {e}。將不保留舊數據。")
-            existing_data_from_file = [] 
-            existing_posts_by_key = {}
-    else:
-        print(f"找不到 {OUTPUT_JSON_FILE}，將創建新檔案。")
-
-    # 獲取 Telegram 頻道實體
-    entity = None
+            print(f"錯誤：無法從 gs://{cfg.state_bucket_name}/ 載入狀態檔: {e}")
+            print("為了避免從頭重新抓取整個頻道並覆蓋遠端的狀態，本次不進行匯入。")
+            metrics.checkpoint("load")
+            return finish()
+
+    # 1. 開啟每個頻道的貼文資料庫 (以訊息 ID 為主鍵)；主頻道的資料庫為空時從既有的 posts.json 匯入一次
+    stores = {}
+    for channel in cfg.channels:
+        if not channel.primary:
+            os.makedirs(os.path.dirname(channel.post_store_file), exist_ok=True)
+        store = stores[channel.username] = post_store.PostStore(channel.post_store_file)
+        if channel.primary and store.count() == 0 and os.path.exists(cfg.output_json_file) \
+                and cfg.message_id_range is None:
+            print(f"貼文資料庫為空，正在從現有的 {cfg.output_json_file} 匯入...")
+            try:
+                imported = store.import_json(cfg.output_json_file)
+                print(f"已匯入 {imported} 筆舊貼文到 {channel.post_store_file}。")
+            except (json.JSONDecodeError, ValueError) as e:
+                print(f"警告：{cfg.output_json_file} 不是有效的貼文 JSON 陣列 ({e})。將忽略其內容。")
+        print(f"頻道 '{channel.username}' 的貼文資料庫 {channel.post_store_file} 目前共有 {store.count()} 筆貼文。")
+
+    def close_stores():
+        for store in stores.values():
+            store.close()
+
+    images = image_cache.ImageCache(
+        cfg.image_index_file, max_entries=cfg.image_index_max_entries, max_age_days=cfg.image_index_max_age_days
+    ).load()
+    print(f"圖片索引已載入：{len(images.photos)} 個 photo id，{len(images.hashes)} 個內容雜湊。")
+    metrics.checkpoint("load")
+
+    # 獲取 Telegram 頻道實體 (呼叫端已提供時直接使用；解析結果寫回 entities，讓常駐服務下次沿用)
+    entities = {} if entities is None else entities
+    if entity is not None:
+        entities.setdefault(cfg.channel_username, entity)
     try:
-        print(f"正在嘗試連接 Telegram 並獲取頻道 '{CHANNEL_USERNAME}' 的實體...")
-        
-        # --- 新增：檢查 Telethon 客戶端是否成功登入 (使用了 Session) ---
-        # 嘗試獲取自己的信息，這是確認 Telethon Session 是否成功載入並授權的最佳方式
-        me = await client.get_me() 
-        print(f"Telethon 客戶端已成功登入為：{me.first_name} {me.last_name if me.last_name else ''} (ID: {me.id})")
-        # --- 新增結束 ---
-
-        entity = await client.get_entity(CHANNEL_USERNAME)
-        print(f"成功獲取頻道 '{CHANNEL_USERNAME}' 實體。")
+        if cfg.channel_username not in entities:
+            print(f"正在嘗試連接 Telegram 並獲取頻道 '{cfg.channel_username}' 的實體...")
+            entities[cfg.channel_username] = await resolve_channel(client, cfg.channel_username)
     except Exception as e:
-        print(f"錯誤：無法連接 Telegram 或獲取頻道 '{CHANNEL_USERNAME}' 的實體: {e}")
+        print(f"錯誤：無法連接 Telegram 或獲取頻道 '{cfg.channel_username}' 的實體: {e}")
         print("請確保 CHANNEL_USERNAME 正確，你的 Telegram 帳號可以訪問此頻道，且 anon.session 有效。")
         print("如果您遇到 PhoneNumberBannedError，請參考之前的解決方案。")
         print(f"--- 腳本結束於：{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
-        return 
-
-    # --- 獲取今天訊息的總數（用於精確進度條）---
-    print(f"正在取得今天 ({MIN_DATE_TO_PROCESS.strftime('%Y-%m-%d')}) 的訊息總數 (這可能需要一些時間)...")
-    total_messages_today = 0
-    try:
-        # 第一次遍歷：僅用於計數今天範圍內的訊息
-        # 從結束日期開始往回抓取
-        async for msg in client.iter_messages(entity, offset_date=MAX_DATE_TO_PROCESS):
-            # 如果訊息日期比我們設定的開始日期還早，就停止計數
-            if msg.date.astimezone(TW_TZ) < MIN_DATE_TO_PROCESS:
-                break
-            total_messages_today += 1
-        print(f"今天頻道 '{CHANNEL_USERNAME}' 總共有 {total_messages_today} 筆訊息，開始處理...")
-    except Exception as e:
-        print(f"錯誤：在計數訊息時發生錯誤: {e}")
-        print("這可能是由於網路問題或 Telegram API 暫時性故障。將嘗試繼續處理但無法顯示總進度。")
-        total_messages_today = 0 
-
-    # 計算預估完成時間
-    estimated_time_per_message = 0.1 # 每次循環的 asyncio.sleep(0.1) 時間 (不含圖片下載/上傳實際耗時)
-    if total_messages_today > 0:
-        estimated_total_seconds = total_messages_today * estimated_time_per_message
-        estimated_end_time = datetime.datetime.now(TW_TZ) + datetime.timedelta(seconds=estimated_total_seconds)
-        print(f"預計完成時間：{estimated_end_time.strftime('%Y-%m-%d %H:%M:%S')}")
-    else:
-        print("無法預估完成時間，因為今天沒有新訊息或無法獲取總數。")
-
-    processed_count = 0
-    # 儲存本次運行處理過的訊息，以 (date, text_key) 為鍵。
-    messages_processed_in_this_run_by_key = {} 
-
-    # --- 處理今天的訊息 ---
-    # 第二次遍歷：實際處理訊息 (只獲取今天範圍內的訊息)
-    # `reverse=True` 會讓它從舊到新獲取今天的訊息。
-    # 由於 reverse=True 會抓取比 offset_date 更新的訊息，所以我們從開始日期的前一秒開始抓
-    async for msg in client.iter_messages(entity, offset_date=MIN_DATE_TO_PROCESS - timedelta(seconds=1), reverse=True):
-        msg_date_tw = msg.date.astimezone(TW_TZ)
-
-        # 如果訊息日期超出了我們設定的結束日期，就停止處理
-        if msg_date_tw >= MAX_DATE_TO_PROCESS:
-            break
-
-        processed_count += 1
-        
-        msg_date_tw_str = msg_date_tw.strftime('%Y-%m-%d')
-        msg_text_original = msg.text or ""
-        msg_text_key = msg_text_original.strip()[:50] # 用於查找的文本鍵
-
-        img_bb_url = None 
-        current_post_lookup_key = (msg_date_tw_str, msg_text_key)
-        
-        # 檢查這條訊息是否已經在舊數據中存在，並且是否有圖片連結
-        # 如果存在且有圖片連結，則跳過圖片下載和上傳，直接使用舊連結
-        if current_post_lookup_key in existing_posts_by_key and existing_posts_by_key[current_post_lookup_key].get("image"):
-            img_bb_url = existing_posts_by_key[current_post_lookup_key]["image"] # <-- 修正這裡！
-        elif msg.photo: # 只有當沒有舊連結或舊連結為空，且訊息確實有圖片時，才處理新圖片
-            # 圖片命名邏輯
-            text_snippet = (msg.text or "").strip()
-            if text_snippet:
-                text_snippet = re.sub(r'[\\/:*?"<>|]', '', text_snippet) 
-                text_snippet = text_snippet.replace(' ', '_')
-                text_snippet = text_snippet[:30] 
-                if text_snippet: 
-                    text_snippet = f"_{text_snippet}"
-            else:
-                text_snippet = "" 
+        close_stores()
+        metrics.checkpoint("connect")
+        return finish()
+    # 其他頻道解析失敗時只略過該頻道，不影響其餘頻道的匯入
+    channels = []
+    for channel in cfg.channels:
+        if channel.username not in entities:
+            try:
+                entities[channel.username] = await client.get_entity(channel.username)
+                print(f"成功獲取頻道 '{channel.username}' 實體。")
+            except Exception as e:
+                print(f"錯誤：無法獲取頻道 '{channel.username}' 的實體: {e}。本次略過此頻道。")
+                metrics.incr("channels_failed")
+                continue
+        channels.append(channel)
+    metrics.checkpoint("connect")
 
-            photo_mime_type = 'image/jpeg' 
-            file_extension = '.jpg' 
+    async def download(media_job):
+        msg = media_job[0]
 
-            file_name = f"{msg_date_tw_str}_{msg.id}{text_snippet}{file_extension}"
-            
+        async def download_once():
+            # 每次嘗試都使用新的緩衝區，避免重試時接在前一次寫了一半的內容後面
             photo_bytes_io = io.BytesIO()
-            
-            try:
+            with metrics.timer("download"):
                 await client.download_media(msg.photo, file=photo_bytes_io)
-                img_bb_url = await upload_to_imgbb(photo_bytes_io, file_name, photo_mime_type)
+            return photo_bytes_io
 
-            except Exception as e:
-                pass 
-            finally:
-                photo_bytes_io.close() 
-        
-        # 準備 post_item 字典，現在包含 msg.id
-        post_item = {
-            "id": msg.id, # <--- 訊息 ID，用於唯一識別和排序
-            "date": msg_date_tw_str, 
-            "text": msg_text_original,
-            "image": img_bb_url # 這裡直接賦值為 img_bb_url (可能為 None)
-        }
-
-        # 將此貼文加入到本次運行處理過的字典中
-        messages_processed_in_this_run_by_key[current_post_lookup_key] = post_item
-        
-        # 顯示進度條 (單行更新)
-        if total_messages_today > 0: # 注意這裡用的是 total_messages_today
-            percent = (processed_count / total_messages_today) * 100
-            print(f"處理進度: {processed_count}/{total_messages_today} 筆訊息 ({percent:.2f}%)", end='\r')
-        else:
-            print(f"處理進度: 已處理 {processed_count} 筆訊息...", end='\r') 
-        
-        await asyncio.sleep(0.1) # 添加短暫延遲
-
-    print("\n") # 處理完成後打印一個換行符，確保後續輸出從新行開始
+        photo_bytes_io = await with_retry(telegram_limiter, download_once, "telegram_flood_waits",
+                                          f"下載圖片 (訊息 ID {msg.id})")
+        metrics.incr("bytes_downloaded", photo_bytes_io.getbuffer().nbytes)
+        return photo_bytes_io
 
-    # --- 合併所有數據並寫入 JSON 檔案 ---
-    final_posts_map = {} # 使用字典來進行精確的合併和去重，以 (date, text_key) 為主要鍵
-
-    # 1. 將所有舊數據放入合併字典
-    for post_key, post_data in existing_posts_by_key.items():
-        final_posts_map[post_key] = post_data
-    
-    # 2. 將本次運行處理的所有訊息（新的或更新的）覆蓋或添加到合併字典中
-    final_posts_map.update(messages_processed_in_this_run_by_key)
+    async def derive_and_upload(photo_bytes, file_name, derive_future):
+        """等待 process pool 縮放完成，上傳各尺寸版本並返回 image_meta；失敗時返回 None (只影響衍生圖片)。"""
+        try:
+            with metrics.timer("derive"):
+                derived = await derive_future
+            variants = derived["variants"]
+            with metrics.timer("upload_derivatives"):
+                results = await asyncio.gather(*(
+                    upload_image(io.BytesIO(variant["data"]),
+                                 image_derivatives.variant_file_name(file_name, variant["name"], variant["format"]),
+                                 image_derivatives.MIME_TYPES[variant["format"]])
+                    for variant in variants
+                ), return_exceptions=True)
+            # 個別尺寸上傳失敗時只從 srcset 中省略，前端會退回使用原圖
+            urls = [url if isinstance(url, str) else None for url in results]
+            if not all(urls):
+                print(f"\n警告：{file_name} 有 {urls.count(None)} 個衍生圖片上傳失敗。")
+                metrics.incr("derivative_failures", urls.count(None))
+            metrics.incr("derivatives_uploaded", sum(1 for url in urls if url))
+            metrics.incr("bytes_uploaded", sum(len(v["data"]) for v, url in zip(variants, urls) if url))
+            return image_derivatives.build_image_meta(derived, urls)
+        except Exception as e:
+            print(f"\n警告：產生衍生圖片失敗 ({file_name}): {e}")
+            metrics.incr("derivative_failures")
+            return None
 
-    # 3. 將合併後的字典值轉換為列表
-    final_posts = list(final_posts_map.values())
+    async def upload(media_job, photo_bytes_io):
+        msg, file_name, post_item = media_job
+        photo_bytes = photo_bytes_io.getvalue()
+        # 3. 下載後以內容雜湊查詢，相同的圖片不再重複上傳
+        img_bb_url, digest = images.lookup_content(photo_bytes)
+        meta = images.meta_for(digest=digest) if img_bb_url else None
+
+        # 趁圖片還在記憶體中，交給 process pool 縮放 (與原圖上傳同時進行，不阻塞事件迴圈)
+        derive_future = None
+        if cfg.image_derivatives and image_derivatives.AVAILABLE and meta is None:
+            derive_future = asyncio.get_running_loop().run_in_executor(
+                get_derive_pool(),
+                functools.partial(image_derivatives.make_derivatives, photo_bytes, formats=derivative_formats),
+            )
+
+        if img_bb_url:
+            metrics.incr("image_cache_content_hits")
+        else:
+            try:
+                with metrics.timer("upload"):
+                    img_bb_url = await upload_image(photo_bytes_io, file_name, 'image/jpeg')
+                if not img_bb_url:
+                    raise media_pipeline.UploadError(f"上傳 {file_name} 沒有返回圖片 URL")
+            except Exception:
+                if derive_future is not None:
+                    derive_future.cancel()
+                raise
+            metrics.incr("bytes_uploaded", len(photo_bytes))
+
+        if derive_future is not None:
+            meta = await derive_and_upload(photo_bytes, file_name, derive_future)
+        post_item["image_meta"] = meta
+        images.record(img_bb_url, photo_id=msg.photo.id, digest=digest, size=len(photo_bytes), meta=meta)
+        return img_bb_url
+
+    async def ingest(channel):
+        """匯入單一頻道：抓取新訊息、處理圖片並分批寫入該頻道的資料庫。返回該頻道的摘要 (不拋出例外)。"""
+        # --- 讀取 watermark，只抓取比它更新的訊息 ---
+        # 沒有狀態檔時，以貼文資料庫中最大的 ID 作為起點；
+        # 上次失敗或錯過的運行，下次會從同一個 watermark 繼續，缺口會自動補齊。
+        store = stores[channel.username]
+        entity = entities[channel.username]
+        # 回補的分區從範圍的起點開始 (分區的資料庫一開始是空的)，只抓取到範圍的終點
+        first_id, last_id = cfg.message_id_range or (1, None)
+        state = import_state.load_state(channel.import_state_file, max(store.max_id(), first_id - 1))
+        last_message_id = state["last_message_id"]
+        # 往回多看 EDIT_LOOKBACK_MESSAGES 則，用於偵測最近貼文的編輯 (edit_date 改變)
+        fetch_min_id = max(0, last_message_id - cfg.edit_lookback_messages)
+        # Telethon 的 max_id 不含本身，0 表示沒有上限
+        fetch_max_id = last_id + 1 if last_id is not None else 0
+        print(f"[{channel.username}] 目前 watermark 為訊息 ID {last_message_id}，將抓取 ID 大於 {fetch_min_id} 的訊息...")
+        # 上次運行中圖片處理失敗的訊息：先以 ID 重新抓取，再開始一般的遍歷
+        retry_ids = import_state.pending_image_ids(state)
+        if retry_ids:
+            print(f"[{channel.username}] 有 {len(retry_ids)} 則訊息的圖片上次未能處理，將重新處理："
+                  f"{', '.join(map(str, retry_ids))}")
+
+        seen_edit_dates = [] # (msg_id, edit_date)，依讀入順序；提交後用於推進 watermark
+        failed_ids = set() # 本次運行中圖片在重試後仍失敗的訊息 ID
+
+        async def pending_messages():
+            try:
+                with metrics.timer("telegram_get_messages"):
+                    messages = await with_retry(telegram_limiter, lambda: client.get_messages(entity, ids=retry_ids),
+                                                "telegram_flood_waits", "重新抓取圖片失敗的訊息")
+            except Exception as e:
+                print(f"警告：[{channel.username}] 無法重新抓取圖片失敗的訊息 ({e})，留到下次運行。")
+                return
+            for msg_id, msg in zip(retry_ids, messages):
+                if msg is None:
+                    print(f"[{channel.username}] 訊息 ID {msg_id} 已不存在，不再重試其圖片。")
+                    state["pending_image_ids"].pop(str(msg_id), None)
+                    continue
+                metrics.incr("image_retries_refetched")
+                yield msg
+
+        async def messages_since_watermark():
+            refetched = set()
+            if retry_ids:
+                async for msg in pending_messages():
+                    refetched.add(msg.id)
+                    seen_edit_dates.append((msg.id, msg.edit_date))
+                    yield msg
+            # 單次遍歷：`reverse=True` 搭配 min_id 會從舊到新取得所有 ID 大於 min_id 的訊息
+            # 手動呼叫 __anext__ 以便單獨計算等待 Telegram 回應的時間
+            messages = client.iter_messages(entity, min_id=fetch_min_id, max_id=fetch_max_id, reverse=True).__aiter__()
+            while True:
+                try:
+                    with metrics.timer("telegram_iter"):
+                        msg = await messages.__anext__()
+                except StopAsyncIteration:
+                    return
+                metrics.incr("messages_fetched")
+                seen_edit_dates.append((msg.id, msg.edit_date))
+                # 回看窗口中未被編輯、且已存在於資料庫的訊息 (以及剛重新處理過的訊息) 直接跳過
+                if msg.id in refetched or (
+                        import_state.is_unchanged(state, msg.id, msg.edit_date) and store.has(msg.id)):
+                    metrics.incr("messages_skipped_unchanged")
+                    continue
+                yield msg
+
+        def plan(msg):
+            """為單則訊息建立 post_item，並決定是否需要下載/上傳圖片。"""
+            msg_date_tw_str = msg.date.astimezone(TW_TZ).strftime('%Y-%m-%d')
+            msg_text_original = msg.text or ""
+
+            # 準備 post_item 字典，現在包含 msg.id
+            post_item = {
+                "id": msg.id, # <--- 訊息 ID，用於唯一識別和排序
+                "date": msg_date_tw_str, 
+                "text": msg_text_original,
+                "image": None # 圖片 URL 由上傳 worker 回填 (可能為 None)
+            }
+
+            if not msg.photo:
+                return post_item, None
+
+            # 1. 以 Telegram photo id 查詢圖片索引，命中則跳過下載與上傳
+            cached_url = images.lookup_photo(msg.photo.id)
+            if cached_url:
+                metrics.incr("image_cache_photo_hits")
+                post_item["image"] = cached_url
+                post_item["image_meta"] = images.meta_for(photo_id=msg.photo.id)
+                return post_item, None
+
+            # 2. 未被編輯過的舊貼文若已有圖片連結，直接沿用並登錄到索引中
+            #    (被編輯過的訊息可能換了圖片，交給下載後的內容雜湊判斷)
+            existing_post = store.get(msg.id)
+            if existing_post and existing_post.get("image") and msg.edit_date is None:
+                metrics.incr("image_reused_existing")
+                post_item["image"] = existing_post["image"]
+                post_item["image_meta"] = existing_post.get("image_meta")
+                images.record(existing_post["image"], photo_id=msg.photo.id, meta=existing_post.get("image_meta"))
+                return post_item, None
+
+            file_name = media_pipeline.build_image_file_name(msg_date_tw_str, msg.id, msg.text)
+            return post_item, (msg, file_name, post_item)
+
+        def on_media_failure(post_item, error):
+            """圖片在重試後仍無法下載或上傳：保留資料庫中原有的圖片 (若有)，並記錄下來留到下次運行重新處理。"""
+            failed_ids.add(post_item["id"])
+            metrics.incr("images_failed")
+            existing_post = store.get(post_item["id"])
+            if existing_post and existing_post.get("image"):
+                post_item["image"] = existing_post["image"]
+                post_item["image_meta"] = existing_post.get("image_meta")
+            print(f"\n錯誤：[{channel.username}] 訊息 ID {post_item['id']} 的圖片在重試後仍無法處理 ({type(error).__name__}: {error})，"
+                  f"下次運行會重新處理。")
+
+        changed_count = 0
+        abandoned_ids = []
+
+        def save_progress(last_id=None):
+            """以已提交的訊息推進 watermark 並保存狀態與圖片索引。
+
+            last_id 為這批最後一則貼文的 ID：只推進到它 (含之前被跳過的未變動訊息)；None 表示本次讀入的全部訊息。
+            """
+            nonlocal state
+            end = len(seen_edit_dates)
+            if last_id is not None:
+                end = next(i for i, (msg_id, _) in enumerate(seen_edit_dates) if msg_id == last_id) + 1
+            state = import_state.advance(state, seen_edit_dates[:end], cfg.edit_lookback_messages)
+            del seen_edit_dates[:end]
+            import_state.save_state(state, channel.import_state_file)
+            if images.changed:
+                images.save()
+            if synced_state is not None:
+                # 定期上傳到 bucket，工作被執行時限終止時下一次運行 (新的容器) 也能從這裡繼續
+                with metrics.timer("state_upload"):
+                    synced_state.checkpoint()
+
+        def commit(posts):
+            """把一批處理完成的貼文寫入資料庫並推進 watermark (工作被終止時從這裡繼續)。"""
+            nonlocal changed_count
+            with metrics.timer("commit"):
+                # 以訊息 ID upsert，回看窗口中被編輯過的貼文會覆蓋舊版本
+                changed_count += store.upsert(posts)
+                ids = [post["id"] for post in posts]
+                abandoned_ids.extend(import_state.update_pending(
+                    state, [i for i in ids if i in failed_ids], [i for i in ids if i not in failed_ids], cfg.image_retry_runs
+                ))
+                save_progress(ids[-1])
+            metrics.incr("checkpoints")
+
+        def show_progress(processed_count):
+            # 顯示進度與實際處理速度 (單行更新)
+            elapsed = metrics.stage_elapsed()
+            rate = processed_count / elapsed if elapsed > 0 else 0
+            print(f"[{channel.username}] 處理進度: 已處理 {processed_count} 筆新的或已編輯的訊息 ({rate:.1f} 則/秒)...",
+                  end='\r')
+
+        # --- 抓取訊息、處理圖片，並分批寫入資料庫 ---
+        # 每批提交後立即推進 watermark：工作被 Cloud Run 的執行時限終止時，下次從最後提交的訊息繼續
+        summary = {"ok": False, "processed": 0, "changed": 0}
+        try:
+            summary["processed"] = await media_pipeline.run_media_pipeline(
+                messages_since_watermark(), plan, download, upload, commit,
+                download_workers=cfg.download_concurrency,
+                upload_workers=cfg.upload_concurrency,
+                on_progress=show_progress,
+                on_failure=on_media_failure,
+                commit_every=cfg.checkpoint_every,
+                commit_interval=cfg.checkpoint_interval_seconds,
+            )
+            # 最後一批貼文之後若還有被跳過的未變動訊息，也一併記錄
+            save_progress()
+            summary["ok"] = True
+        except Exception as e:
+            print(f"\n錯誤：[{channel.username}] 抓取或處理訊息時失敗: {e}")
+            print(f"[{channel.username}] watermark 停在最後提交的訊息 ID {state['last_message_id']}，下次運行會從這裡繼續。")
+
+        summary["changed"] = changed_count
+        summary["watermark"] = state["last_message_id"]
+        print(f"\n[{channel.username}] 本次處理 {summary['processed']} 則訊息，資料庫中有 {changed_count} 筆新增或更新；"
+              f"watermark 為訊息 ID {state['last_message_id']}。")
+        pending = import_state.pending_image_ids(state)
+        if pending:
+            summary["pending_image_ids"] = pending
+            print(f"警告：[{channel.username}] {len(pending)} 則訊息的圖片尚未成功處理，下次運行會重新處理："
+                  f"{', '.join(map(str, pending))}")
+        if abandoned_ids:
+            summary["abandoned_image_ids"] = abandoned_ids
+            metrics.incr("images_abandoned", len(abandoned_ids))
+            print(f"錯誤：[{channel.username}] 以下訊息的圖片已在 {cfg.image_retry_runs} 次運行中都失敗，"
+                  f"不再自動重試 (需要人工處理)：{', '.join(map(str, abandoned_ids))}")
+        return summary
+
+    # --- 所有頻道共用同一個 Telethon 客戶端同時匯入 ---
+    # 每個頻道有自己的管線 (併發上限為每個頻道各自計算)、watermark 與資料庫；
+    # Telegram 與 ImgBB 的速率控制器則由所有頻道共用，整體請求速率不會因為頻道變多而超過上限。
+    summaries = await asyncio.gather(*(ingest(channel) for channel in channels))
+    channel_reports = {channel.username: summary for channel, summary in zip(channels, summaries)}
+    metrics.incr("posts_processed", sum(summary["processed"] for summary in summaries))
+    metrics.incr("posts_changed", sum(summary["changed"] for summary in summaries))
+    metrics.info["channels"] = channel_reports
+    metrics.info["rate_control"] = {limiter.name: limiter.stats() for limiter in (telegram_limiter, imgbb_limiter)}
+    ingest_ok = all(summary["ok"] for summary in summaries) and len(channels) == len(cfg.channels)
+    metrics.checkpoint("fetch_and_media")
+
+    # --- 輸出 JSON 檔案 ---
+    # 回補的分區 (cfg.message_id_range) 只寫入自己的資料庫，由最後的合併步驟統一輸出
+    outputs_ok = cfg.message_id_range is not None or export_outputs(cfg, stores, metrics, ingest_ok=ingest_ok)
+    # 有頻道匯入失敗時，已提交的貼文仍會輸出，但本次運行視為失敗
+    metrics.ok = ingest_ok and outputs_ok
 
-    # 4. 對所有數據進行排序：按日期降序，如果日期相同，則按 ID 降序 (最新的在最上面)
-    final_posts.sort(key=lambda x: (
-        datetime.datetime.strptime(x['date'], '%Y-%m-%d'), 
-        x.get('id', 0) # 如果有 id 則用 id 排序，否則用 0 (確保穩定性)
-    ), reverse=True) # <--- 關鍵的 reverse=True 實現降序排列
-    
-    print(f"共擷取並準備寫入 {len(final_posts)} 筆資料。")
-    
-    print(f"正在寫入 {OUTPUT_JSON_FILE} ...")
     try:
-        with open(OUTPUT_JSON_FILE, "w", encoding="utf-8") as f:
-            json.dump(final_posts, f, ensure_ascii=False, indent=2)
-        print("完成！數據已儲存。")
+        images.save()
+        print(f"圖片索引已儲存 (命中 {images.hits} 次，未命中 {images.misses} 次)。")
     except Exception as e:
-        print(f"錯誤：寫入 {OUTPUT_JSON_FILE} 失敗: {e}")
+        print(f"警告：寫入 {cfg.image_index_file} 失敗: {e}")
+    close_stores()
+    if not save_state(synced_state, metrics, cfg, outputs_ok=outputs_ok):
+        metrics.ok = False
+    metrics.checkpoint("finalize")
     
     end_time = time.time() # 記錄結束時間
     total_duration = end_time - start_time
     print(f"--- 腳本結束運行於：{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
     print(f"總耗時：{total_duration:.2f} 秒")
+    print("各階段耗時：" + "、".join(f"{stage} {seconds:.2f} 秒" for stage, seconds in metrics.stages.items()))
+    return finish()
+
+def run(cfg=None):
+    """以 anon.session 連線 Telegram 並執行一次匯入 (Cloud Run Job 與 `python cli.py import` 的進入點)。
+
+    Telethon 只在這裡才載入。返回本次運行的報告。
+    """
+    config.load_env()
+    api_id = check_required_env(cfg)
+    cfg = cfg or config.ImporterConfig()
+    from telethon import TelegramClient
+
+    # Telethon 客戶端初始化
+    # 'anon' 會是 session 檔案名 (anon.session)。
+    # 確保這個 anon.session 檔案存在且有效，否則 Telethon 會嘗試重新登入（需要電話驗證）。
+    # 傳遞的 API_ID 和 API_HASH 必須與生成 anon.session 時所用的憑證匹配。
+    client = TelegramClient('anon', api_id, cfg.api_hash)
+    with client:
+        return client.loop.run_until_complete(main(client, cfg=cfg))
 
 # 運行主程式
-with client:
-    client.loop.run_until_complete(main())
+if __name__ == "__main__":
+    run()
@@ -1,33 +1,9 @@
 # export_session.py (最终修正版 - 保证输出正确的 Session String)
 
-import os
-from dotenv import load_dotenv
-from telethon import TelegramClient
-# 导入 StringSession，我们将用它来转换
-from telethon.sessions import StringSession
+import config
 
-# 加载 .env 文件中的配置
-load_dotenv()
-API_ID = os.getenv("TELEGRAM_API_ID")
-API_HASH = os.getenv("TELEGRAM_API_HASH")
 
-# 确保配置存在
-if not all([API_ID, API_HASH]):
-    print("错误: 请确保 .env 文件中有 TELEGRAM_API_ID 和 TELEGRAM_API_HASH")
-    exit(1)
-    
-try:
-    API_ID = int(API_ID)
-except ValueError:
-    print("错误: TELEGRAM_API_ID 必须是数字。")
-    exit(1)
-
-# 【核心修改】直接以 StringSession 模式启动
-# 我们不需要 'anon.session' 文件了。脚本会直接在内存中处理 session，并打印出来。
-# 如果是第一次运行，它会要求登录，登录成功后直接打印出可用的 session string。
-client = TelegramClient(StringSession(), API_ID, API_HASH)
-
-async def main():
+async def login_and_print(client):
     # 连接客户端
     await client.connect()
 
@@ -66,8 +42,30 @@ async def main():
     print("复制完成后，请将它更新到 Secret Manager 中。")
     print("="*50 + "\n")
 
-# 使用 client.run_until_disconnected() 来运行，更适合交互式会话
-# 注意：这个脚本在打印出 session 后不会自动退出，您需要手动按 Ctrl+C 来结束它。
-if __name__ == '__main__':
+
+def main():
+    """互動式登入 Telegram 並印出 StringSession。設定缺少時返回 1。"""
+    # 載入 .env 檔案中的設定，並確認 TELEGRAM_API_ID (數字) 與 TELEGRAM_API_HASH 存在
+    config.load_env()
+    try:
+        api_id, api_hash = config.telegram_credentials()
+    except config.ConfigError as e:
+        print(f"錯誤: {e}")
+        return 1
+
+    # Telethon 只在真正需要登入時才載入
+    from telethon import TelegramClient
+    # 导入 StringSession，我们将用它来转换
+    from telethon.sessions import StringSession
+
+    # 【核心修改】直接以 StringSession 模式启动
+    # 我们不需要 'anon.session' 文件了。脚本会直接在内存中处理 session，并打印出来。
+    # 如果是第一次运行，它会要求登录，登录成功后直接打印出可用的 session string。
+    client = TelegramClient(StringSession(), api_id, api_hash)
     with client:
-        client.loop.run_until_complete(main())
\ No newline at end of file
+        client.loop.run_until_complete(login_and_print(client))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
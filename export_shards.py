@@ -0,0 +1,135 @@
+# export_shards.py
+# 將完整的貼文列表輸出為「按月分片」的檔案：
+#   posts/2025-08.json ...   每個月一個分片 (由新到舊排序)
+#   posts/manifest.json      分片清單，每個分片附上 SHA-256 與貼文數
+#   latest.json              最新的 N 則貼文，給首頁首屏與推播使用
+# 只有內容真的改變的分片才會被重寫，未改變的檔案保持原樣 (連修改時間都不動)。
+# manifest.json 只由分片清單決定 (不含產生時間)，內容相同的匯出不會改寫它，上傳時也會被略過。
+
+import hashlib
+import json
+import os
+
+SHARDS_DIR = "posts"
+MANIFEST_FILE_NAME = "manifest.json"
+LATEST_JSON_FILE = "latest.json"
+MANIFEST_FORMAT_VERSION = 1
+
+
+def serialize_posts(posts) -> bytes:
+    """分片與 latest.json 使用緊湊格式：不縮排、保留中文字元。"""
+    return json.dumps(posts, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def shard_key(post) -> str:
+    """貼文所屬的月份分片 (YYYY-MM)。沒有日期的貼文歸入 'undated'。"""
+    date = post.get("date") or ""
+    return date[:7] if len(date) >= 7 else "undated"
+
+
+def _write_if_changed(path: str, data: bytes) -> bool:
+    """內容與磁碟上的檔案相同時不寫入。返回是否真的寫入。"""
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
+
+
+def load_manifest(shards_dir: str = SHARDS_DIR):
+    path = os.path.join(shards_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        print(f"警告：{path} 不是有效的 JSON，將重新產生所有分片。")
+        return None
+
+
+def write_shards(posts, shards_dir: str = SHARDS_DIR, latest_path: str = LATEST_JSON_FILE,
+                 latest_count: int = 20) -> dict:
+    """輸出分片、manifest 與 latest.json。
+
+    posts 可以是任何可迭代物件 (例如 PostStore.iter_posts())，但必須已依「日期降序、ID 降序」排好
+    (與 posts.json 相同)，分片內會保留這個順序。處理時一次只在記憶體中保留一個月份的貼文。
+    返回統計資訊：{"written": [...], "unchanged": n, "removed": [...], "latest_written": bool, "manifest_written": bool}
+    """
+    os.makedirs(shards_dir, exist_ok=True)
+    previous = load_manifest(shards_dir) or {}
+    previous_hashes = {shard["month"]: shard["sha256"] for shard in previous.get("shards", [])}
+
+    manifest_shards = []
+    written, unchanged = [], 0
+    latest_posts = []
+    total = 0
+
+    def flush(month, shard_posts):
+        nonlocal unchanged
+        data = serialize_posts(shard_posts)
+        digest = hashlib.sha256(data).hexdigest()
+        file_name = f"{month}.json"
+        path = os.path.join(shards_dir, file_name)
+        # manifest 記錄的雜湊相同且檔案仍在，就完全不碰這個分片
+        if previous_hashes.get(month) == digest and os.path.exists(path):
+            unchanged += 1
+        elif _write_if_changed(path, data):
+            written.append(file_name)
+        else:
+            unchanged += 1
+        manifest_shards.append({"month": month, "file": file_name, "sha256": digest, "count": len(shard_posts)})
+
+    current_month, shard_posts = None, []
+    for post in posts:
+        total += 1
+        if len(latest_posts) < latest_count:
+            latest_posts.append(post)
+        month = shard_key(post)
+        if month != current_month and shard_posts:
+            flush(current_month, shard_posts)
+            shard_posts = []
+        current_month = month
+        shard_posts.append(post)
+    if shard_posts:
+        flush(current_month, shard_posts)
+
+    # 移除已不存在的月份分片 (例如貼文被刪光)
+    months = {shard["month"] for shard in manifest_shards}
+    removed = []
+    for month in previous_hashes:
+        if month not in months:
+            path = os.path.join(shards_dir, f"{month}.json")
+            if os.path.exists(path):
+                os.remove(path)
+            removed.append(f"{month}.json")
+
+    latest_written = _write_if_changed(latest_path, serialize_posts(latest_posts))
+
+    manifest = {
+        "version": MANIFEST_FORMAT_VERSION,
+        "total": total,
+        "latest": os.path.basename(latest_path),
+        "shards": manifest_shards,
+    }
+    manifest_written = _write_if_changed(os.path.join(shards_dir, MANIFEST_FILE_NAME),
+                                         json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+
+    return {"written": written, "unchanged": unchanged, "removed": removed, "latest_written": latest_written,
+            "manifest_written": manifest_written}
+
+
+def read_shards(shards_dir: str = SHARDS_DIR):
+    """依 manifest 的順序讀回所有分片，重組成與 posts.json 相同的完整列表。"""
+    manifest = load_manifest(shards_dir)
+    if manifest is None:
+        return []
+    posts = []
+    for shard in manifest["shards"]:
+        with open(os.path.join(shards_dir, shard["file"]), "r", encoding="utf-8") as f:
+            posts.extend(json.load(f))
+    return posts
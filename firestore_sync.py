@@ -0,0 +1,176 @@
+# firestore_sync.py
+# 把貼文資料庫增量同步到 Firestore 的 posts 集合 (取代每次重寫所有文件的 import-to-firestore.js)：
+#   - 文件 ID 與 import-to-firestore.js 相同：YYYY-MM-DD_XXXXX (原始 ID 左側補零到 5 位)；
+#     非主頻道的貼文在後面加上 _<頻道>，避免不同頻道的同一個訊息 ID 互相覆蓋
+#   - 每篇文件寫入 content_hash 欄位；上一次同步的雜湊保存在 firestore_sync_state.json，
+#     只有雜湊改變的貼文才寫入，資料庫中已不存在的貼文 (例如日期被修改) 刪除對應的文件
+#   - 只刪除狀態檔中記錄的文件 (也就是這個匯入程式曾經同步過的貼文)，集合中其他來源寫入的文件不會被刪除
+#   - 狀態檔不存在時 (例如全新的容器) 以只讀 content_hash 欄位的查詢從 Firestore 重建，不必重寫所有文件；
+#     重建時不刪除任何文件 (無法分辨哪些文件是這個程式寫入的)，只記錄資料庫中存在的貼文
+#   - 匯入失敗時 (allow_deletes=False) 資料庫可能不完整，不刪除文件，待刪除的文件留在狀態檔中，下次運行再處理
+#   - 以 BulkWriter 寫入：內建 500/50/5 的流量控制 (從每秒 500 次開始，每 5 分鐘增加 50%)
+#     與指數退避重試；重試用盡的文件不更新狀態，下次運行會再寫一次
+# firebase-admin 只在實際同步時才載入；設定 FIRESTORE_EMULATOR_HOST 時會連到本地模擬器。
+
+import json
+import os
+import threading
+
+from delta_feed import post_signature
+
+FIRESTORE_COLLECTION = "posts"
+FIRESTORE_SYNC_STATE_FILE = "firestore_sync_state.json"
+SYNC_STATE_FORMAT_VERSION = 1
+# 與 import-to-firestore.js 的 RAW_ID_PAD_LENGTH 保持一致
+RAW_ID_PAD_LENGTH = 5
+# BulkWriter 的流量控制：初始每秒寫入數，之後每 5 分鐘增加 50% 直到上限
+DEFAULT_INITIAL_OPS_PER_SECOND = 500
+DEFAULT_MAX_OPS_PER_SECOND = 10000
+
+
+def composite_id(post) -> str:
+    """Firestore 文件 ID：YYYY-MM-DD_XXXXX，非主頻道的貼文加上 _<頻道>。缺少日期或 ID 時返回 None。"""
+    raw_id, date = post.get("id"), post.get("date")
+    if raw_id is None or str(raw_id).strip() == "" or not date or str(date).strip() == "":
+        return None
+    doc_id = f"{date}_{str(raw_id).rjust(RAW_ID_PAD_LENGTH, '0')}"
+    return f"{doc_id}_{post['channel']}" if post.get("channel") else doc_id
+
+
+def document_data(post, doc_id: str) -> dict:
+    """寫入 Firestore 的欄位 (與 import-to-firestore.js 相同，另加 channel 與 content_hash)。"""
+    data = {"id": doc_id, "date": post["date"], "text": post.get("text") or "", "image": post.get("image") or ""}
+    if post.get("channel"):
+        data["channel"] = post["channel"]
+    data["content_hash"] = post_signature(data)
+    return data
+
+
+def load_state(path: str, collection: str):
+    """返回上一次同步到 collection 的 {文件 ID: content_hash}；狀態檔不存在、無效或屬於其他集合時返回 None。"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except json.JSONDecodeError:
+        print(f"警告：{path} 不是有效的 JSON，將從 Firestore 重建同步狀態。")
+        return None
+    if state.get("version") != SYNC_STATE_FORMAT_VERSION or state.get("collection") != collection:
+        return None
+    return state.get("hashes") or {}
+
+
+def save_state(path: str, collection: str, hashes: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": SYNC_STATE_FORMAT_VERSION, "collection": collection, "hashes": hashes},
+                  f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def make_client():
+    """以預設憑證 (Cloud Run 的服務帳號或 GOOGLE_APPLICATION_CREDENTIALS) 建立 Firestore 客戶端。"""
+    import firebase_admin
+    from firebase_admin import firestore
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_admin.initialize_app()
+    return firestore.client()
+
+
+def fetch_remote_hashes(client, collection: str) -> dict:
+    """只讀取每篇文件的 content_hash 欄位 (沒有這個欄位的舊文件會被視為需要重寫)。"""
+    hashes = {}
+    for snapshot in client.collection(collection).select(["content_hash"]).stream():
+        hashes[snapshot.id] = (snapshot.to_dict() or {}).get("content_hash")
+    return hashes
+
+
+def sync_posts(posts, client=None, collection: str = FIRESTORE_COLLECTION, state_path: str = FIRESTORE_SYNC_STATE_FILE,
+               initial_ops_per_second: int = DEFAULT_INITIAL_OPS_PER_SECOND,
+               max_ops_per_second: int = DEFAULT_MAX_OPS_PER_SECOND, max_attempts: int = 5,
+               allow_deletes: bool = True) -> dict:
+    """把 posts (任意順序的可迭代物件) 同步到 Firestore 的 collection。
+
+    allow_deletes 為 False 時 (例如本次匯入失敗) 只寫入，不刪除任何文件。
+    返回 {"written", "deleted", "deletes_deferred", "unchanged", "skipped", "failed", "bootstrapped"}。
+    """
+    from google.cloud.firestore_v1.bulk_writer import BulkRetry, BulkWriterOptions
+
+    client = client or make_client()
+    previous = load_state(state_path, collection)
+    bootstrapped = previous is None
+    if bootstrapped:
+        print(f"沒有 Firestore 同步狀態，從 {collection} 集合讀取現有文件的 content_hash ...")
+        previous = fetch_remote_hashes(client, collection)
+
+    writer = client.bulk_writer(options=BulkWriterOptions(
+        initial_ops_per_second=initial_ops_per_second, max_ops_per_second=max_ops_per_second,
+        retry=BulkRetry.exponential,
+    ))
+    lock = threading.Lock()
+    succeeded, failed = set(), set()
+
+    def on_result(reference, result, bulk_writer):
+        with lock:
+            succeeded.add(reference.id)
+
+    def on_error(failure, bulk_writer) -> bool:
+        # attempts 為已重試的次數 (第一次失敗時為 0)
+        if failure.attempts + 1 < max_attempts:
+            return True
+        print(f"錯誤：寫入 Firestore 文件 {failure.operation.reference.id} 失敗 ({failure.code}): {failure.message}")
+        with lock:
+            failed.add(failure.operation.reference.id)
+        return False
+
+    writer.on_write_result(on_result)
+    writer.on_write_error(on_error)
+
+    posts_collection = client.collection(collection)
+    current = {} # 文件 ID → 本次的 content_hash
+    written, skipped = {}, 0
+    try:
+        for post in posts:
+            doc_id = composite_id(post)
+            if doc_id is None:
+                skipped += 1
+                continue
+            data = document_data(post, doc_id)
+            current[doc_id] = data["content_hash"]
+            if previous.get(doc_id) != data["content_hash"]:
+                writer.set(posts_collection.document(doc_id), data)
+                written[doc_id] = data["content_hash"]
+        # 重建狀態時 previous 是集合中的所有文件，其中可能有不是這個程式寫入的文件，因此不刪除
+        stale = [] if bootstrapped else [doc_id for doc_id in previous if doc_id not in current]
+        deleted = stale if allow_deletes else []
+        for doc_id in deleted:
+            writer.delete(posts_collection.document(doc_id))
+    finally:
+        # 等待所有寫入 (含重試) 完成。先 flush 再 close：close() 會先拒絕新的操作，
+        # 在 flush 期間排程的重試會因此失敗
+        writer.flush()
+        writer.close()
+
+    # 成功的寫入與刪除更新到狀態；失敗的文件維持上一次的雜湊 (或不記錄)，下次運行會重試
+    hashes = {doc_id: previous[doc_id] for doc_id in previous
+              if doc_id in current and previous[doc_id] is not None}
+    for doc_id in stale:
+        # 刪除失敗或延後的文件留在狀態中，下次運行再刪除
+        if doc_id not in deleted or doc_id in failed:
+            hashes[doc_id] = previous[doc_id] or ""
+    for doc_id, content_hash in written.items():
+        if doc_id in succeeded and doc_id not in failed:
+            hashes[doc_id] = content_hash
+        else:
+            hashes.pop(doc_id, None)
+    if bootstrapped or written or deleted:
+        save_state(state_path, collection, hashes)
+
+    return {"written": len(written) - len(failed & written.keys()),
+            "deleted": len([doc_id for doc_id in deleted if doc_id not in failed]),
+            "deletes_deferred": len(stale) - len(deleted),
+            "unchanged": len(current) - len(written), "skipped": skipped,
+            "failed": sorted(failed), "bootstrapped": bootstrapped}
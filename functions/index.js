@@ -12,6 +12,8 @@ const cors = require('cors');
 const webpush = require('web-push');
 const { JobsClient } = require('@google-cloud/run');
 const axios = require('axios'); // 確保已引入 axios
+const { sendToAllSubscribers, optionsFromEnv, intFromEnv } = require('./pushFanout');
+const { HeartbeatCoalescer, SubscriptionCounter, cleanupStaleSubscriptions } = require('./subscriptions');
 
 // 【新增】定義 app 變數
 const app = express(); // <--- 這裡已經修正了
@@ -48,6 +50,21 @@ function safeEncode(str) {
   return Buffer.from(str).toString('base64').replace(/\//g, '_');
 }
 
+// --- 訂閱記錄的讀寫成本控制 (實作見 subscriptions.js) ---
+// 同一個 endpoint 在這段時間內最多寫入一次 lastSeen (前端也以相同間隔節流)
+const HEARTBEAT_WINDOW_MS = intFromEnv('HEARTBEAT_WINDOW_HOURS', 12) * 60 * 60 * 1000;
+// 每個執行個體最多記住的 endpoint 數量，超過時淘汰最舊的記錄
+const HEARTBEAT_CACHE_MAX_ENTRIES = intFromEnv('HEARTBEAT_CACHE_MAX_ENTRIES', 10000);
+// 訂閱數的快取秒數 (計數使用 Firestore 伺服器端 count() 聚合，不讀取文件內容)
+const SUBSCRIPTION_COUNT_CACHE_MS = intFromEnv('SUBSCRIPTION_COUNT_CACHE_SECONDS', 300) * 1000;
+// 超過這個天數沒有心跳的訂閱視為殭屍訂閱
+const SUBSCRIPTION_STALE_DAYS = intFromEnv('SUBSCRIPTION_STALE_DAYS', 30);
+// 清理時每次查詢與刪除的文件數 (不超過 Firestore batch 的 500 筆上限)
+const CLEANUP_CHUNK_SIZE = Math.min(intFromEnv('CLEANUP_CHUNK_SIZE', 400), 500);
+
+const heartbeats = new HeartbeatCoalescer({ windowMs: HEARTBEAT_WINDOW_MS, maxEntries: HEARTBEAT_CACHE_MAX_ENTRIES });
+const subscriptionCounter = new SubscriptionCounter({ db, cacheMs: SUBSCRIPTION_COUNT_CACHE_MS });
+
 // --- VAPID 金鑰初始化 (從 process.env 讀取) ---
 try {
   const vapidPublicKey = process.env.VAPID_PUBLIC_KEY;
@@ -74,40 +91,29 @@ try {
 
 // 【核心輔助函數】負責發送實際的推播通知
 /**
- * 向所有訂閱者發送推播通知。
- * 會自動處理失效的訂閱 (HTTP 404/410)。
+ * 向所有訂閱者發送推播通知 (分頁讀取、限制並行數量，實作見 pushFanout.js)。
+ * 會自動批次刪除失效的訂閱 (HTTP 404/410)。
  * @param {object} payload - 推播通知的內容物件 (會被 JSON.stringify 處理)。
- * @returns {Promise<object>} - 包含狀態、訊息和嘗試發送訂閱數的物件。
+ * @returns {Promise<object>} - 包含狀態、訊息、嘗試發送訂閱數與發送統計的物件。
  */
 async function sendPushNotificationsToSubscribers(payload) { // 移除 res 參數，使其更通用
   try {
-    const snapshot = await db.collection('subscriptions').get();
-    if (snapshot.empty) {
+    const stats = await sendToAllSubscribers({
+      db,
+      payload,
+      sender: webpush.sendNotification.bind(webpush),
+      options: optionsFromEnv(),
+    });
+    if (stats.pruned > 0) subscriptionCounter.invalidate();
+    if (stats.total === 0) {
       console.log("沒有找到任何訂閱者。");
-      return { status: 200, message: "No subscribers to notify." };
+      return { status: 200, message: "No subscribers to notify.", count: 0, stats };
     }
-    
-    const subscriptions = snapshot.docs.map(doc => doc.data());
-    const pushPromises = subscriptions.map(sub => 
-        webpush.sendNotification(sub, JSON.stringify(payload)).catch(async (err) => { 
-            if (err.statusCode === 404 || err.statusCode === 410) {
-                // 偵測到失效訂閱，自動從 Firestore 刪除
-                const docIdToDelete = safeEncode(err.endpoint || sub.endpoint);
-                if(docIdToDelete) {
-                    await db.collection('subscriptions').doc(docIdToDelete).delete();
-                    console.log(`偵測並刪除了失效的訂閱: ${docIdToDelete}`);
-                }
-            } else {
-                console.error('發送推播失敗 (非 404/410):', err.statusCode, err.body);
-            }
-        })
-    );
-    
-    await Promise.all(pushPromises);
-    
-    const message = `推播任務完成，嘗試發送給 ${subscriptions.length} 位訂閱者。`;
+
+    const message = `推播任務完成，嘗試發送給 ${stats.total} 位訂閱者：成功 ${stats.sent}、失敗 ${stats.failed}、` +
+      `刪除失效訂閱 ${stats.pruned} (p50 ${stats.latencyMs.p50?.toFixed(0)} ms / p95 ${stats.latencyMs.p95?.toFixed(0)} ms)。`;
     console.log(message);
-    return { status: 200, message: message, count: subscriptions.length }; // 回傳訂閱數
+    return { status: 200, message: message, count: stats.total, stats }; // 回傳訂閱數與統計
 
   } catch (error) {
     console.error("處理推播通知發送時發生嚴重錯誤:", error);
@@ -144,6 +150,8 @@ app.post('/subscribe', async (req, res) => {
       lastSeen: admin.firestore.FieldValue.serverTimestamp(),
     };
     await db.collection('subscriptions').doc(docId).set(dataToSave);
+    heartbeats.remember(docId, Date.now());
+    subscriptionCounter.invalidate();
     console.log("成功儲存訂閱，文件 ID:", docId);
     res.status(201).json({ message: "Subscription added successfully." });
   } catch (error) {
@@ -161,6 +169,8 @@ app.post('/unsubscribe', async (req, res) => {
   try {
     const docId = safeEncode(endpoint);
     await db.collection('subscriptions').doc(docId).delete();
+    heartbeats.forget(docId);
+    subscriptionCounter.invalidate();
     res.status(200).json({ message: "Subscription removed successfully." });
   } catch (error) {
     console.error("Firestore 刪除失敗:", error);
@@ -176,9 +186,15 @@ app.post('/heartbeat', async (req, res) => {
   }
   try {
     const docId = safeEncode(endpoint);
+    const now = Date.now();
+    if (heartbeats.isCoalesced(docId, now)) {
+      // 本執行個體在時間窗口內已寫入過，合併為一次寫入 (清理門檻以天計，不需要更精確的 lastSeen)
+      return res.status(200).json({ message: "Heartbeat coalesced." });
+    }
     await db.collection('subscriptions').doc(docId).update({
       lastSeen: admin.firestore.FieldValue.serverTimestamp()
     });
+    heartbeats.remember(docId, now);
     res.status(200).json({ message: "Heartbeat successful." });
   } catch (error) {
     // 裝置可能已清除資料或為新的，更新失敗是正常情況，回應 200
@@ -206,7 +222,7 @@ app.post('/send-daily-notification', async (req, res) => {
 
   // 呼叫核心輔助函數發送推播
   const result = await sendPushNotificationsToSubscribers(payload);
-  res.status(result.status).json({ message: result.message, details: result.details, count: result.count });
+  res.status(result.status).json({ message: result.message, details: result.details, count: result.count, stats: result.stats });
 });
 
 // 手動觸發今天的最新貼文推播 API (通常用於管理介面或排程)
@@ -215,6 +231,9 @@ app.post('/manual-daily-notification', async (req, res) => {
 
   const POSTS_JSON_URL = process.env.POSTS_JSON_URL;
   const PWA_BASE_URL = process.env.PWA_BASE_URL;
+  // 只含最新 N 則貼文的 latest.json，推播只需要第一則，不必下載整個 posts.json
+  const LATEST_JSON_URL = process.env.LATEST_JSON_URL ||
+    (POSTS_JSON_URL ? POSTS_JSON_URL.replace(/posts\.json$/, 'latest.json') : null);
 
   if (!POSTS_JSON_URL || !PWA_BASE_URL) {
       console.error('錯誤：環境變數 POSTS_JSON_URL 或 PWA_BASE_URL 未設定。');
@@ -222,9 +241,20 @@ app.post('/manual-daily-notification', async (req, res) => {
   }
 
   try {
-      // 1. 從設定的 URL (通常是 Firebase Storage) 獲取最新的 posts.json
-      const response = await axios.get(POSTS_JSON_URL, { timeout: 15000 }); // 增加超時時間以確保穩定性
-      const allPosts = response.data;
+      // 1. 從設定的 URL (通常是 Firebase Storage) 獲取最新貼文，優先使用 latest.json
+      let allPosts = null;
+      if (LATEST_JSON_URL && LATEST_JSON_URL !== POSTS_JSON_URL) {
+        try {
+          const latestResponse = await axios.get(LATEST_JSON_URL, { timeout: 15000 });
+          allPosts = latestResponse.data;
+        } catch (latestError) {
+          console.warn(`無法獲取 latest.json (${latestError.message})，改為下載完整的 posts.json。`);
+        }
+      }
+      if (!Array.isArray(allPosts) || allPosts.length === 0) {
+        const response = await axios.get(POSTS_JSON_URL, { timeout: 15000 }); // 增加超時時間以確保穩定性
+        allPosts = response.data;
+      }
 
       if (!Array.isArray(allPosts) || allPosts.length === 0) {
           console.log("posts.json 是空的或格式不正確，沒有文章可以推播。");
@@ -243,7 +273,7 @@ app.post('/manual-daily-notification', async (req, res) => {
 
       // 3. 呼叫核心推播發送輔助函數
       const result = await sendPushNotificationsToSubscribers(pushPayload);
-      res.status(result.status).json({ message: result.message, details: result.details, count: result.count });
+      res.status(result.status).json({ message: result.message, details: result.details, count: result.count, stats: result.stats });
 
   } catch (error) {
       console.error("手動觸發推播時發生錯誤:", error);
@@ -264,9 +294,9 @@ app.post('/manual-daily-notification', async (req, res) => {
 app.get('/subscription-count', async (req, res) => {
   console.log("收到取得訂閱數量的請求。");
   try {
-    const snapshot = await db.collection('subscriptions').get();
-    const count = snapshot.size;
+    const count = await subscriptionCounter.get();
     console.log(`目前訂閱數為: ${count}`);
+    res.set('Cache-Control', `public, max-age=${Math.floor(SUBSCRIPTION_COUNT_CACHE_MS / 1000)}`);
     res.status(200).json({ count: count });
   } catch (error) {
     console.error("取得訂閱數失敗:", error);
@@ -283,30 +313,32 @@ exports.api = onRequest(app);
 // ==========================================================
 exports.cleanupzombiesubscriptions = onSchedule("every day 04:00", async (event) => {
   console.log("開始執行每日殭屍訂閱清理任務...");
-  const threeDaysAgo = new Date();
-  threeDaysAgo.setDate(threeDaysAgo.getDate() - 30); // 30 天前
-  const threeDaysAgoTimestamp = admin.firestore.Timestamp.fromDate(threeDaysAgo);
+  const staleBefore = new Date();
+  staleBefore.setDate(staleBefore.getDate() - SUBSCRIPTION_STALE_DAYS); // 預設 30 天前
+  const staleBeforeTimestamp = admin.firestore.Timestamp.fromDate(staleBefore);
 
+  let deleted = 0;
   try {
-    // 查詢 'lastSeen' 時間戳早於30天前的訂閱
-    const oldSubscriptionsQuery = db.collection('subscriptions').where('lastSeen', '<', threeDaysAgoTimestamp);
-    const snapshot = await oldSubscriptionsQuery.get();
+    // 分段查詢 'lastSeen' 早於門檻的訂閱，每段最多 CLEANUP_CHUNK_SIZE 筆並以單一 batch 刪除
+    await cleanupStaleSubscriptions({
+      db,
+      staleBefore: staleBeforeTimestamp,
+      chunkSize: CLEANUP_CHUNK_SIZE,
+      onDeleted: (docIds) => {
+        docIds.forEach((docId) => heartbeats.forget(docId));
+        deleted += docIds.length;
+      },
+    });
 
-    if (snapshot.empty) {
+    if (deleted === 0) {
       console.log("沒有找到需要清理的過期訂閱。");
-      return null;
+    } else {
+      subscriptionCounter.invalidate();
+      console.log(`成功刪除了 ${deleted} 個過期的殭屍訂閱。`);
     }
-    
-    // 批量刪除過期訂閱以提高效率
-    const batch = db.batch();
-    snapshot.forEach(doc => {
-      batch.delete(doc.ref);
-    });
-    await batch.commit();
-    console.log(`成功刪除了 ${snapshot.size} 個過期的殭屍訂閱。`);
     return null;
   } catch (error) {
-    console.error("清理殭屍訂閱任務失敗:", error);
+    console.error(`清理殭屍訂閱任務失敗 (已刪除 ${deleted} 個):`, error);
     return null;
   }
 });
@@ -0,0 +1,209 @@
+// functions/pushFanout.js
+// 推播發送引擎：分頁讀取 subscriptions、限制同時發送數量、處理 Retry-After，
+// 並把失效的訂閱 (HTTP 404/410) 集中成批次刪除。
+//
+// Firestore 與 web-push 都由呼叫端傳入，因此可以直接對 Firestore 模擬器
+// 與本機的假推播伺服器 (sender 換成對 stub 發送的函數) 執行；
+// 本模組不直接載入 firebase-admin，測試 (test/pushFanout.test.js) 以記憶體中的假 Firestore 執行。
+
+const https = require('https');
+
+// 依文件 ID 排序的欄位名稱 (與 FieldPath.documentId() 相同)
+const DOCUMENT_ID_FIELD = '__name__';
+
+const DEFAULT_OPTIONS = {
+  pageSize: 500,          // 每次從 Firestore 讀取的訂閱數
+  concurrency: 50,        // 同時進行中的推播請求上限 (也是 HTTPS 連線池大小)
+  maxRetries: 2,          // 429 / 5xx 時的重試次數
+  maxRetryAfterSeconds: 30, // Retry-After 過長時不等待，直接記為失敗
+  ttl: 24 * 60 * 60,      // 推播服務保留訊息的秒數
+};
+
+// Firestore 單一 batch 最多 500 個操作
+const MAX_BATCH_WRITES = 500;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+/**
+ * 解析 Retry-After 標頭 (秒數或 HTTP 日期)，返回毫秒數；無法解析時返回 null。
+ * @param {string|undefined} value
+ * @returns {number|null}
+ */
+function parseRetryAfter(value) {
+  if (!value) return null;
+  const seconds = Number(value);
+  if (Number.isFinite(seconds)) return Math.max(0, seconds * 1000);
+  const date = Date.parse(value);
+  return Number.isNaN(date) ? null : Math.max(0, date - Date.now());
+}
+
+/**
+ * 以 nearest-rank 方法計算百分位數 (輸入須已由小到大排序)。
+ * @param {number[]} sorted
+ * @param {number} p - 0 到 100
+ * @returns {number|null}
+ */
+function percentile(sorted, p) {
+  if (sorted.length === 0) return null;
+  const rank = Math.ceil((p / 100) * sorted.length);
+  return sorted[Math.min(sorted.length, Math.max(1, rank)) - 1];
+}
+
+/**
+ * 以最多 limit 個並行工作處理 items。
+ * @param {Array} items
+ * @param {number} limit
+ * @param {(item: any) => Promise<void>} worker
+ */
+async function runWithConcurrency(items, limit, worker) {
+  let next = 0;
+  const runners = Array.from({ length: Math.min(limit, items.length) }, async () => {
+    while (next < items.length) {
+      const item = items[next++];
+      await worker(item);
+    }
+  });
+  await Promise.all(runners);
+}
+
+/**
+ * 分批刪除文件 (每批最多 500 個)。
+ * @param {FirebaseFirestore.Firestore} db
+ * @param {FirebaseFirestore.DocumentReference[]} refs
+ */
+async function deleteInBatches(db, refs) {
+  for (let i = 0; i < refs.length; i += MAX_BATCH_WRITES) {
+    const batch = db.batch();
+    refs.slice(i, i + MAX_BATCH_WRITES).forEach((ref) => batch.delete(ref));
+    await batch.commit();
+  }
+}
+
+/**
+ * 分頁走訪 subscriptions 並發送推播。
+ * @param {object} params
+ * @param {FirebaseFirestore.Firestore} params.db - Firestore (可為模擬器)
+ * @param {object} params.payload - 推播內容 (會被 JSON.stringify 處理)
+ * @param {Function} [params.sender] - 發送函數，簽名同 webpush.sendNotification(subscription, body, options)
+ * @param {object} [params.options] - 覆寫 DEFAULT_OPTIONS
+ * @returns {Promise<object>} - { total, sent, failed, pruned, retried, pages, latencyMs: { p50, p95 }, durationMs }
+ */
+async function sendToAllSubscribers({ db, payload, sender, options = {} }) {
+  const opts = { ...DEFAULT_OPTIONS, ...options };
+  const send = sender || require('web-push').sendNotification;
+  const body = JSON.stringify(payload);
+  // 長連線並限制 socket 數量，避免訂閱數變多時耗盡連線
+  const agent = new https.Agent({ keepAlive: true, maxSockets: opts.concurrency });
+  const sendOptions = { TTL: opts.ttl, agent };
+
+  const stats = { total: 0, sent: 0, failed: 0, pruned: 0, retried: 0, pages: 0 };
+  const latencies = [];
+  const startedAt = Date.now();
+
+  const sendOne = async (doc, staleRefs) => {
+    const subscription = doc.data();
+    for (let attempt = 0; ; attempt++) {
+      const sendStart = process.hrtime.bigint();
+      try {
+        await send(subscription, body, sendOptions);
+        latencies.push(Number(process.hrtime.bigint() - sendStart) / 1e6);
+        stats.sent++;
+        return;
+      } catch (err) {
+        latencies.push(Number(process.hrtime.bigint() - sendStart) / 1e6);
+        const status = err.statusCode;
+        if (status === 404 || status === 410) {
+          // 偵測到失效訂閱，等本頁結束後批次刪除
+          staleRefs.push(doc.ref);
+          stats.failed++;
+          return;
+        }
+        const retryable = status === 429 || (status >= 500 && status < 600);
+        const headers = err.headers || {};
+        const retryAfterMs = parseRetryAfter(headers['retry-after'] || headers['Retry-After']);
+        const delayMs = retryAfterMs !== null ? retryAfterMs : 1000 * 2 ** attempt;
+        if (!retryable || attempt >= opts.maxRetries || delayMs > opts.maxRetryAfterSeconds * 1000) {
+          console.error('發送推播失敗 (非 404/410):', status, err.body);
+          stats.failed++;
+          return;
+        }
+        stats.retried++;
+        await sleep(delayMs);
+      }
+    }
+  };
+
+  try {
+    let lastDoc = null;
+    for (;;) {
+      let query = db.collection('subscriptions')
+        .orderBy(DOCUMENT_ID_FIELD)
+        .select('endpoint', 'keys')
+        .limit(opts.pageSize);
+      if (lastDoc) query = query.startAfter(lastDoc);
+      const snapshot = await query.get();
+      if (snapshot.empty) break;
+
+      stats.pages++;
+      stats.total += snapshot.size;
+      const staleRefs = [];
+      await runWithConcurrency(snapshot.docs, opts.concurrency, (doc) => sendOne(doc, staleRefs));
+
+      if (staleRefs.length > 0) {
+        await deleteInBatches(db, staleRefs);
+        stats.pruned += staleRefs.length;
+        console.log(`已批次刪除 ${staleRefs.length} 個失效的訂閱。`);
+      }
+
+      if (snapshot.size < opts.pageSize) break;
+      lastDoc = snapshot.docs[snapshot.docs.length - 1];
+    }
+  } finally {
+    agent.destroy();
+  }
+
+  latencies.sort((a, b) => a - b);
+  stats.latencyMs = {
+    p50: percentile(latencies, 50),
+    p95: percentile(latencies, 95),
+  };
+  stats.durationMs = Date.now() - startedAt;
+  return stats;
+}
+
+/**
+ * 讀取整數環境變數，未設定、格式不正確或小於 min 時返回預設值 (index.js 也使用這個函數)。
+ * @param {string} name
+ * @param {number} fallback
+ * @param {number} [min=1] - 允許的最小值 (例如重試次數可以是 0)
+ * @returns {number}
+ */
+function intFromEnv(name, fallback, min = 1) {
+  const value = parseInt(process.env[name], 10);
+  return Number.isFinite(value) && value >= min ? value : fallback;
+}
+
+/**
+ * 從環境變數讀取發送設定 (未設定的項目使用預設值)。
+ * @returns {object}
+ */
+function optionsFromEnv() {
+  return {
+    pageSize: intFromEnv('PUSH_PAGE_SIZE', DEFAULT_OPTIONS.pageSize),
+    concurrency: intFromEnv('PUSH_CONCURRENCY', DEFAULT_OPTIONS.concurrency),
+    maxRetries: intFromEnv('PUSH_MAX_RETRIES', DEFAULT_OPTIONS.maxRetries, 0),
+    maxRetryAfterSeconds: intFromEnv('PUSH_MAX_RETRY_AFTER_SECONDS', DEFAULT_OPTIONS.maxRetryAfterSeconds, 0),
+    ttl: intFromEnv('PUSH_TTL_SECONDS', DEFAULT_OPTIONS.ttl),
+  };
+}
+
+module.exports = {
+  DEFAULT_OPTIONS,
+  sendToAllSubscribers,
+  optionsFromEnv,
+  intFromEnv,
+  parseRetryAfter,
+  percentile,
+  runWithConcurrency,
+  deleteInBatches,
+};
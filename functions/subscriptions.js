@@ -0,0 +1,126 @@
+// functions/subscriptions.js
+// 訂閱記錄的讀寫成本控制 (index.js 的路由與排程函式使用)：
+//   - HeartbeatCoalescer：同一個 endpoint 在時間窗口內最多寫入一次 lastSeen，記住的 endpoint 數量有上限
+//   - SubscriptionCounter：以 Firestore 伺服器端 count() 聚合計算訂閱數並快取，不讀取文件內容
+//   - cleanupStaleSubscriptions：分段查詢 lastSeen 過期的訂閱並批次刪除
+// Firestore 由呼叫端傳入，本模組不直接載入 firebase-admin；
+// 測試 (test/subscriptions.test.js) 以記憶體中的假 Firestore 執行。
+
+const { deleteInBatches } = require('./pushFanout');
+
+/**
+ * 記錄每個 endpoint 上次寫入 lastSeen 的時間 (依插入順序，最舊的在前)。
+ */
+class HeartbeatCoalescer {
+  /**
+   * @param {object} params
+   * @param {number} params.windowMs - 同一個 endpoint 在這段時間內最多寫入一次
+   * @param {number} params.maxEntries - 最多記住的 endpoint 數量，超過時淘汰最舊的記錄
+   */
+  constructor({ windowMs, maxEntries }) {
+    this.windowMs = windowMs;
+    this.maxEntries = maxEntries;
+    this.writtenAt = new Map(); // 文件 ID → 上次寫入 lastSeen 的時間
+  }
+
+  /**
+   * 本執行個體在時間窗口內是否已寫入過 (是則這次心跳不需要寫入)。
+   * @param {string} docId
+   * @param {number} now
+   * @returns {boolean}
+   */
+  isCoalesced(docId, now) {
+    const lastWrite = this.writtenAt.get(docId);
+    return lastWrite !== undefined && now - lastWrite < this.windowMs;
+  }
+
+  /**
+   * 記錄某個 endpoint 剛寫入 lastSeen，並限制快取大小。
+   * @param {string} docId
+   * @param {number} now
+   */
+  remember(docId, now) {
+    this.writtenAt.delete(docId);
+    this.writtenAt.set(docId, now);
+    while (this.writtenAt.size > this.maxEntries) {
+      this.writtenAt.delete(this.writtenAt.keys().next().value);
+    }
+  }
+
+  /**
+   * @param {string} docId
+   */
+  forget(docId) {
+    this.writtenAt.delete(docId);
+  }
+}
+
+/**
+ * 訂閱數的快取：快取過期或被 invalidate() 後才重新執行 count() 聚合查詢。
+ */
+class SubscriptionCounter {
+  /**
+   * @param {object} params
+   * @param {FirebaseFirestore.Firestore} params.db
+   * @param {number} params.cacheMs - 快取的毫秒數
+   */
+  constructor({ db, cacheMs }) {
+    this.db = db;
+    this.cacheMs = cacheMs;
+    this.cache = null; // { count, fetchedAt }
+  }
+
+  /**
+   * @param {number} [now]
+   * @returns {Promise<number>}
+   */
+  async get(now = Date.now()) {
+    if (!this.cache || now - this.cache.fetchedAt >= this.cacheMs) {
+      // 伺服器端聚合：每 1000 筆索引項目只計 1 次讀取，不需要把所有文件讀回來
+      const snapshot = await this.db.collection('subscriptions').count().get();
+      this.cache = { count: snapshot.data().count, fetchedAt: now };
+    }
+    return this.cache.count;
+  }
+
+  invalidate() {
+    this.cache = null;
+  }
+}
+
+/**
+ * 刪除 lastSeen 早於 staleBefore 的訂閱。
+ *
+ * 每段最多查詢 chunkSize 筆並以單一 batch 刪除；刪除後重新從頭查詢即可取得下一段，
+ * 同一天過期的訂閱再多也不會超過 batch 上限。
+ * @param {object} params
+ * @param {FirebaseFirestore.Firestore} params.db
+ * @param {*} params.staleBefore - 門檻時間 (Firestore Timestamp)
+ * @param {number} params.chunkSize - 每段的文件數 (不超過 500)
+ * @param {Function} [params.onDeleted] - 每段刪除後以文件 ID 陣列呼叫
+ * @returns {Promise<number>} - 刪除的訂閱數
+ */
+async function cleanupStaleSubscriptions({ db, staleBefore, chunkSize, onDeleted }) {
+  let deleted = 0;
+  for (;;) {
+    const snapshot = await db.collection('subscriptions')
+      .where('lastSeen', '<', staleBefore)
+      .orderBy('lastSeen')
+      .select()
+      .limit(chunkSize)
+      .get();
+    if (snapshot.empty) break;
+
+    await deleteInBatches(db, snapshot.docs.map((doc) => doc.ref));
+    if (onDeleted) onDeleted(snapshot.docs.map((doc) => doc.id));
+    deleted += snapshot.size;
+    if (snapshot.size < chunkSize) break;
+  }
+  return deleted;
+}
+
+module.exports = {
+  HeartbeatCoalescer,
+  SubscriptionCounter,
+  cleanupStaleSubscriptions,
+};
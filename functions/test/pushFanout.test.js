@@ -0,0 +1,227 @@
+// 以記憶體中的假 Firestore 與假發送函數測試 pushFanout.js (node --test)。
+
+const test = require('node:test');
+const assert = require('node:assert');
+
+const {
+  sendToAllSubscribers,
+  parseRetryAfter,
+  deleteInBatches,
+  intFromEnv,
+  optionsFromEnv,
+  DEFAULT_OPTIONS,
+} = require('../pushFanout');
+
+/**
+ * 只實作 pushFanout.js 用到的 Firestore API：
+ * collection().orderBy('__name__').select().limit().startAfter().get() 與 batch()。
+ */
+function fakeDb(count) {
+  const docs = new Map();
+  for (let i = 0; i < count; i++) {
+    const id = `sub-${String(i).padStart(6, '0')}`;
+    docs.set(id, { endpoint: `https://push.example/${id}`, keys: { p256dh: 'p', auth: 'a' } });
+  }
+  const db = { docs, queries: [], batches: [] };
+
+  const makeDoc = (id) => ({
+    id,
+    ref: { id },
+    data: () => ({ ...docs.get(id) }),
+  });
+
+  const query = (state) => ({
+    orderBy: (field) => query({ ...state, orderBy: field }),
+    select: (...fields) => query({ ...state, select: fields }),
+    limit: (n) => query({ ...state, limit: n }),
+    startAfter: (doc) => query({ ...state, startAfter: doc.id }),
+    get: async () => {
+      db.queries.push(state);
+      assert.strictEqual(state.orderBy, '__name__');
+      const ids = [...docs.keys()].sort()
+        .filter((id) => state.startAfter === undefined || id > state.startAfter)
+        .slice(0, state.limit);
+      const page = ids.map(makeDoc);
+      return { empty: page.length === 0, size: page.length, docs: page };
+    },
+  });
+
+  db.collection = (name) => {
+    assert.strictEqual(name, 'subscriptions');
+    return query({});
+  };
+  db.batch = () => {
+    const refs = [];
+    return {
+      delete: (ref) => refs.push(ref),
+      commit: async () => {
+        assert.ok(refs.length <= 500, `batch 有 ${refs.length} 個操作`);
+        db.batches.push(refs.length);
+        refs.forEach((ref) => docs.delete(ref.id));
+      },
+    };
+  };
+  return db;
+}
+
+function pushError(statusCode, headers = {}) {
+  const err = new Error(`status ${statusCode}`);
+  err.statusCode = statusCode;
+  err.headers = headers;
+  return err;
+}
+
+test('分頁讀取所有訂閱，每個訂閱只發送一次', async () => {
+  const db = fakeDb(1203);
+  const seen = new Map();
+  const stats = await sendToAllSubscribers({
+    db,
+    payload: { title: 't' },
+    sender: async (subscription) => {
+      seen.set(subscription.endpoint, (seen.get(subscription.endpoint) || 0) + 1);
+    },
+    options: { pageSize: 500, concurrency: 20 },
+  });
+
+  assert.strictEqual(stats.pages, 3);
+  assert.strictEqual(stats.total, 1203);
+  assert.strictEqual(stats.sent, 1203);
+  assert.strictEqual(stats.failed, 0);
+  assert.strictEqual(seen.size, 1203);
+  assert.ok([...seen.values()].every((n) => n === 1));
+  assert.deepStrictEqual(db.queries.map((q) => q.limit), [500, 500, 500]);
+  assert.deepStrictEqual(db.queries[0].select, ['endpoint', 'keys']);
+});
+
+test('剛好整頁時多讀一次空頁後結束', async () => {
+  const db = fakeDb(10);
+  const stats = await sendToAllSubscribers({
+    db, payload: {}, sender: async () => {}, options: { pageSize: 5 },
+  });
+  assert.strictEqual(stats.pages, 2);
+  assert.strictEqual(stats.sent, 10);
+  assert.strictEqual(db.queries.length, 3);
+});
+
+test('同時進行中的發送不超過 concurrency', async () => {
+  const db = fakeDb(200);
+  let inFlight = 0;
+  let maxInFlight = 0;
+  const stats = await sendToAllSubscribers({
+    db,
+    payload: {},
+    sender: async () => {
+      inFlight++;
+      maxInFlight = Math.max(maxInFlight, inFlight);
+      await new Promise((resolve) => setTimeout(resolve, 1 + Math.floor(Math.random() * 3)));
+      inFlight--;
+    },
+    options: { pageSize: 100, concurrency: 7 },
+  });
+  assert.strictEqual(stats.sent, 200);
+  assert.strictEqual(maxInFlight, 7);
+});
+
+test('404/410 的訂閱在每頁結束後批次刪除，其他錯誤不刪除', async () => {
+  const db = fakeDb(30);
+  const stats = await sendToAllSubscribers({
+    db,
+    payload: {},
+    sender: async (subscription) => {
+      const n = parseInt(subscription.endpoint.slice(-6), 10);
+      if (n % 3 === 0) throw pushError(410);
+      if (n % 5 === 0) throw pushError(404);
+      if (n === 1) throw pushError(400);
+    },
+    options: { pageSize: 10, maxRetries: 0 },
+  });
+
+  // 0..29 中 3 的倍數 10 個、其餘 5 的倍數 (5, 10, 20, 25) 4 個
+  assert.strictEqual(stats.pruned, 14);
+  assert.strictEqual(stats.failed, 15);
+  assert.strictEqual(stats.sent, 15);
+  assert.strictEqual(db.docs.size, 16);
+  assert.ok(db.docs.has('sub-000001'));
+  assert.ok(!db.docs.has('sub-000000'));
+  assert.ok(!db.docs.has('sub-000025'));
+  // 每頁各一個 batch
+  assert.strictEqual(db.batches.length, 3);
+});
+
+test('deleteInBatches 每個 batch 最多 500 個刪除', async () => {
+  const db = fakeDb(1201);
+  const refs = [...db.docs.keys()].map((id) => ({ id }));
+  await deleteInBatches(db, refs);
+  assert.deepStrictEqual(db.batches, [500, 500, 201]);
+  assert.strictEqual(db.docs.size, 0);
+});
+
+test('429 依 Retry-After 重試，過長的 Retry-After 直接記為失敗', async () => {
+  const db = fakeDb(2);
+  const attempts = new Map();
+  const stats = await sendToAllSubscribers({
+    db,
+    payload: {},
+    sender: async (subscription) => {
+      const attempt = (attempts.get(subscription.endpoint) || 0) + 1;
+      attempts.set(subscription.endpoint, attempt);
+      if (subscription.endpoint.endsWith('000000')) {
+        if (attempt === 1) throw pushError(429, { 'retry-after': '0' });
+        return;
+      }
+      throw pushError(429, { 'retry-after': '3600' });
+    },
+    options: { maxRetries: 2, maxRetryAfterSeconds: 30 },
+  });
+  assert.strictEqual(stats.sent, 1);
+  assert.strictEqual(stats.failed, 1);
+  assert.strictEqual(stats.retried, 1);
+  assert.strictEqual(stats.pruned, 0);
+  assert.strictEqual(db.docs.size, 2);
+});
+
+test('parseRetryAfter 解析秒數與 HTTP 日期', () => {
+  assert.strictEqual(parseRetryAfter('120'), 120000);
+  assert.strictEqual(parseRetryAfter('0'), 0);
+  assert.strictEqual(parseRetryAfter(undefined), null);
+  assert.strictEqual(parseRetryAfter(''), null);
+  assert.strictEqual(parseRetryAfter('soon'), null);
+  const inOneMinute = new Date(Date.now() + 60000).toUTCString();
+  const ms = parseRetryAfter(inOneMinute);
+  assert.ok(ms > 55000 && ms <= 60000, `${ms}`);
+  assert.strictEqual(parseRetryAfter(new Date(Date.now() - 60000).toUTCString()), 0);
+});
+
+test('intFromEnv 預設只接受正整數，可指定最小值', () => {
+  const name = 'PUSH_FANOUT_TEST_VALUE';
+  try {
+    process.env[name] = '25';
+    assert.strictEqual(intFromEnv(name, 7), 25);
+    for (const value of ['0', '-3', 'abc', '']) {
+      process.env[name] = value;
+      assert.strictEqual(intFromEnv(name, 7), 7);
+    }
+    delete process.env[name];
+    assert.strictEqual(intFromEnv(name, 7), 7);
+
+    process.env[name] = '0';
+    assert.strictEqual(intFromEnv(name, 7, 0), 0);
+    process.env[name] = '-1';
+    assert.strictEqual(intFromEnv(name, 7, 0), 7);
+  } finally {
+    delete process.env[name];
+  }
+});
+
+test('optionsFromEnv 接受 PUSH_MAX_RETRIES=0', () => {
+  try {
+    process.env.PUSH_MAX_RETRIES = '0';
+    process.env.PUSH_CONCURRENCY = '0';
+    const options = optionsFromEnv();
+    assert.strictEqual(options.maxRetries, 0);
+    assert.strictEqual(options.concurrency, DEFAULT_OPTIONS.concurrency);
+  } finally {
+    delete process.env.PUSH_MAX_RETRIES;
+    delete process.env.PUSH_CONCURRENCY;
+  }
+});
@@ -0,0 +1,138 @@
+// 以記憶體中的假 Firestore 測試 subscriptions.js (node --test)。
+
+const test = require('node:test');
+const assert = require('node:assert');
+
+const {
+  HeartbeatCoalescer,
+  SubscriptionCounter,
+  cleanupStaleSubscriptions,
+} = require('../subscriptions');
+
+/**
+ * 只實作 subscriptions.js 用到的 Firestore API：count() 聚合查詢、
+ * where('lastSeen', '<', t).orderBy('lastSeen').select().limit().get() 與 batch()。
+ * lastSeen 以數字表示。
+ */
+function fakeDb(lastSeenById = {}) {
+  const docs = new Map(Object.entries(lastSeenById));
+  const db = { docs, countQueries: 0, cleanupQueries: 0, batches: [] };
+
+  const query = (state) => ({
+    where: (field, op, value) => {
+      assert.deepStrictEqual([field, op], ['lastSeen', '<']);
+      return query({ ...state, before: value });
+    },
+    orderBy: (field) => {
+      assert.strictEqual(field, 'lastSeen');
+      return query(state);
+    },
+    select: (...fields) => {
+      assert.deepStrictEqual(fields, []);
+      return query(state);
+    },
+    limit: (n) => query({ ...state, limit: n }),
+    count: () => ({
+      get: async () => {
+        db.countQueries++;
+        return { data: () => ({ count: docs.size }) };
+      },
+    }),
+    get: async () => {
+      db.cleanupQueries++;
+      const page = [...docs.entries()]
+        .filter(([, lastSeen]) => lastSeen < state.before)
+        .sort((a, b) => a[1] - b[1])
+        .slice(0, state.limit)
+        .map(([id]) => ({ id, ref: { id } }));
+      return { empty: page.length === 0, size: page.length, docs: page };
+    },
+  });
+
+  db.collection = (name) => {
+    assert.strictEqual(name, 'subscriptions');
+    return query({});
+  };
+  db.batch = () => {
+    const refs = [];
+    return {
+      delete: (ref) => refs.push(ref),
+      commit: async () => {
+        db.batches.push(refs.length);
+        refs.forEach((ref) => docs.delete(ref.id));
+      },
+    };
+  };
+  return db;
+}
+
+test('同一個 endpoint 在時間窗口內的心跳只寫入一次', () => {
+  const heartbeats = new HeartbeatCoalescer({ windowMs: 1000, maxEntries: 10 });
+  assert.strictEqual(heartbeats.isCoalesced('a', 0), false);
+  heartbeats.remember('a', 0);
+  assert.strictEqual(heartbeats.isCoalesced('a', 999), true);
+  assert.strictEqual(heartbeats.isCoalesced('a', 1000), false);
+  assert.strictEqual(heartbeats.isCoalesced('b', 500), false);
+
+  heartbeats.forget('a');
+  assert.strictEqual(heartbeats.isCoalesced('a', 1), false);
+});
+
+test('心跳快取超過上限時淘汰最久沒有寫入的 endpoint', () => {
+  const heartbeats = new HeartbeatCoalescer({ windowMs: 1000, maxEntries: 3 });
+  heartbeats.remember('a', 0);
+  heartbeats.remember('b', 1);
+  heartbeats.remember('c', 2);
+  // 重新寫入的 endpoint 移到最新的位置
+  heartbeats.remember('a', 3);
+  heartbeats.remember('d', 4);
+  assert.strictEqual(heartbeats.writtenAt.size, 3);
+  assert.deepStrictEqual([...heartbeats.writtenAt.keys()], ['c', 'a', 'd']);
+  assert.strictEqual(heartbeats.isCoalesced('b', 5), false);
+  assert.strictEqual(heartbeats.isCoalesced('a', 5), true);
+});
+
+test('訂閱數在快取期間只聚合查詢一次，invalidate 後重新查詢', async () => {
+  const db = fakeDb({ a: 1, b: 2 });
+  const counter = new SubscriptionCounter({ db, cacheMs: 1000 });
+  assert.strictEqual(await counter.get(0), 2);
+  db.docs.set('c', 3);
+  assert.strictEqual(await counter.get(999), 2);
+  assert.strictEqual(db.countQueries, 1);
+
+  assert.strictEqual(await counter.get(1000), 3);
+  assert.strictEqual(db.countQueries, 2);
+
+  db.docs.delete('a');
+  counter.invalidate();
+  assert.strictEqual(await counter.get(1001), 2);
+  assert.strictEqual(db.countQueries, 3);
+});
+
+test('分段刪除過期的訂閱，每段以一個 batch 刪除', async () => {
+  const lastSeen = {};
+  for (let i = 0; i < 25; i++) lastSeen[`stale-${i}`] = i;
+  for (let i = 0; i < 5; i++) lastSeen[`active-${i}`] = 100 + i;
+  const db = fakeDb(lastSeen);
+  const forgotten = [];
+
+  const deleted = await cleanupStaleSubscriptions({
+    db, staleBefore: 100, chunkSize: 10, onDeleted: (ids) => forgotten.push(...ids),
+  });
+
+  assert.strictEqual(deleted, 25);
+  assert.deepStrictEqual(db.batches, [10, 10, 5]);
+  assert.strictEqual(db.cleanupQueries, 3);
+  assert.strictEqual(forgotten.length, 25);
+  assert.deepStrictEqual([...db.docs.keys()].sort(), ['active-0', 'active-1', 'active-2', 'active-3', 'active-4']);
+});
+
+test('剛好整段時再查詢一次空段後結束，沒有過期訂閱時不刪除', async () => {
+  const db = fakeDb({ a: 1, b: 2, c: 50 });
+  assert.strictEqual(await cleanupStaleSubscriptions({ db, staleBefore: 10, chunkSize: 2 }), 2);
+  assert.deepStrictEqual(db.batches, [2]);
+  assert.strictEqual(db.cleanupQueries, 2);
+
+  assert.strictEqual(await cleanupStaleSubscriptions({ db, staleBefore: 10, chunkSize: 2 }), 0);
+  assert.deepStrictEqual(db.batches, [2]);
+});
@@ -0,0 +1,245 @@
+# gcs_sync.py
+# 把匯入程式的輸出檔案直接同步到 Cloud Storage bucket (前端從 storage.googleapis.com/<bucket>/ 讀取)：
+#   - 內容沒變的物件不重新上傳：每個目錄只列出一次遠端物件的 MD5 與 generation，和本地檔案串流計算的 MD5 比對
+#   - 每次寫入都帶 ifGenerationMatch 前置條件 (新物件為 0)，兩個重疊的運行不會互相覆寫；
+#     條件不符的物件記為衝突，留給下一次運行重新比對
+#   - 直接從檔案串流上傳，大檔案以固定大小分塊的 resumable upload 傳送，不在記憶體中另建完整副本
+#   - 以 thread pool 平行上傳；先上傳分片、增量與內容雜湊產物，全部成功後才上傳指向它們的
+#     manifest.json、version.json、current.json 等指標檔，讀者不會看到指向不存在內容的指標
+#   - Cache-Control：內容雜湊檔名的發布產物為 immutable，其他檔名固定的物件為 no-cache (每次向伺服器驗證)；
+#     .gz / .br 預壓縮檔設定對應的 Content-Encoding
+#   - 發布產物的舊版本只保留 current.json 列出的幾個，其餘由 delete_stale_artifacts 從 bucket 刪除
+# 設定 STORAGE_EMULATOR_HOST 時連到本地的 GCS 相容替身 (例如 fake-gcs-server)，使用匿名憑證。
+# google-cloud-storage 只在實際同步時才載入。
+
+import base64
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+
+import delta_feed
+import export_shards
+import publish_artifacts
+import search_index
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+DEFAULT_UPLOAD_CONCURRENCY = 8
+# 建立不到這個秒數的發布產物不刪除：可能是重疊的運行剛上傳、還沒寫入 current.json 的新版本
+STALE_ARTIFACT_GRACE_SECONDS = 3600
+# 超過這個大小的檔案改用分塊 resumable upload，每次只讀一個分塊到記憶體 (必須是 256 KB 的倍數)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+_CHUNK_SIZE = 1024 * 1024
+_CONTENT_ENCODINGS = {".gz": "gzip", ".br": "br"}
+_LIST_FIELDS = ("items(name,md5Hash,generation,metageneration,cacheControl,contentType,contentEncoding,timeCreated),"
+                "nextPageToken")
+
+
+def file_md5(path: str) -> str:
+    """以串流方式計算檔案的 MD5，格式與 GCS 物件的 md5Hash 相同 (base64)。"""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode("ascii")
+
+
+def _upload_item(path: str, name: str, cache_control: str, pointer: bool = False) -> dict:
+    """一個要上傳的檔案。pointer 為 True 的物件指向其他物件，在其他物件都上傳成功後才寫入。"""
+    base, suffix = os.path.splitext(name)
+    content_encoding = _CONTENT_ENCODINGS.get(suffix)
+    content_type = mimetypes.guess_type(base if content_encoding else name)[0] or "application/octet-stream"
+    return {"path": path, "name": name, "cache_control": cache_control, "content_type": content_type,
+            "content_encoding": content_encoding, "pointer": pointer}
+
+
+def _directory_items(local_dir: str, remote_dir: str, cache_control: str, pointer_names=()) -> list:
+    if not local_dir or not os.path.isdir(local_dir):
+        return []
+    items = []
+    for file_name in sorted(os.listdir(local_dir)):
+        path = os.path.join(local_dir, file_name)
+        if file_name.endswith(".tmp") or not os.path.isfile(path):
+            continue
+        pointer = file_name in pointer_names
+        items.append(_upload_item(path, posixpath.join(remote_dir, file_name),
+                                  REVALIDATE_CACHE_CONTROL if pointer else cache_control, pointer))
+    return items
+
+
+def collect_outputs(cfg, prefix: str = "") -> list:
+    """列出要同步的輸出檔案。遠端使用前端預期的固定路徑 (與本地設定的檔名無關)，前面加上 prefix。
+
+    不發布的內部檔案 (posts.db、import_state.json、delta_state.json、image_index.json 等) 不會上傳。
+    """
+    items = []
+    for path, name in ((cfg.output_json_file, "posts.json"),
+                       (cfg.latest_json_file, export_shards.LATEST_JSON_FILE),
+                       (cfg.search_index_file, search_index.SEARCH_INDEX_FILE),
+                       (cfg.version_json_file, delta_feed.VERSION_JSON_FILE)):
+        if path and os.path.isfile(path):
+            items.append(_upload_item(path, name, REVALIDATE_CACHE_CONTROL, pointer=True))
+    # 月份分片以 manifest.json 中的雜湊當作網址參數，檔名固定，所以仍需要重新驗證
+    items += _directory_items(cfg.shards_dir, export_shards.SHARDS_DIR, REVALIDATE_CACHE_CONTROL,
+                              pointer_names=(export_shards.MANIFEST_FILE_NAME,))
+    # 版本號不會倒退，但 deltas/<N>.json 在 version.json 指向它之前仍可能被重疊的運行重寫，因此不設為 immutable
+    items += _directory_items(cfg.delta_dir, delta_feed.DELTA_DIR, REVALIDATE_CACHE_CONTROL)
+    if cfg.publish_dir:
+        items += _directory_items(cfg.publish_dir, publish_artifacts.PUBLISH_DIR, IMMUTABLE_CACHE_CONTROL,
+                                  pointer_names=(publish_artifacts.POINTER_FILE_NAME,))
+    if len(cfg.channels) > 1:
+        for channel in cfg.channels:
+            remote_dir = posixpath.join("channels", channel.slug)
+            if os.path.isfile(channel.latest_json_file):
+                items.append(_upload_item(channel.latest_json_file,
+                                          posixpath.join(remote_dir, export_shards.LATEST_JSON_FILE),
+                                          REVALIDATE_CACHE_CONTROL, pointer=True))
+            items += _directory_items(channel.shards_dir, posixpath.join(remote_dir, export_shards.SHARDS_DIR),
+                                      REVALIDATE_CACHE_CONTROL, pointer_names=(export_shards.MANIFEST_FILE_NAME,))
+    if prefix:
+        for item in items:
+            item["name"] = posixpath.join(prefix.strip("/"), item["name"])
+    return items
+
+
+def make_client(project: str = None):
+    """建立 Cloud Storage 客戶端。設定 STORAGE_EMULATOR_HOST 時連到本地替身並使用匿名憑證。"""
+    from google.cloud import storage
+    if os.environ.get("STORAGE_EMULATOR_HOST"):
+        from google.auth.credentials import AnonymousCredentials
+        return storage.Client(project=project or "emulator", credentials=AnonymousCredentials())
+    return storage.Client(project=project)
+
+
+def read_remote_json(bucket_name: str, name: str, client=None):
+    """讀取 bucket 中的一個 JSON 物件，不存在時返回 None。"""
+    from google.api_core.exceptions import NotFound
+
+    client = client or make_client()
+    try:
+        data = client.bucket(bucket_name).blob(name).download_as_bytes()
+    except NotFound:
+        return None
+    return json.loads(data)
+
+
+def _remote_name(cfg, name: str) -> str:
+    return posixpath.join(cfg.storage_object_prefix.strip("/"), name) if cfg.storage_object_prefix else name
+
+
+def remote_version(cfg, client=None) -> int:
+    """bucket 中已發布的 version.json 的版本號 (不存在時為 0)，新的歸檔版本必須大於它。"""
+    name = _remote_name(cfg, delta_feed.VERSION_JSON_FILE)
+    return int((read_remote_json(cfg.storage_bucket_name, name, client) or {}).get("version") or 0)
+
+
+def remote_pointer(cfg, client=None):
+    """bucket 中已發布的 publish/current.json (不存在時為 None)，作為發布產物是否改變的比對基準。"""
+    name = _remote_name(cfg, posixpath.join(publish_artifacts.PUBLISH_DIR, publish_artifacts.POINTER_FILE_NAME))
+    return read_remote_json(cfg.storage_bucket_name, name, client)
+
+
+def delete_stale_artifacts(cfg, pointer: dict, client=None, grace_seconds: float = STALE_ARTIFACT_GRACE_SECONDS) -> list:
+    """刪除 bucket 的 publish/ 中沒有被 pointer (剛上傳的 current.json) 引用的物件，返回刪除的物件名稱。
+
+    以列出時的 generation 為前置條件刪除，建立不到 grace_seconds 秒的物件保留。
+    """
+    from google.api_core.exceptions import NotFound, PreconditionFailed
+
+    client = client or make_client()
+    bucket = client.bucket(cfg.storage_bucket_name)
+    directory = _remote_name(cfg, publish_artifacts.PUBLISH_DIR)
+    keep = publish_artifacts.referenced_files(pointer)
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=grace_seconds)
+    deleted = []
+    for blob in client.list_blobs(bucket, prefix=f"{directory}/", delimiter="/", fields=_LIST_FIELDS):
+        if posixpath.basename(blob.name) in keep or (blob.time_created and blob.time_created > cutoff):
+            continue
+        try:
+            bucket.blob(blob.name).delete(if_generation_match=blob.generation)
+        except (NotFound, PreconditionFailed):
+            continue
+        deleted.append(blob.name)
+    return deleted
+
+
+def _list_remote(client, bucket, items) -> dict:
+    """每個目錄只列出一次 (不遞迴)，返回 {物件名稱: Blob}。"""
+    remote = {}
+    for directory in sorted({posixpath.dirname(item["name"]) for item in items}):
+        prefix = f"{directory}/" if directory else None
+        for blob in client.list_blobs(bucket, prefix=prefix, delimiter="/", fields=_LIST_FIELDS):
+            remote[blob.name] = blob
+    return remote
+
+
+def _sync_one(bucket, item: dict, remote_blob) -> tuple:
+    """同步單一物件，返回 (結果, 上傳的位元組數)。結果為 unchanged、metadata 或 uploaded。"""
+    md5 = file_md5(item["path"])
+    if remote_blob is not None and remote_blob.md5_hash == md5:
+        if (remote_blob.cache_control, remote_blob.content_type, remote_blob.content_encoding) == \
+                (item["cache_control"], item["content_type"], item["content_encoding"]):
+            return "unchanged", 0
+        # 內容相同，只更新中繼資料 (同樣以 metageneration 前置條件避免覆寫別人的修改)
+        remote_blob.cache_control = item["cache_control"]
+        remote_blob.content_type = item["content_type"]
+        remote_blob.content_encoding = item["content_encoding"]
+        remote_blob.patch(if_metageneration_match=remote_blob.metageneration)
+        return "metadata", 0
+
+    size = os.path.getsize(item["path"])
+    blob = bucket.blob(item["name"], chunk_size=UPLOAD_CHUNK_SIZE if size > UPLOAD_CHUNK_SIZE else None)
+    blob.cache_control = item["cache_control"]
+    blob.content_encoding = item["content_encoding"]
+    # 物件不存在時 generation 必須為 0 (只允許建立)；存在時必須仍是剛才列出的版本
+    generation = remote_blob.generation if remote_blob is not None else 0
+    blob.upload_from_filename(item["path"], content_type=item["content_type"], if_generation_match=generation)
+    return "uploaded", size
+
+
+def sync_outputs(items: list, bucket_name: str, client=None, workers: int = DEFAULT_UPLOAD_CONCURRENCY) -> dict:
+    """把 items (見 collect_outputs) 同步到 bucket_name。
+
+    返回 {"uploaded": [...], "metadata": [...], "unchanged": n, "conflicts": [...], "failed": [...],
+          "bytes": n, "pointers_skipped": bool}。
+    非指標物件有失敗或衝突時不寫入指標檔，遠端維持上一次一致的狀態。
+    """
+    from google.api_core.exceptions import PreconditionFailed
+
+    client = client or make_client()
+    bucket = client.bucket(bucket_name)
+    remote = _list_remote(client, bucket, items)
+    stats = {"uploaded": [], "metadata": [], "unchanged": 0, "conflicts": [], "failed": [], "bytes": 0,
+             "pointers_skipped": False}
+
+    def run_phase(phase_items):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(_sync_one, bucket, item, remote.get(item["name"])): item for item in phase_items}
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]["name"]
+                try:
+                    result, size = future.result()
+                except PreconditionFailed:
+                    print(f"警告：gs://{bucket_name}/{name} 已被其他運行修改，本次不覆寫。")
+                    stats["conflicts"].append(name)
+                    continue
+                except Exception as e:
+                    print(f"錯誤：上傳 gs://{bucket_name}/{name} 失敗: {e}")
+                    stats["failed"].append(name)
+                    continue
+                if result == "unchanged":
+                    stats["unchanged"] += 1
+                else:
+                    stats[result].append(name)
+                    stats["bytes"] += size
+
+    run_phase([item for item in items if not item["pointer"]])
+    if stats["failed"] or stats["conflicts"]:
+        stats["pointers_skipped"] = True
+    else:
+        run_phase([item for item in items if item["pointer"]])
+    return stats
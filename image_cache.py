@@ -0,0 +1,130 @@
+# image_cache.py
+# 以內容定址的圖片索引：記錄「Telegram photo id → 圖片 URL」與「圖片內容 SHA-256 → 圖片 URL」。
+# 已知的 photo id 可以同時跳過下載與上傳；下載後內容雜湊命中則跳過上傳。
+# 索引以 JSON 檔案持久化，並依最後使用時間做數量上限與存活時間的淘汰。
+
+import hashlib
+import json
+import os
+import time
+
+IMAGE_INDEX_FILE = "image_index.json"
+INDEX_FORMAT_VERSION = 1
+
+
+def content_hash(data: bytes) -> str:
+    """圖片內容的 SHA-256 (十六進位字串)。"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ImageCache:
+    """photo id / 內容雜湊 → 已託管 URL 的持久化索引。"""
+
+    def __init__(self, path: str = IMAGE_INDEX_FILE, max_entries: int = 20000, max_age_days: float = 365):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400
+        self.photos = {} # photo_id (str) → {"url", "sha256", "last_used", "meta"?}
+        self.hashes = {} # sha256 → {"url", "size", "last_used", "meta"?}
+        # meta 為衍生圖片的 image_meta (尺寸、BlurHash、srcset)，見 image_derivatives.py
+        self.hits = 0
+        self.misses = 0
+        self.changed = False # 上次 save() 之後是否有新記錄的 URL
+
+    # --- 讀寫 ---
+    def load(self):
+        if not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_FORMAT_VERSION:
+                print(f"警告：{self.path} 的格式版本不符，將重新建立圖片索引。")
+                return self
+            self.photos = data.get("photos") or {}
+            self.hashes = data.get("hashes") or {}
+        except (json.JSONDecodeError, AttributeError) as e:
+            print(f"警告：{self.path} 不是有效的圖片索引 ({e})，將重新建立。")
+        return self
+
+    def save(self):
+        """淘汰過期或超量的項目後寫回檔案 (寫入暫存檔再改名)。"""
+        self.evict()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_FORMAT_VERSION, "photos": self.photos, "hashes": self.hashes},
+                      f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+    # --- 查詢 ---
+    def lookup_photo(self, photo_id):
+        """以 Telegram photo id 查詢 URL，命中時不需要下載。"""
+        entry = self.photos.get(str(photo_id))
+        if entry and entry.get("url"):
+            entry["last_used"] = time.time()
+            if entry.get("sha256") in self.hashes:
+                self.hashes[entry["sha256"]]["last_used"] = entry["last_used"]
+            self.hits += 1
+            return entry["url"]
+        self.misses += 1
+        return None
+
+    def lookup_content(self, data: bytes):
+        """以圖片內容雜湊查詢 URL，命中時不需要上傳。返回 (url 或 None, sha256)。"""
+        digest = content_hash(data)
+        entry = self.hashes.get(digest)
+        if entry and entry.get("url"):
+            entry["last_used"] = time.time()
+            self.hits += 1
+            return entry["url"], digest
+        self.misses += 1
+        return None, digest
+
+    def meta_for(self, photo_id=None, digest: str = None):
+        """已記錄的 image_meta (先查 photo id，再查內容雜湊)，沒有時返回 None。"""
+        entry = self.photos.get(str(photo_id)) if photo_id is not None else None
+        if entry and entry.get("meta"):
+            return entry["meta"]
+        digest = digest or (entry or {}).get("sha256")
+        entry = self.hashes.get(digest) if digest else None
+        return entry.get("meta") if entry else None
+
+    # --- 記錄 ---
+    def record(self, url: str, photo_id=None, digest: str = None, size: int = None, meta: dict = None):
+        if not url:
+            return
+        self.changed = True
+        now = time.time()
+        if digest:
+            entry = {"url": url, "size": size, "last_used": now}
+            meta = meta or (self.hashes.get(digest) or {}).get("meta")
+            if meta:
+                entry["meta"] = meta
+            self.hashes[digest] = entry
+        if photo_id is not None:
+            entry = {"url": url, "sha256": digest, "last_used": now}
+            if meta:
+                entry["meta"] = meta
+            self.photos[str(photo_id)] = entry
+
+    def merge(self, other: "ImageCache") -> None:
+        """併入另一個索引 (例如回補分區的索引)，同一個鍵保留最後使用時間較新的項目。"""
+        for table, other_table in ((self.photos, other.photos), (self.hashes, other.hashes)):
+            for key, entry in other_table.items():
+                if entry.get("last_used", 0) >= table.get(key, {}).get("last_used", 0):
+                    table[key] = entry
+                    self.changed = True
+
+    # --- 淘汰 ---
+    def evict(self):
+        """移除超過存活時間的項目，再依最後使用時間保留最新的 max_entries 筆。"""
+        cutoff = time.time() - self.max_age_seconds
+        for table in (self.photos, self.hashes):
+            expired = [key for key, entry in table.items() if entry.get("last_used", 0) < cutoff]
+            for key in expired:
+                del table[key]
+            if len(table) > self.max_entries:
+                ordered = sorted(table, key=lambda key: table[key].get("last_used", 0), reverse=True)
+                for key in ordered[self.max_entries:]:
+                    del table[key]
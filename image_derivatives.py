@@ -0,0 +1,147 @@
+# image_derivatives.py
+# 匯入時趁圖片還在記憶體中，產生給前端使用的縮圖與中尺寸版本 (WebP，可選 JPEG)，
+# 並計算原圖尺寸與 BlurHash，讓頁面在圖片載入前就能保留正確的版面並顯示模糊預覽。
+#
+# 縮放在 process pool 中執行 (make_derivatives 是可 pickle 的模組層級函式)，
+# 不會阻塞 Telethon 的事件迴圈。Pillow 為選用依賴：未安裝時 AVAILABLE 為 False，匯入流程照常運作。
+#
+# 輸出到 posts.json 的 image_meta 格式：
+#   {"width": 1280, "height": 960, "blurhash": "LEHV6nWB2yk8...",
+#    "srcset": [{"url": "...", "width": 320, "type": "image/webp"}, ...]}
+
+import importlib.util
+import io
+import math
+
+# Pillow 只在 worker 真正縮放圖片時才載入 (見 make_derivatives)，未安裝時不產生衍生圖片
+AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+# (名稱, 最大寬度)：卡片格線 1~4 欄在手機與桌面上的顯示寬度大約落在這兩個尺寸
+DEFAULT_VARIANTS = (("thumb", 320), ("medium", 960))
+DEFAULT_FORMATS = ("webp",)
+MIME_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+FILE_EXTENSIONS = {"webp": ".webp", "jpeg": ".jpg"}
+
+BLURHASH_COMPONENTS = (4, 3)
+_BLURHASH_SAMPLE_SIZE = 32
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+# --- BlurHash (https://blurha.sh) 編碼 ---
+def _encode83(value: int, length: int) -> str:
+    return "".join(_BASE83[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    return int(v * 12.92 * 255 + 0.5) if v <= 0.0031308 else int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exp: float) -> float:
+    return math.copysign(abs(value) ** exp, value)
+
+
+def blurhash_encode(pixels, width: int, height: int, components=BLURHASH_COMPONENTS) -> str:
+    """pixels 為逐列排列的 (r, g, b) 序列。建議先縮到 32px 左右以降低計算量。"""
+    cx, cy = components
+    linear = [(_srgb_to_linear(r), _srgb_to_linear(g), _srgb_to_linear(b)) for r, g, b in pixels]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(cx)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(cy)]
+
+    factors = []
+    for j in range(cy):
+        for i in range(cx):
+            norm = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                basis_y = cos_y[j][y]
+                for x in range(width):
+                    basis = basis_y * cos_x[i][x]
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = norm / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((cx - 1) + (cy - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(v) for factor in ac for v in factor)
+        quantised_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+        result += _encode83(quantised_max, 1)
+    else:
+        max_value = 1
+        result += _encode83(0, 1)
+    result += _encode83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+
+    def quantise(v):
+        return max(0, min(18, int(_sign_pow(v / max_value, 0.5) * 9 + 9.5)))
+
+    for r, g, b in ac:
+        result += _encode83(quantise(r) * 19 * 19 + quantise(g) * 19 + quantise(b), 2)
+    return result
+
+
+# --- 衍生圖片 ---
+def make_derivatives(data: bytes, variants=DEFAULT_VARIANTS, formats=DEFAULT_FORMATS, quality: int = 80) -> dict:
+    """解碼一張圖片並產生各尺寸版本 (在 process pool 的 worker 中執行)。
+
+    返回 {"width", "height", "blurhash", "variants": [{"name", "width", "height", "format", "data"}]}；
+    原圖寬度不超過某個尺寸時不產生該尺寸 (直接使用原圖即可)。
+    """
+    if not AVAILABLE:
+        raise RuntimeError("需要安裝 Pillow 才能產生衍生圖片")
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as opened:
+        image = ImageOps.exif_transpose(opened).convert("RGB")
+    width, height = image.size
+
+    sample = image.copy()
+    sample.thumbnail((_BLURHASH_SAMPLE_SIZE, _BLURHASH_SAMPLE_SIZE))
+    raw = sample.tobytes()
+    blurhash = blurhash_encode(zip(raw[0::3], raw[1::3], raw[2::3]), sample.width, sample.height)
+
+    outputs = []
+    for name, max_width in variants:
+        if width <= max_width:
+            continue
+        resized = image.resize((max_width, max(1, round(height * max_width / width))), Image.LANCZOS)
+        for fmt in formats:
+            buffer = io.BytesIO()
+            if fmt == "webp":
+                resized.save(buffer, "WEBP", quality=quality, method=4)
+            else:
+                resized.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+            outputs.append({"name": name, "width": resized.width, "height": resized.height,
+                            "format": fmt, "data": buffer.getvalue()})
+    return {"width": width, "height": height, "blurhash": blurhash, "variants": outputs}
+
+
+def variant_file_name(file_name: str, name: str, fmt: str) -> str:
+    """原圖檔名加上尺寸名稱與對應副檔名，例如 2025-08-13_2132.jpg → 2025-08-13_2132_thumb.webp。"""
+    stem = file_name.rsplit(".", 1)[0]
+    return f"{stem}_{name}{FILE_EXTENSIONS[fmt]}"
+
+
+def build_image_meta(derived: dict, uploaded_urls) -> dict:
+    """由 make_derivatives 的結果與各版本上傳後的 URL (順序相同，失敗為 None) 組出 image_meta。"""
+    srcset = [
+        {"url": url, "width": variant["width"], "type": MIME_TYPES[variant["format"]]}
+        for variant, url in zip(derived["variants"], uploaded_urls) if url
+    ]
+    return {"width": derived["width"], "height": derived["height"], "blurhash": derived["blurhash"], "srcset": srcset}
+
+
+def parse_formats(value: str):
+    """解析 IMAGE_DERIVATIVE_FORMATS (例如 "webp,jpeg")，忽略不支援的格式。"""
+    formats = tuple(fmt.strip().lower().replace("jpg", "jpeg") for fmt in (value or "").split(",") if fmt.strip())
+    return tuple(fmt for fmt in formats if fmt in MIME_TYPES) or DEFAULT_FORMATS
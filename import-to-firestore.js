@@ -1,4 +1,6 @@
 // import-to-firestore.js (修正版 - ID 規格統一為 日期_5位ID)
+// 日常的同步已由匯入程式以 firestore_sync.py 增量完成 (FIRESTORE_SYNC=1，只寫入內容改變的貼文)；
+// 此腳本會重寫所有文件，只適合第一次建立集合或手動完整重建。
 
 const admin = require('firebase-admin');
 const fs = require('fs');
@@ -0,0 +1,99 @@
+# import_state.py
+# 匯入進度 (watermark) 的持久化：
+# 記錄已處理過的最大 Telegram 訊息 ID，以及最近訊息的 edit_date，
+# 讓 everypy.py 每次只需抓取比 watermark 更新的訊息 (外加一小段回看窗口以追蹤編輯)。
+# 另外記錄圖片在重試後仍下載/上傳失敗的訊息 (pending_image_ids：訊息 ID → 已嘗試的運行次數)，
+# 下次運行時會以 ID 重新抓取這些訊息，不會因為 watermark 已經越過它們而被遺漏。
+
+import json
+import os
+import datetime
+
+IMPORT_STATE_FILE = "import_state.json"
+
+
+def empty_state() -> dict:
+    return {"last_message_id": 0, "edit_dates": {}, "pending_image_ids": {}, "updated_at": None}
+
+
+def load_state(path: str = IMPORT_STATE_FILE, fallback_last_id: int = 0) -> dict:
+    """讀取 watermark 狀態檔。
+
+    若狀態檔不存在，則以 fallback_last_id (通常是貼文資料庫中最大的 ID) 作為初始 watermark，
+    避免第一次啟用此功能時把整個頻道重新抓一次。
+    """
+    state = empty_state()
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            state["last_message_id"] = int(data.get("last_message_id") or 0)
+            state["edit_dates"] = {str(k): v for k, v in (data.get("edit_dates") or {}).items()}
+            state["pending_image_ids"] = {str(k): int(v) for k, v in (data.get("pending_image_ids") or {}).items()}
+            state["updated_at"] = data.get("updated_at")
+            return state
+        except (json.JSONDecodeError, ValueError, TypeError) as e:
+            print(f"警告：{path} 格式不正確 ({e})，將改由貼文資料庫推算 watermark。")
+
+    state["last_message_id"] = int(fallback_last_id or 0)
+    return state
+
+
+def save_state(state: dict, path: str = IMPORT_STATE_FILE) -> None:
+    """以「寫入暫存檔再改名」的方式保存狀態，避免中途被終止時留下半個檔案。"""
+    state = dict(state)
+    state["updated_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def format_edit_date(edit_date):
+    """將 Telethon 的 msg.edit_date (datetime 或 None) 轉為可存入 JSON 的字串。"""
+    return edit_date.isoformat() if edit_date else None
+
+
+def is_unchanged(state: dict, msg_id: int, edit_date) -> bool:
+    """回看窗口中的訊息：ID 不超過 watermark 且 edit_date 與上次記錄相同，即可跳過。"""
+    if msg_id > state["last_message_id"]:
+        return False
+    return state["edit_dates"].get(str(msg_id)) == format_edit_date(edit_date)
+
+
+def advance(state: dict, processed, lookback: int) -> dict:
+    """以本次處理的訊息推進 watermark，並只保留回看窗口內的 edit_date 記錄。
+
+    processed 為 (msg_id, edit_date) 的可迭代物件。
+    """
+    edit_dates = dict(state["edit_dates"])
+    last_message_id = state["last_message_id"]
+    for msg_id, edit_date in processed:
+        edit_dates[str(msg_id)] = format_edit_date(edit_date)
+        last_message_id = max(last_message_id, msg_id)
+
+    oldest_tracked_id = last_message_id - lookback
+    edit_dates = {k: v for k, v in edit_dates.items() if int(k) > oldest_tracked_id}
+    return {"last_message_id": last_message_id, "edit_dates": edit_dates,
+            "pending_image_ids": dict(state.get("pending_image_ids") or {}), "updated_at": state.get("updated_at")}
+
+
+def pending_image_ids(state: dict):
+    """返回需要重新處理圖片的訊息 ID (升冪)。"""
+    return sorted(int(k) for k in state.get("pending_image_ids") or {})
+
+
+def update_pending(state: dict, failed_ids, succeeded_ids, max_attempts: int):
+    """記錄本批失敗與成功的訊息。返回嘗試次數已達 max_attempts、不再重試的訊息 ID。"""
+    pending = state.setdefault("pending_image_ids", {})
+    abandoned = []
+    for msg_id in succeeded_ids:
+        pending.pop(str(msg_id), None)
+    for msg_id in failed_ids:
+        attempts = pending.get(str(msg_id), 0) + 1
+        if attempts >= max_attempts:
+            pending.pop(str(msg_id), None)
+            abandoned.append(msg_id)
+        else:
+            pending[str(msg_id)] = attempts
+    return abandoned
@@ -1,52 +1,61 @@
 # manual_push.py
 
-import os
-import requests
 import json
-from dotenv import load_dotenv
 
-# --- 配置區 ---
-# 這個腳本會從您的 .env 檔案讀取設定
-load_dotenv()
-
-# 1. 您的 posts.json 的公開 URL
-#    (這是 everypy.py 成功執行後，上傳到 Firebase Storage 的那個檔案的 URL)
-POSTS_JSON_URL = os.getenv("POSTS_JSON_URL")
-
-# 2. 您的 Cloud Function API 的基礎 URL
-CLOUD_FUNCTION_BASE_URL = os.getenv("CLOUD_FUNCTION_BASE_URL")
-
-# 3. 您的 PWA 網站的基礎 URL
-PWA_BASE_URL = os.getenv("PWA_BASE_URL")
+import config
 
-# --- 檢查配置 ---
-if not all([POSTS_JSON_URL, CLOUD_FUNCTION_BASE_URL, PWA_BASE_URL]):
-    print("錯誤：請確保您的 .env 檔案中包含了 POSTS_JSON_URL, CLOUD_FUNCTION_BASE_URL 和 PWA_BASE_URL。")
-    exit(1)
+# --- 配置區 ---
+# 設定由 config.PushConfig 從 .env 檔案與環境變數讀取：
+#   POSTS_JSON_URL          posts.json 的公開 URL (everypy.py 成功執行後，上傳到 Firebase Storage 的那個檔案)
+#   LATEST_JSON_URL         只含最新 N 則貼文的 latest.json；推播只需要第一則貼文，未設定時依 POSTS_JSON_URL 推算
+#   CLOUD_FUNCTION_BASE_URL Cloud Function API 的基礎 URL
+#   PWA_BASE_URL            PWA 網站的基礎 URL
 
-def main():
+def main(cfg=None):
     """
-    主函數：獲取最新貼文並觸發手動推播。
+    主函數：獲取最新貼文並觸發手動推播。設定缺少時返回 1。
     """
+    config.load_env()
+    cfg = cfg or config.PushConfig()
+    # --- 檢查配置 ---
+    try:
+        cfg.require()
+    except config.ConfigError as e:
+        print(f"錯誤：{e}")
+        return 1
+    import requests
+
     print("--- 開始手動推播任務 ---")
 
-    # --- 步驟 1: 從 Firebase Storage 獲取最新的 posts.json ---
-    print(f"正在從 {POSTS_JSON_URL} 獲取最新貼文列表...")
+    # --- 步驟 1: 從 Firebase Storage 獲取最新貼文 (優先使用小巧的 latest.json) ---
+    all_posts = None
+    if cfg.latest_json_url:
+        print(f"正在從 {cfg.latest_json_url} 獲取最新貼文列表...")
+        try:
+            response = requests.get(cfg.latest_json_url, timeout=10)
+            response.raise_for_status()
+            all_posts = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"警告：無法獲取 latest.json ({e})，改為下載完整的 posts.json。")
+            all_posts = None
+
     try:
-        response = requests.get(POSTS_JSON_URL, timeout=10)
-        response.raise_for_status() # 如果請求失敗 (如 404)，會拋出異常
-        all_posts = response.json()
+        if all_posts is None:
+            print(f"正在從 {cfg.posts_json_url} 獲取最新貼文列表...")
+            response = requests.get(cfg.posts_json_url, timeout=10)
+            response.raise_for_status() # 如果請求失敗 (如 404)，會拋出異常
+            all_posts = response.json()
         
         if not all_posts or not isinstance(all_posts, list):
             print("錯誤：獲取到的 posts.json 內容為空或格式不正確。")
-            return
+            return 1
             
         print(f"✅ 成功獲取到 {len(all_posts)} 筆貼文。")
 
     except requests.exceptions.RequestException as e:
         print(f"錯誤：無法獲取 posts.json 檔案。請檢查 URL 是否正確以及檔案是否已公開。")
         print(f"錯誤詳情: {e}")
-        return
+        return 1
 
     # --- 步驟 2: 提取最新一則貼文並準備 Payload ---
     latest_post = all_posts[0] # JSON 檔案已按 ID 降序排列，第一個就是最新的
@@ -61,15 +70,16 @@ def main():
         "title": "✨ 濟公報：今日最新聖賢語錄 ✨",
         "body": post_text or "點此查看今日的最新啟示。",
         #"image": post_image,
-        "url": f"{PWA_BASE_URL.rstrip('/')}/?post_id={post_id}" # 點擊後可直接定位到文章
+        "url": f"{cfg.pwa_base_url.rstrip('/')}/?post_id={post_id}" # 點擊後可直接定位到文章
     }
 
     # --- 步驟 3: 呼叫 Cloud Function API 觸發推播 ---
-    trigger_endpoint = f"{CLOUD_FUNCTION_BASE_URL.rstrip('/')}/send-daily-notification"
+    trigger_endpoint = f"{cfg.cloud_function_base_url.rstrip('/')}/send-daily-notification"
     
     print(f"\n準備發送推播請求至: {trigger_endpoint}")
     print(f"推播內容 Payload: {json.dumps(push_payload, ensure_ascii=False)}")
     
+    exit_code = 0
     try:
         api_response = requests.post(trigger_endpoint, json=push_payload, timeout=30)
         api_response.raise_for_status()
@@ -79,11 +89,14 @@ def main():
     except requests.exceptions.HTTPError as e:
         print(f"\n錯誤：觸發推播請求失敗，狀態碼 {e.response.status_code}")
         print("Cloud Function 錯誤回應:", e.response.text)
+        exit_code = 1
     except Exception as e:
         print(f"\n錯誤：觸發推播時發生未知錯誤: {e}")
+        exit_code = 1
         
     print("\n--- 手動推播任務結束 ---")
+    return exit_code
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    exit(main())
\ No newline at end of file
@@ -0,0 +1,235 @@
+# media_pipeline.py
+# everypy.py 使用的媒體處理管線：
+#   訊息迭代器 (producer) → 下載 worker 池 → 上傳 worker 池
+# 每個階段之間以有界佇列 (asyncio.Queue(maxsize=...)) 相連，
+# 所以同時在途的圖片數量受併發上限控制，不會把整個頻道一次塞進記憶體。
+# 處理完成的貼文依讀入順序分批交給 commit()：只有「之前的訊息都已完成」的連續前綴才會被提交，
+# 讓呼叫端可以在每批提交後推進 watermark，工作中途被終止時從最後提交的訊息繼續。
+
+import asyncio
+import collections
+import email.utils
+import io
+import re
+import time
+
+import rate_control
+
+# ImgBB 上傳端點。測試或本地壓測時可以指向本地的 HTTP 替身伺服器。
+IMGBB_UPLOAD_URL = "https://api.imgbb.com/1/upload"
+
+# 佇列結束標記
+_DONE = object()
+
+
+class UploadError(Exception):
+    """ImgBB 拒絕了上傳 (重試也不會成功，例如檔案格式錯誤或 API key 無效)。"""
+
+
+def retry_after_seconds(value):
+    """解析 HTTP Retry-After 標頭 (秒數或 HTTP 日期)，無法解析時返回 None。"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def build_image_file_name(msg_date_str: str, msg_id: int, text: str, file_extension: str = ".jpg") -> str:
+    """根據日期、訊息 ID 與文字開頭組出上傳用的檔名 (例如 2025-08-13_2132_濟公報.jpg)。"""
+    text_snippet = (text or "").strip()
+    if text_snippet:
+        text_snippet = re.sub(r'[\\/:*?"<>|]', '', text_snippet)
+        text_snippet = text_snippet.replace(' ', '_')
+        text_snippet = text_snippet[:30]
+        if text_snippet:
+            text_snippet = f"_{text_snippet}"
+    return f"{msg_date_str}_{msg_id}{text_snippet}{file_extension}"
+
+
+def _upload_to_imgbb_sync(file_bytes_io: io.BytesIO, file_name: str, mime_type: str,
+                          api_key: str, upload_url: str, timeout: float):
+    """同步版本的 ImgBB 上傳，只應在 worker 執行緒中呼叫。
+
+    成功時返回圖片 URL。失敗時拋出例外而不是返回 None，讓呼叫端決定是否重試：
+    HTTP 429 → rate_control.ThrottledError (帶 Retry-After)；連線錯誤、逾時與 5xx → rate_control.RetryableError；
+    其他 4xx 或 ImgBB 回報失敗 → UploadError。
+    """
+    import requests # 第一次上傳時才載入，不拖慢程式啟動
+
+    file_bytes_io.seek(0)
+
+    try:
+        response = requests.post(
+            upload_url,
+            params={"key": api_key},
+            files={"image": (file_name, file_bytes_io, mime_type)},
+            timeout=timeout,
+        )
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        raise rate_control.RetryableError(f"ImgBB 上傳請求失敗 ({file_name}): {e}") from e
+
+    if response.status_code == 429:
+        raise rate_control.ThrottledError(f"ImgBB 要求降速 ({file_name})",
+                                          retry_after_seconds(response.headers.get("Retry-After")))
+    if response.status_code >= 500:
+        raise rate_control.RetryableError(f"ImgBB 伺服器錯誤 {response.status_code} ({file_name})",
+                                          retry_after_seconds(response.headers.get("Retry-After")))
+    try:
+        data = response.json()
+    except ValueError:
+        data = None
+    if response.ok and data and data.get("success"):
+        return data["data"]["url"]
+    error_message = ((data or {}).get("error") or {}).get("message", "未知錯誤")
+    raise UploadError(f"ImgBB 上傳失敗 ({file_name}): HTTP {response.status_code} {error_message}")
+
+
+async def upload_to_imgbb(file_bytes_io: io.BytesIO, file_name: str, mime_type: str, api_key: str,
+                          upload_url: str = IMGBB_UPLOAD_URL, timeout: float = 60):
+    """將圖片從記憶體上傳到 ImgBB 並返回其 URL；失敗時拋出例外 (見 _upload_to_imgbb_sync)。
+
+    requests 是阻塞式的，因此丟到執行緒池中執行，Telethon 的事件迴圈在上傳期間仍可繼續下載其他圖片。
+    """
+    return await asyncio.to_thread(
+        _upload_to_imgbb_sync, file_bytes_io, file_name, mime_type, api_key, upload_url, timeout
+    )
+
+
+async def run_media_pipeline(messages, plan, download, upload, commit,
+                             download_workers: int = 4, upload_workers: int = 4,
+                             on_progress=None, on_failure=None,
+                             commit_every: int = 200, commit_interval: float = 30.0) -> int:
+    """以有界的 producer/consumer 管線處理一批訊息，並分批提交處理完成的貼文。返回處理的訊息數。
+
+    參數:
+        messages: 訊息的 async iterable (例如 client.iter_messages(...))。
+        plan(msg): 同步函式，返回 (post_item, media_job)。
+            post_item 是要輸出的字典 (必須含 "id")；media_job 為 None 表示不需要下載圖片。
+        download(media_job): async 函式，返回 io.BytesIO；返回 None 表示沒有可下載的內容，失敗時拋出例外。
+        upload(media_job, file_bytes_io): async 函式，返回圖片 URL，失敗時拋出例外。
+        commit(posts): 同步函式，收到依讀入順序排列、且之前的訊息都已完成的一批 post_item。
+            累積 commit_every 則，或距離上次提交超過 commit_interval 秒時提交一次，結束時提交剩下的部分。
+        download_workers / upload_workers: 兩個 worker 池各自的併發上限。
+        on_progress(processed_count): 每讀入一則訊息時呼叫，用於顯示進度。
+        on_failure(post_item, error): 圖片下載或上傳失敗時呼叫 (可在此回填既有的圖片)，之後貼文照常提交。
+    任何一個 worker、commit() 或 on_failure() 拋出的例外都會取消整個管線並由本函式拋出。
+    """
+    download_workers = max(1, int(download_workers))
+    upload_workers = max(1, int(upload_workers))
+
+    # 佇列容量為 worker 數的兩倍：讓 worker 永遠有下一件工作可拿，又不會無限堆積
+    download_queue = asyncio.Queue(maxsize=download_workers * 2)
+    upload_queue = asyncio.Queue(maxsize=upload_workers * 2)
+
+    # 依讀入順序排列的 [post_item, 是否完成]；已完成的連續前綴移到 ready 等待提交
+    in_flight = collections.deque()
+    ready = []
+    last_commit = time.monotonic()
+
+    def flush(force: bool = False) -> None:
+        nonlocal last_commit
+        while in_flight and in_flight[0][1]:
+            ready.append(in_flight.popleft()[0])
+        if ready and (force or len(ready) >= commit_every or time.monotonic() - last_commit >= commit_interval):
+            batch = ready[:]
+            ready.clear()
+            commit(batch)
+            last_commit = time.monotonic()
+
+    def fail(entry, stage: str, error: Exception) -> None:
+        post_item = entry[0]
+        if on_failure:
+            on_failure(post_item, error)
+        else:
+            print(f"\n{stage}圖片失敗 (訊息 ID {post_item['id']}): {error}")
+
+    async def producer():
+        processed_count = 0
+        async for msg in messages:
+            post_item, media_job = plan(msg)
+            if post_item is None:
+                continue
+            entry = [post_item, media_job is None]
+            in_flight.append(entry)
+            processed_count += 1
+            if on_progress:
+                on_progress(processed_count)
+            if media_job is not None:
+                await download_queue.put((entry, media_job))
+            # 只在 producer 中提交：commit() 拋出的例外會中止整個管線，而不是讓某個 worker 默默停止
+            flush()
+        return processed_count
+
+    async def download_worker():
+        while True:
+            job = await download_queue.get()
+            try:
+                if job is _DONE:
+                    return
+                entry, media_job = job
+                try:
+                    file_bytes_io = await download(media_job)
+                except Exception as e:
+                    fail(entry, "下載", e)
+                    file_bytes_io = None
+                if file_bytes_io is not None:
+                    await upload_queue.put((entry, media_job, file_bytes_io))
+                else:
+                    entry[1] = True
+            finally:
+                download_queue.task_done()
+
+    async def upload_worker():
+        while True:
+            job = await upload_queue.get()
+            try:
+                if job is _DONE:
+                    return
+                entry, media_job, file_bytes_io = job
+                try:
+                    entry[0]["image"] = await upload(media_job, file_bytes_io)
+                except Exception as e:
+                    fail(entry, "上傳", e)
+                finally:
+                    file_bytes_io.close()
+                    entry[1] = True
+            finally:
+                upload_queue.task_done()
+
+    download_tasks = [asyncio.create_task(download_worker()) for _ in range(download_workers)]
+    upload_tasks = [asyncio.create_task(upload_worker()) for _ in range(upload_workers)]
+
+    async def drain():
+        processed_count = await producer()
+        # 依序關閉兩個 worker 池：先等所有下載結束，再通知上傳 worker 收工
+        for _ in download_tasks:
+            await download_queue.put(_DONE)
+        await asyncio.gather(*download_tasks)
+        for _ in upload_tasks:
+            await upload_queue.put(_DONE)
+        await asyncio.gather(*upload_tasks)
+        return processed_count
+
+    worker_tasks = download_tasks + upload_tasks
+    drain_task = asyncio.create_task(drain())
+    try:
+        # worker 拋出例外 (例如 on_failure 本身失敗) 時立即中止整個管線：
+        # 否則剩下的 worker 不再取用佇列，producer 會永遠卡在已滿的佇列上
+        done, _ = await asyncio.wait([drain_task, *worker_tasks], return_when=asyncio.FIRST_EXCEPTION)
+        for task in worker_tasks:
+            if task in done and not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+        processed_count = await drain_task
+    finally:
+        for task in [drain_task] + worker_tasks:
+            task.cancel()
+
+    flush(force=True)
+    return processed_count
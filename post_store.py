@@ -0,0 +1,195 @@
+# post_store.py
+# 以 SQLite 為底的貼文儲存 (posts.db)，作為所有輸出檔案的唯一資料來源：
+#   - 以 Telegram 訊息 ID 為主鍵，upsert 只會動到本次新增或編輯的貼文
+#   - 依日期與 ID 建立索引，支援日期範圍查詢與「最新 N 則」查詢
+#   - posts.json 與其他衍生檔案以串流方式從資料庫輸出，記憶體用量不隨歸檔大小成長
+# 匯入多個頻道時每個頻道各有一個資料庫 (訊息 ID 只在同一頻道內唯一)，
+# 合併的輸出以 merge_posts() 把各頻道已排序的串流合併，不需要重新排序整個歸檔。
+
+import heapq
+import json
+import os
+import sqlite3
+
+POST_STORE_FILE = "posts.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id    INTEGER PRIMARY KEY,
+    date  TEXT NOT NULL,
+    text  TEXT NOT NULL DEFAULT '',
+    image TEXT,
+    image_meta TEXT
+);
+CREATE INDEX IF NOT EXISTS posts_date_id ON posts (date DESC, id DESC);
+"""
+
+_COLUMNS = "id, date, text, image, image_meta"
+
+# 與 posts.json 相同的排序：日期降序，日期相同則 ID 降序 (最新的在最上面)
+_EXPORT_ORDER = "ORDER BY date DESC, id DESC"
+
+
+def _row_to_post(row) -> dict:
+    post = {"id": row[0], "date": row[1], "text": row[2], "image": row[3]}
+    # 圖片尺寸、BlurHash 與 srcset (見 image_derivatives.py)；沒有時不輸出此欄位，舊貼文的輸出保持不變
+    if row[4]:
+        post["image_meta"] = json.loads(row[4])
+    return post
+
+
+def post_key(post):
+    """貼文在合併輸出中的唯一鍵：主頻道為訊息 ID，其他頻道為 "<channel>:<訊息 ID>"。"""
+    return f"{post['channel']}:{post['id']}" if post.get("channel") else post["id"]
+
+
+def output_order_key(post):
+    """輸出順序 (降序排列)：日期、訊息 ID，不同頻道的日期與 ID 都相同時再依頻道名稱。"""
+    return post.get("date") or "", post.get("id") or 0, post.get("channel") or ""
+
+
+def merge_posts(*streams):
+    """把多個依輸出順序排列的貼文串流合併成一個，只逐筆比較各串流的開頭，不需要重新排序。"""
+    if len(streams) == 1:
+        return iter(streams[0])
+    return heapq.merge(*streams, key=output_order_key, reverse=True)
+
+
+def _meta_to_column(post):
+    meta = post.get("image_meta")
+    return json.dumps(meta, ensure_ascii=False, separators=(",", ":"), sort_keys=True) if meta else None
+
+
+class PostStore:
+    """以訊息 ID 為鍵的貼文資料庫。可作為 context manager 使用。"""
+
+    def __init__(self, path: str = POST_STORE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+        # 舊版資料庫沒有 image_meta 欄位時補上
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(posts)")}
+        if "image_meta" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE posts ADD COLUMN image_meta TEXT")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # --- 寫入 ---
+    def upsert(self, posts) -> int:
+        """新增或更新貼文 (以 ID 為鍵)，返回實際有變化的筆數。內容完全相同的貼文不會被改寫。"""
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO posts (id, date, text, image, image_meta) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET date = excluded.date, text = excluded.text, image = excluded.image,
+                                              image_meta = excluded.image_meta
+                WHERE posts.date IS NOT excluded.date OR posts.text IS NOT excluded.text
+                   OR posts.image IS NOT excluded.image OR posts.image_meta IS NOT excluded.image_meta
+                """,
+                ((post["id"], post["date"], post.get("text") or "", post.get("image"), _meta_to_column(post))
+                 for post in posts if post.get("id") is not None and post.get("date")),
+            )
+        return self.conn.total_changes - before
+
+    def delete(self, ids) -> int:
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany("DELETE FROM posts WHERE id = ?", ((post_id,) for post_id in ids))
+        return self.conn.total_changes - before
+
+    # --- 查詢 ---
+    def get(self, post_id):
+        row = self.conn.execute(f"SELECT {_COLUMNS} FROM posts WHERE id = ?", (post_id,)).fetchone()
+        return _row_to_post(row) if row else None
+
+    def has(self, post_id) -> bool:
+        return self.conn.execute("SELECT 1 FROM posts WHERE id = ?", (post_id,)).fetchone() is not None
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def max_id(self) -> int:
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM posts").fetchone()[0]
+
+    def latest(self, n: int):
+        """最新的 n 則貼文 (依輸出順序)。"""
+        rows = self.conn.execute(f"SELECT {_COLUMNS} FROM posts {_EXPORT_ORDER} LIMIT ?", (n,))
+        return [_row_to_post(row) for row in rows]
+
+    def date_range(self, date_from: str, date_to: str):
+        """日期介於 date_from 與 date_to (皆含，YYYY-MM-DD) 之間的貼文，依輸出順序。"""
+        rows = self.conn.execute(
+            f"SELECT {_COLUMNS} FROM posts WHERE date BETWEEN ? AND ? {_EXPORT_ORDER}",
+            (date_from, date_to),
+        )
+        return [_row_to_post(row) for row in rows]
+
+    def iter_posts(self, batch_size: int = 500, channel: str = None, by_id: bool = False):
+        """依輸出順序逐筆讀出所有貼文 (分批讀取，不會一次載入整個資料表)。
+
+        指定 channel 時每則貼文加上 "channel" 欄位 (用於多個頻道的合併輸出)；
+        by_id 為 True 時改依訊息 ID 升序 (回補的部分分片使用)。
+        """
+        cursor = self.conn.execute(f"SELECT {_COLUMNS} FROM posts {'ORDER BY id' if by_id else _EXPORT_ORDER}")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                post = _row_to_post(row)
+                if channel:
+                    post["channel"] = channel
+                yield post
+
+    # --- 匯入 / 匯出 ---
+    def import_json(self, path: str) -> int:
+        """把既有的 posts.json 匯入資料庫 (第一次啟用資料庫時使用)，返回有變化的筆數。
+
+        合併輸出中其他頻道的貼文 (有 channel 欄位) 不屬於這個資料庫，會被略過。
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            posts = json.load(f)
+        if not isinstance(posts, list):
+            raise ValueError(f"{path} 的內容不是 JSON 陣列")
+        return self.upsert(post for post in posts if not post.get("channel"))
+
+    def export_json(self, path: str, indent=2) -> int:
+        """以串流方式輸出 posts.json，返回輸出的筆數。"""
+        return write_posts_json(self.iter_posts(), path, indent=indent)
+
+
+def write_posts_json(posts, path: str, indent=2) -> int:
+    """逐筆寫出 JSON 陣列，輸出結果與 json.dump(list(posts), f, ensure_ascii=False, indent=indent) 相同；
+    indent 為 None 時輸出緊湊格式，與再加上 separators=(",", ":") 的 json.dump 相同。
+
+    先寫入暫存檔再改名，避免讀取端看到寫到一半的檔案。
+    """
+    tmp_path = f"{path}.tmp"
+    count = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for post in posts:
+            if indent is None:
+                item = json.dumps(post, ensure_ascii=False, separators=(",", ":"))
+                f.write(("," if count else "[") + item)
+            else:
+                pad = " " * indent
+                item = json.dumps(post, ensure_ascii=False, indent=indent).replace("\n", "\n" + pad)
+                f.write((",\n" if count else "[\n") + pad + item)
+            count += 1
+        if count == 0:
+            f.write("[]")
+        elif indent is None:
+            f.write("]")
+        else:
+            f.write("\n]")
+    os.replace(tmp_path, path)
+    return count
@@ -1,7 +1,7 @@
 // budaCards.js (Merged and Enhanced Version)
 
 // 模組變數
-let _allPosts, _getImageUrl, _showCustomAlert, _showModal, _PWA_SUB_PATH, _gachaContainer;
+let _allPosts, _getImageUrl, _buildImageHtml, _showCustomAlert, _showModal, _PWA_SUB_PATH, _gachaContainer;
 let _drawCardBtn, _gachaModalOverlay, _gachaModal, _closeGachaBtn, _rollDiceBtn, _drawAgainBtn, _diceResultDisplay, _drawnCardsContainer, _gachaInstructions;
 let _diceContainer, _diceCube, _diceTextResult; // Added _diceTextResult as per old code for consistency
 let _selectedGachaCardElement = null;
@@ -309,6 +309,11 @@ const displayDrawnCards = (cards) => {
 
         const imageUrl = _getImageUrl(card.image);
         const cardBackImageUrl = _getImageUrl('icons/濟公報logo.png'); 
+        const cardOnError = `onerror="this.src='${_getImageUrl('icons/placeholder.png')}'; this.alt='圖片載入失敗';"`;
+        // 有 image_meta 時使用縮圖 srcset (卡片寬度約為半個螢幕)
+        const cardImageHtml = _buildImageHtml
+            ? _buildImageHtml(card, "仙佛小卡", "50vw", cardOnError)
+            : `<img src="${imageUrl}" alt="仙佛小卡" ${cardOnError}>`;
 
         const displayText = (card.text || '').replace(/\n/g, ' '); 
 
@@ -322,7 +327,7 @@ const displayDrawnCards = (cards) => {
                     <img src="${cardBackImageUrl}" alt="卡背" onerror="this.src='${_getImageUrl('icons/placeholder.png')}'; this.alt='圖片載入失敗';">
                 </div>
                 <div class="card-face card-front">
-                    <img src="${imageUrl}" alt="仙佛小卡" onerror="this.src='${_getImageUrl('icons/placeholder.png')}'; this.alt='圖片載入失敗';">
+                    ${cardImageHtml}
                     ${luckyNumberDisplay} 
                     <div class="card-date">${card.date || ''}</div>
                     <div class="card-text">${displayText}</div>
@@ -374,12 +379,13 @@ const displayDrawnCards = (cards) => {
  * @param {HTMLElement} options.container - 抽卡遊戲將被注入的 HTML 容器元素
  * @param {Array<object>} options.allPosts - 所有文章數據
  * @param {function} options.getImageUrl - 圖片路徑處理函數
+ * @param {function} [options.buildImageHtml] - 產生響應式圖片 HTML 的函數 (index.html 的 buildPostImageHtml)，未提供時使用原圖
  * @param {function} options.showCustomAlert - 自定義彈窗函數
  * @param {function} options.showModal - 顯示大圖模態視窗函數
  * @param {string} options.PWA_SUB_PATH - PWA 子路徑 (用於 getImageUrl 內部處理)
  */
 function initializeBudaCardsLogic(options) {
-    ({ container: _gachaContainer, allPosts: _allPosts, getImageUrl: _getImageUrl, showCustomAlert: _showCustomAlert, showModal: _showModal, PWA_SUB_PATH: _PWA_SUB_PATH } = options);
+    ({ container: _gachaContainer, allPosts: _allPosts, getImageUrl: _getImageUrl, buildImageHtml: _buildImageHtml, showCustomAlert: _showCustomAlert, showModal: _showModal, PWA_SUB_PATH: _PWA_SUB_PATH } = options);
 
     _gachaContainer.innerHTML = `
         <style>
@@ -42,6 +42,8 @@ function initializePwaLogic(domElements) {
     let swRegistration = null; // 用於保存 Service Worker 註冊的實例
     let deferredPrompt; // 用於保存 PWA 安裝提示事件
     const LOCAL_STORAGE_SUBSCRIPTION_KEY = 'userSubscribedToNotifications'; // 確認名稱
+    const LOCAL_STORAGE_HEARTBEAT_KEY = 'lastHeartbeatSentAt'; // 上次成功送出心跳的時間 (毫秒)
+    const HEARTBEAT_INTERVAL_MS = 12 * 60 * 60 * 1000; // 與後端 HEARTBEAT_WINDOW_HOURS 相同，窗口內只送一次
     let initialClickCount = 0; // 初始化點擊計數器
     const REQUIRED_CLICKS_FOR_PROMPT = 2; // 設定需要 2 次點擊就觸發提示
     let isInteractionPaused = false; // 控制點擊偵測的旗標
@@ -368,13 +370,20 @@ function initializePwaLogic(domElements) {
             return;
         }
         try {
+            const lastSentAt = Number(localStorage.getItem(LOCAL_STORAGE_HEARTBEAT_KEY) || 0);
+            if (Date.now() - lastSentAt < HEARTBEAT_INTERVAL_MS) {
+                console.log('[心跳] 距離上次心跳未滿間隔，略過。');
+                return;
+            }
             const subscription = await swRegistration.pushManager.getSubscription();
             if (subscription && subscription.endpoint) {
                 fetch(`${BACKEND_BASE_URL}/heartbeat`, {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({ endpoint: subscription.endpoint }),
-                });
+                }).then((response) => {
+                    if (response.ok) localStorage.setItem(LOCAL_STORAGE_HEARTBEAT_KEY, String(Date.now()));
+                }).catch(() => {});
                 console.log('[心跳] 已向後端發送裝置活躍信號。');
             }
         } catch (error) {
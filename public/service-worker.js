@@ -11,14 +11,19 @@ const PWA_SUB_PATH = ""; // 部署到 Firebase Hosting 根目錄，此設定正
 const BACKEND_BASE_URL = 'https://us-central1-jigong-news-test.cloudfunctions.net/api';
 
 // 每次更新預緩存資源時，請務必更新版本號以強制 Service Worker 更新
-const CACHE_NAME = 'jigong-pwa-cache-v2.0.6'; // <--- 已更新版本號
+const CACHE_NAME = 'jigong-pwa-cache-v2.0.15'; // <--- 已更新版本號
+
+// 文章資料 (latest.json、posts/ 分片、version.json、deltas/ 等) 由匯入程式發布到 Cloud Storage bucket，
+// 不在 Firebase Hosting 上；必須與 index.html 的 postsBaseUrl 保持一致 (本地開發時為同一個來源)
+const IS_LOCALHOST = self.location.hostname === 'localhost' || self.location.hostname === '127.0.0.1';
+const DATA_BASE_URL = IS_LOCALHOST ? self.location.origin : 'https://storage.googleapis.com/jigong-news-test.firebasestorage.app';
 
 // 需要預緩存的資源列表 (已修正為相對路徑)
 const urlsToCache = [
   './',
   './index.html',
   './manifest.json',
-  './posts.json',
+  `${DATA_BASE_URL}/latest.json`, // 離線時的首屏 (與 index.html 請求的網址相同)
   './pwa-notifications.js',
   './service-worker.js',
   './zh-tw.js',
@@ -96,8 +101,43 @@ self.addEventListener('fetch', event => {
     return; // 讓瀏覽器自己處理這些請求
   }
 
-  // 對於 posts.json，採用 Network First (網路優先) 策略
-  if (requestUrl.pathname.endsWith('/posts.json')) {
+  // 發布產物 publish/<名稱>.<雜湊>.json 內容永遠不變：Cache First，
+  // 並在快取新版本時移除同名產物的舊版本，避免快取隨著每次發布不斷變大
+  const publishedArtifact = requestUrl.pathname.match(/\/publish\/([^/.]+)\.[0-9a-f]+\.json$/);
+  if (publishedArtifact) {
+    event.respondWith(
+      caches.open(CACHE_NAME).then(cache =>
+        cache.match(event.request).then(cachedResponse => {
+          if (cachedResponse) {
+            return cachedResponse;
+          }
+          return fetch(event.request).then(networkResponse => {
+            if (networkResponse && networkResponse.status === 200) {
+              const responseToCache = networkResponse.clone();
+              cache.keys().then(requests => Promise.all(requests
+                .filter(request => {
+                  const match = new URL(request.url).pathname.match(/\/publish\/([^/.]+)\.[0-9a-f]+\.json$/);
+                  return match && match[1] === publishedArtifact[1] && request.url !== event.request.url;
+                })
+                .map(request => cache.delete(request))))
+                .then(() => cache.put(event.request, responseToCache));
+            }
+            return networkResponse;
+          });
+        })
+      )
+    );
+    return;
+  }
+
+  // 對於 posts.json、latest.json、分片清單 manifest.json 與發布指標檔 current.json，採用 Network First (網路優先) 策略
+  // (月份分片的網址帶有內容雜湊，交給下方的 Cache First 處理即可)
+  if (
+    requestUrl.pathname.endsWith('/posts.json') ||
+    requestUrl.pathname.endsWith('/latest.json') ||
+    requestUrl.pathname.endsWith('/posts/manifest.json') ||
+    requestUrl.pathname.endsWith('/publish/current.json')
+  ) {
     event.respondWith(
       fetch(event.request)
         .then(networkResponse => {
@@ -110,7 +150,7 @@ self.addEventListener('fetch', event => {
           return networkResponse;
         })
         .catch(() => {
-          console.warn('[Service Worker] Network for posts.json failed, falling back to cache.');
+          console.warn(`[Service Worker] Network for ${requestUrl.pathname} failed, falling back to cache.`);
           return caches.match(event.request);
         })
     );
@@ -224,42 +264,59 @@ self.addEventListener('periodicsync', event => {
   }
 });
 
+// 只比對 version.json (幾百位元組) 的版本號，不再下載並比對整個 posts.json
 async function checkForUpdatesAndNotify() {
   try {
-    console.log('[Service Worker] 背景同步：正在檢查 posts.json 更新...');
+    console.log('[Service Worker] 背景同步：正在檢查 version.json 更新...');
     const cache = await caches.open(CACHE_NAME);
-    const postsJsonFullPath = new URL('./posts.json', self.location.origin).href;
+    // version.json 與 deltas/ 由匯入程式發布到 bucket (Hosting 上沒有這些檔案)
+    const versionJsonFullPath = `${DATA_BASE_URL}/version.json`;
 
-    const networkResponse = await fetch(postsJsonFullPath, { cache: 'no-store' });
+    const networkResponse = await fetch(versionJsonFullPath, { cache: 'no-store' });
     if (!networkResponse.ok) {
-      console.error('[Service Worker] 背景同步失敗：無法從網路獲取 posts.json。', networkResponse.statusText);
+      console.error('[Service Worker] 背景同步失敗：無法從網路獲取 version.json。', networkResponse.statusText);
       return;
     }
+    const networkVersion = await networkResponse.clone().json();
 
-    const cachedResponse = await cache.match(postsJsonFullPath);
-
-    if (cachedResponse) {
-      const networkText = await networkResponse.clone().text();
-      const cachedText = await cachedResponse.text();
-
-      if (networkText !== cachedText) {
-        console.log('[Service Worker] 背景檢查發現新內容，發送推通知播。');
-        await cache.put(postsJsonFullPath, networkResponse.clone());
-        self.registration.showNotification('濟公報有新內容！', {
-          body: '點擊查看最新聖賢語錄。',
-          icon: './icons/icon-192.png',
-          badge: './icons/濟公報logo.png',
-          tag: 'jigongbao-content-update',
-          data: {
-            url: './index.html?source=periodicsync'
+    const cachedResponse = await cache.match(versionJsonFullPath);
+    await cache.put(versionJsonFullPath, networkResponse.clone());
+
+    if (!cachedResponse) {
+      console.log('[Service Worker] 背景同步：無快取版本，已記錄目前版本', networkVersion.version);
+      return;
+    }
+
+    const cachedVersion = await cachedResponse.json();
+    if (networkVersion.version > cachedVersion.version) {
+      console.log(`[Service Worker] 背景檢查發現新版本 ${cachedVersion.version} → ${networkVersion.version}，發送推播通知。`);
+
+      // 讀取最新一個 delta，用其中最新的貼文作為通知內容 (失敗時使用預設文字)
+      let body = '點擊查看最新聖賢語錄。';
+      try {
+        const deltaUrl = `${DATA_BASE_URL}/deltas/${networkVersion.version}.json`;
+        const deltaResponse = await fetch(deltaUrl);
+        if (deltaResponse.ok) {
+          const delta = await deltaResponse.json();
+          if (delta.upserts && delta.upserts.length > 0 && delta.upserts[0].text) {
+            body = delta.upserts[0].text;
           }
-        });
-      } else {
-        console.log('[Service Worker] 背景同步：內容無更新。');
+        }
+      } catch (deltaError) {
+        console.warn('[Service Worker] 無法讀取 delta，使用預設通知內容。', deltaError);
       }
+
+      self.registration.showNotification('濟公報有新內容！', {
+        body: body,
+        icon: './icons/icon-192.png',
+        badge: './icons/濟公報logo.png',
+        tag: 'jigongbao-content-update',
+        data: {
+          url: './index.html?source=periodicsync'
+        }
+      });
     } else {
-      console.log('[Service Worker] 背景同步：無快取版本，正在快取新內容。');
-      await cache.put(postsJsonFullPath, networkResponse.clone());
+      console.log('[Service Worker] 背景同步：內容無更新。');
     }
   } catch (error) {
     console.error('[Service Worker] 背景內容檢查出錯：', error);
@@ -0,0 +1,175 @@
+# publish_artifacts.py
+# 發布階段：把前端要下載的 JSON 檔案整理成「內容雜湊檔名」的不可變產物：
+#   publish/posts.<hash>.json          緊湊格式 (不縮排、保留中文字元)
+#   publish/posts.<hash>.json.gz       預先壓縮的 gzip 版本 (固定 mtime，內容相同時位元組也相同)
+#   publish/posts.<hash>.json.br       預先壓縮的 brotli 版本 (需要 brotli 套件，未安裝時略過)
+#   publish/current.json               指標檔：每個產物目前的檔名、雜湊與各壓縮版本的大小
+# 有雜湊的檔案內容永遠不變，可以用 Cache-Control: immutable 長期快取；
+# 只有很小的 current.json 需要每次重新驗證 (通常得到 304)。
+# 匯出結果與上一次位元組完全相同時不產生任何新檔案，current.json 也不會被改寫。
+# 比對的基準可以是 bucket 中已發布的 current.json (全新的容器沒有本地的 publish/)：
+# 其中列出的產物視為已經存在於 bucket，不會重新產生；超過保留數量的舊版本由 gcs_sync.delete_stale_artifacts 從 bucket 刪除。
+
+import datetime
+import gzip
+import hashlib
+import importlib.util
+import json
+import os
+
+PUBLISH_DIR = "publish"
+POINTER_FILE_NAME = "current.json"
+POINTER_FORMAT_VERSION = 1
+# 每個產物除了目前的版本，再保留幾個舊版本 (仍持有舊 current.json 的頁面可以繼續下載)
+DEFAULT_RETENTION = 2
+
+BROTLI_AVAILABLE = importlib.util.find_spec("brotli") is not None
+HASH_LENGTH = 16
+# brotli 最高品質 (11) 每秒只能壓縮約 0.3 MB，每次運行都要重新壓縮完整歸檔與搜尋索引；
+# 品質 9 快二十倍以上，檔案只大約 10%
+BROTLI_QUALITY = 9
+_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    """以串流方式計算檔案的 SHA-256。"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def artifact_file_name(name: str, digest: str) -> str:
+    return f"{name}.{digest[:HASH_LENGTH]}.json"
+
+
+def _compress(source_path: str, target_path: str, encoding: str) -> int:
+    """把 source_path 壓縮成 target_path (先寫暫存檔再改名)，返回壓縮後的位元組數。"""
+    tmp_path = f"{target_path}.tmp"
+    with open(source_path, "rb") as src, open(tmp_path, "wb") as dst:
+        if encoding == "gzip":
+            # 不記錄檔名與時間，內容相同時輸出也相同
+            with gzip.GzipFile(filename="", mode="wb", fileobj=dst, compresslevel=9, mtime=0) as gz:
+                for chunk in iter(lambda: src.read(_CHUNK_SIZE), b""):
+                    gz.write(chunk)
+        else:
+            import brotli
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY, mode=brotli.MODE_TEXT)
+            for chunk in iter(lambda: src.read(_CHUNK_SIZE), b""):
+                dst.write(compressor.process(chunk))
+            dst.write(compressor.finish())
+    os.replace(tmp_path, target_path)
+    return os.path.getsize(target_path)
+
+
+def load_pointer(publish_dir: str = PUBLISH_DIR) -> dict:
+    path = os.path.join(publish_dir, POINTER_FILE_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        print(f"警告：{path} 不是有效的 JSON，將重新產生指標檔。")
+        return {}
+
+
+def referenced_files(pointer: dict) -> set:
+    """指標檔引用的所有檔案名稱 (目前與保留的舊版本，含壓縮檔)，包含指標檔本身。"""
+    names = {POINTER_FILE_NAME}
+    for entry in (pointer.get("artifacts") or {}).values():
+        for file_name in [entry.get("file")] + list(entry.get("previous") or []):
+            if file_name:
+                names.update(file_name + suffix for suffix in ("", ".gz", ".br"))
+    return names
+
+
+def _write_pointer(pointer: dict, publish_dir: str) -> None:
+    path = os.path.join(publish_dir, POINTER_FILE_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(pointer, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _publish_one(name: str, source_path: str, publish_dir: str, previous_entry: dict, retention: int,
+                 published_remotely: bool = False):
+    """發布單一產物。返回 (指標檔中的項目, 是否產生了新版本)。
+
+    published_remotely 為 True 時 previous_entry 來自 bucket 中的 current.json，
+    雜湊相同就不需要本地的產物檔案 (bucket 中已經有了)。
+    """
+    digest = file_digest(source_path)
+    file_name = artifact_file_name(name, digest)
+    path = os.path.join(publish_dir, file_name)
+    encodings = {"gzip": ".gz"}
+    if BROTLI_AVAILABLE:
+        encodings["br"] = ".br"
+
+    if previous_entry.get("sha256") == digest and set(previous_entry.get("encodings") or {}) == set(encodings) and \
+            (published_remotely or all(os.path.exists(path + suffix) for suffix in ("",) + tuple(encodings.values()))):
+        return previous_entry, False
+
+    entry = {"file": file_name, "sha256": digest, "bytes": os.path.getsize(source_path), "encodings": {}}
+    for encoding, suffix in encodings.items():
+        target = path + suffix
+        size = os.path.getsize(target) if os.path.exists(target) else _compress(source_path, target, encoding)
+        entry["encodings"][encoding] = {"file": file_name + suffix, "bytes": size}
+    if not os.path.exists(path):
+        tmp_path = f"{path}.tmp"
+        with open(source_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for chunk in iter(lambda: src.read(_CHUNK_SIZE), b""):
+                dst.write(chunk)
+        os.replace(tmp_path, path)
+
+    # 記錄舊版本的檔名，超過保留數量的舊版本連同壓縮檔一起刪除
+    history = [previous_entry["file"]] + previous_entry.get("previous", []) if previous_entry.get("file") else []
+    history = [old for old in history if old != file_name]
+    entry["previous"] = history[:retention]
+    for old in history[retention:]:
+        for suffix in ("", ".gz", ".br"):
+            old_path = os.path.join(publish_dir, old + suffix)
+            if os.path.exists(old_path):
+                os.remove(old_path)
+    return entry, True
+
+
+def publish(sources: dict, publish_dir: str = PUBLISH_DIR, retention: int = DEFAULT_RETENTION,
+            remote_pointer: dict = None) -> dict:
+    """發布 sources ({產物名稱: 來源檔案路徑}) 中的每個檔案並更新 current.json。
+
+    來源檔案應該已是緊湊格式的 JSON。不存在的來源會被略過 (指標檔保留原本的項目)。
+    remote_pointer 為 bucket 中已發布的 current.json (沒有時為 None)，有的話以它而不是本地的指標檔為比對基準。
+    返回統計資訊：{"published": [...], "unchanged": [...], "pointer_written": bool, "artifacts": {...}}
+    """
+    os.makedirs(publish_dir, exist_ok=True)
+    local_pointer = load_pointer(publish_dir)
+    pointer = remote_pointer or local_pointer
+    previous_artifacts = pointer.get("artifacts", {})
+    artifacts = dict(previous_artifacts)
+    published, unchanged = [], []
+
+    for name, source_path in sources.items():
+        if not source_path or not os.path.exists(source_path):
+            continue
+        entry, changed = _publish_one(name, source_path, publish_dir, previous_artifacts.get(name, {}), retention,
+                                      published_remotely=bool(remote_pointer))
+        artifacts[name] = entry
+        (published if changed else unchanged).append(name)
+
+    pointer_written = False
+    if published or pointer.get("version") != POINTER_FORMAT_VERSION:
+        pointer = {
+            "version": POINTER_FORMAT_VERSION,
+            "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "artifacts": artifacts,
+        }
+        _write_pointer(pointer, publish_dir)
+        pointer_written = True
+    elif pointer != local_pointer:
+        # 沿用 bucket 中的指標檔 (位元組與遠端相同，不會被重新上傳)，之後的保留與刪除都以它為準
+        _write_pointer(pointer, publish_dir)
+
+    return {"published": published, "unchanged": unchanged, "pointer_written": pointer_written,
+            "artifacts": artifacts}
@@ -0,0 +1,147 @@
+# rate_control.py
+# 上游服務 (Telegram、ImgBB) 的速率控制與重試：
+#   RateController   每個上游一個，所有 worker 共用。令牌桶限制送出速率，
+#                    成功時緩慢加速 (additive increase)，被限流時減半 (multiplicative decrease)，
+#                    收到 FloodWait / Retry-After 時讓所有 worker 一起暫停到指定時間。
+#   call_with_retry  透過 RateController 呼叫上游，可重試的錯誤以 jitter 指數退避重試，
+#                    重試用盡或遇到不可重試的錯誤時拋出最後一個例外 (不會默默返回 None)。
+#
+# 不 import Telethon：FloodWaitError 等錯誤以類別名稱與屬性判斷，讓壓測與測試替身也能使用。
+
+import asyncio
+import random
+import time
+
+# 錯誤分類
+THROTTLED = "throttled" # 被上游限流 (FloodWait、HTTP 429)，需要降速
+RETRY = "retry"         # 暫時性錯誤 (連線中斷、逾時、5xx)，退避後重試
+FATAL = "fatal"         # 重試也不會成功的錯誤
+
+# Telethon 中代表伺服器暫時性問題的錯誤類別名稱
+_TELEGRAM_RETRYABLE_ERRORS = {"ServerError", "RpcCallFailError", "RpcMcgetFailError", "TimedOutError"}
+
+
+class RetryableError(Exception):
+    """可重試的上游錯誤。retry_after 為上游要求的等待秒數 (可為 None)。"""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ThrottledError(RetryableError):
+    """上游要求降速 (例如 HTTP 429)。"""
+
+
+def classify_error(error: Exception):
+    """返回 (分類, 上游要求的等待秒數或 None)。"""
+    if isinstance(error, ThrottledError):
+        return THROTTLED, error.retry_after
+    if isinstance(error, RetryableError):
+        return RETRY, error.retry_after
+    name = type(error).__name__
+    # telethon.errors.FloodWaitError / FloodPremiumWaitError 以 .seconds 表示需要等待的秒數
+    if "FloodWait" in name and isinstance(getattr(error, "seconds", None), (int, float)):
+        return THROTTLED, float(error.seconds)
+    if name in _TELEGRAM_RETRYABLE_ERRORS or isinstance(error, (asyncio.TimeoutError, ConnectionError, OSError)):
+        return RETRY, None
+    return FATAL, None
+
+
+class RateController:
+    """單一上游共用的令牌桶 + AIMD 速率控制。rate 為每秒允許送出的請求數，0 表示不限速 (仍會遵守暫停要求)。"""
+
+    def __init__(self, name: str, rate: float, burst: float = None, min_rate: float = None,
+                 max_rate: float = None, increase: float = None, decrease: float = 0.5):
+        self.name = name
+        self.rate = float(rate)
+        self.unlimited = self.rate <= 0
+        self.min_rate = float(min_rate) if min_rate else max(0.1, self.rate / 16)
+        self.max_rate = float(max_rate) if max_rate else self.rate * 4
+        # 每秒的成功請求讓速率增加約 increase (預設為初始速率的 5%)
+        self.increase = float(increase) if increase else self.rate * 0.05
+        self.decrease = decrease
+        self.burst = float(burst) if burst else max(1.0, self.rate)
+        self.tokens = self.burst
+        self.blocked_until = 0.0
+        self.throttles = 0
+        self.waited_seconds = 0.0
+        self._updated = time.monotonic()
+        self._lock = None # 第一次 acquire 時在執行中的事件迴圈上建立
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """等待到可以送出下一個請求 (依序排隊，暫停期間所有呼叫者一起等待)。"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.unlimited:
+                    return
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+
+    def on_success(self) -> None:
+        if self.unlimited:
+            return
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self, retry_after: float = None) -> None:
+        """被限流：速率減半並清空令牌；有 retry_after 時暫停所有請求到指定時間。"""
+        self.throttles += 1
+        if not self.unlimited:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = 0.0
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def stats(self) -> dict:
+        return {"rate": round(self.rate, 3), "throttles": self.throttles, "waited_seconds": round(self.waited_seconds, 3)}
+
+
+async def call_with_retry(controller: RateController, func, *, max_attempts: int = 5, base_delay: float = 1.0,
+                          max_delay: float = 60.0, max_wait: float = None, on_retry=None, label: str = ""):
+    """透過 controller 呼叫 await func()，可重試的錯誤以 full jitter 指數退避重試。
+
+    max_wait：上游要求等待的秒數超過此值時不再等待，直接拋出 (例如 FloodWait 長到會超過工作的執行時限)。
+    on_retry(kind, error, delay)：每次重試前呼叫，用於計數與記錄。
+    """
+    attempt = 0
+    while True:
+        await controller.acquire()
+        try:
+            result = await func()
+        except Exception as e:
+            kind, retry_after = classify_error(e)
+            attempt += 1
+            if kind == FATAL or attempt >= max_attempts:
+                raise
+            if kind == THROTTLED:
+                if retry_after and max_wait is not None and retry_after > max_wait:
+                    # 先檢查再暫停：不等待的呼叫者不能讓其他 worker 一起暫停到 max_wait 之後，只降速
+                    controller.on_throttle(None)
+                    raise
+                controller.on_throttle(retry_after)
+                # 暫停由 controller 負責 (所有 worker 一起等)，這裡只加上一點 jitter 錯開恢復的時間點
+                delay = random.uniform(0, 1) if retry_after else random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            else:
+                delay = max(retry_after or 0, random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+            if on_retry:
+                on_retry(kind, e, delay)
+            print(f"\n{label or controller.name} 失敗 ({type(e).__name__}: {e})，{delay:.1f} 秒後第 {attempt} 次重試。")
+            await asyncio.sleep(delay)
+            continue
+        controller.on_success()
+        return result
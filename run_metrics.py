@@ -0,0 +1,187 @@
+# run_metrics.py
+# 匯入流程的計時與計數：
+#   - checkpoint(stage)   依序執行的階段耗時 (load → connect → fetch_and_media → merge → ...)
+#   - timer(name)         可重疊、可重複的操作累計耗時與次數 (例如每次下載、每次上傳)
+#   - incr(name, n)       計數器 (下載/上傳位元組、快取命中、重試次數 ...)
+# 運行結束後輸出機器可讀的報告：
+#   run_metrics.jsonl     每次運行追加一行 JSON
+#   run_metrics.prom      最近一次運行的 OpenMetrics 文字格式 (可交給 node_exporter textfile 或直接上傳)
+# 另外可選擇以 cProfile 或 tracemalloc 分析單次運行 (見 Profiler)。
+
+import contextlib
+import datetime
+import json
+import os
+import re
+import time
+
+RUN_METRICS_FILE = "run_metrics.jsonl"
+OPENMETRICS_FILE = "run_metrics.prom"
+METRIC_PREFIX = "importer"
+PROFILE_MODES = ("cprofile", "tracemalloc")
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+    """單次匯入運行的計時器與計數器。"""
+
+    def __init__(self, run_id: str = None):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.run_id = run_id or now.strftime("%Y%m%dT%H%M%SZ")
+        self.started_at = now.isoformat()
+        self.stages = {} # 階段 → 秒 (依執行順序)
+        self.timers = {} # 操作 → {"count": n, "seconds": s}
+        self.counters = {} # 名稱 → 數值
+        self.info = {} # 其他描述性資訊 (例如 profile 檔案路徑)
+        self.ok = False
+        self._start = time.perf_counter()
+        self._last_checkpoint = self._start
+
+    # --- 記錄 ---
+    def checkpoint(self, stage: str) -> float:
+        """結束目前階段並記錄其耗時 (從上一個 checkpoint 起算)，返回秒數。"""
+        now = time.perf_counter()
+        seconds = now - self._last_checkpoint
+        self.stages[stage] = round(self.stages.get(stage, 0) + seconds, 4)
+        self._last_checkpoint = now
+        return seconds
+
+    def stage_elapsed(self) -> float:
+        """目前階段已經過的秒數。"""
+        return time.perf_counter() - self._last_checkpoint
+
+    def add_time(self, name: str, seconds: float, count: int = 1) -> None:
+        timer = self.timers.setdefault(name, {"count": 0, "seconds": 0.0})
+        timer["count"] += count
+        timer["seconds"] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        """累計區塊的耗時；可以包住 await (例如 with metrics.timer("download"): await ...)。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def incr(self, name: str, value=1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    # --- 報告 ---
+    @property
+    def duration_seconds(self) -> float:
+        return time.perf_counter() - self._start
+
+    def report(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "ok": self.ok,
+            "duration_seconds": round(self.duration_seconds, 4),
+            "stages": dict(self.stages),
+            "timers": {name: {"count": t["count"], "seconds": round(t["seconds"], 4)} for name, t in self.timers.items()},
+            "counters": dict(self.counters),
+            "info": dict(self.info),
+        }
+
+    def to_openmetrics(self) -> str:
+        """OpenMetrics 文字格式 (計數器以 _total 結尾，最後一行為 # EOF)。"""
+        p = METRIC_PREFIX
+        run = f'run_id="{_label_value(self.run_id)}"'
+        lines = [
+            f"# TYPE {p}_run_duration_seconds gauge",
+            f"# UNIT {p}_run_duration_seconds seconds",
+            f"{p}_run_duration_seconds{{{run}}} {self.duration_seconds:.4f}",
+            f"# TYPE {p}_run_success gauge",
+            f"{p}_run_success{{{run}}} {1 if self.ok else 0}",
+            f"# TYPE {p}_stage_duration_seconds gauge",
+            f"# UNIT {p}_stage_duration_seconds seconds",
+        ]
+        for stage, seconds in self.stages.items():
+            lines.append(f'{p}_stage_duration_seconds{{{run},stage="{_label_value(stage)}"}} {seconds:.4f}')
+        lines += [
+            f"# TYPE {p}_operation_seconds counter",
+            f"# UNIT {p}_operation_seconds seconds",
+        ]
+        for name, t in self.timers.items():
+            lines.append(f'{p}_operation_seconds_total{{{run},operation="{_label_value(name)}"}} {t["seconds"]:.4f}')
+        lines.append(f"# TYPE {p}_operations counter")
+        for name, t in self.timers.items():
+            lines.append(f'{p}_operations_total{{{run},operation="{_label_value(name)}"}} {t["count"]}')
+        for name, value in self.counters.items():
+            metric = f"{p}_{_metric_name(name)}"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}_total{{{run}}} {value}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, jsonl_path: str = RUN_METRICS_FILE, openmetrics_path: str = OPENMETRICS_FILE) -> None:
+        """追加 JSON 報告並覆寫 OpenMetrics 檔案。任一路徑為空字串時略過該輸出。"""
+        if jsonl_path:
+            with open(jsonl_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.report(), ensure_ascii=False) + "\n")
+        if openmetrics_path:
+            tmp_path = f"{openmetrics_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.to_openmetrics())
+            os.replace(tmp_path, openmetrics_path)
+
+
+class Profiler:
+    """可選的單次運行分析。mode 為 "cprofile"、"tracemalloc"，或空值表示不啟用。
+
+    cprofile：結果存成 <output_dir>/profile_<run_id>.prof (可用 snakeviz 或 pstats 檢視)。
+    tracemalloc：把峰值記憶體與配置最多的前幾行程式碼寫入報告的 info["tracemalloc"]。
+    """
+
+    def __init__(self, mode: str, metrics: RunMetrics, output_dir: str = ".", top: int = 15):
+        self.mode = (mode or "").strip().lower()
+        if self.mode and self.mode not in PROFILE_MODES:
+            print(f"警告：不支援的 profile 模式 '{mode}' (可用：{', '.join(PROFILE_MODES)})，將不啟用。")
+            self.mode = ""
+        self.metrics = metrics
+        self.output_dir = output_dir
+        self.top = top
+        self._profile = None
+
+    def start(self):
+        if self.mode == "cprofile":
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif self.mode == "tracemalloc":
+            import tracemalloc
+            tracemalloc.start()
+        return self
+
+    def stop(self) -> None:
+        if self.mode == "cprofile" and self._profile is not None:
+            import pstats
+            self._profile.disable()
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"profile_{self.metrics.run_id}.prof")
+            self._profile.dump_stats(path)
+            self.metrics.info["cprofile"] = path
+            print(f"cProfile 結果已儲存到 {path}，累計耗時最多的函式：")
+            pstats.Stats(self._profile).sort_stats("cumulative").print_stats(self.top)
+            self._profile = None
+        elif self.mode == "tracemalloc":
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                return
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            top = snapshot.statistics("lineno")[:self.top]
+            self.metrics.info["tracemalloc"] = {
+                "peak_bytes": peak,
+                "top": [{"where": str(stat.traceback[0]), "bytes": stat.size, "count": stat.count} for stat in top],
+            }
+            print(f"tracemalloc：峰值 {peak / 1024 / 1024:.1f} MB。")
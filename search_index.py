@@ -0,0 +1,283 @@
+# search_index.py
+# 匯入時預先建立的全文搜尋索引 (search-index.json)，供前端搜尋框與 Python 端共用。
+#
+# 繁體中文沒有空白分詞，因此以「字元二元組 (bigram)」作為索引詞：
+#   "聖賢語錄" → 聖賢、賢語、語錄
+# 查詢關鍵字的所有 bigram 都出現在某篇貼文中，是該關鍵字為其子字串的必要條件；
+# 先以倒排索引取交集縮小候選集合，再用子字串比對確認，結果與逐篇線性掃描完全一致。
+#
+# 檔案格式 (version 1)：
+#   {
+#     "version": 1,
+#     "docs":  [[post_key, "YYYY-MM-DD", signature] 或 null, ...], # 索引序號 → 貼文，null 表示已刪除
+#     "terms": {"聖賢": [0, 1, 3, ...], ...},                       # bigram → 索引序號 (差分編碼)
+#     "dates": {"2025-08-13": [0], ...}                              # 日期 facet (差分編碼)
+#   }
+# 差分編碼：列表中第一個數字是 (序號 + 1)，之後每個數字是與前一個序號的差值，JSON 體積較小。
+# post_key 見 post_store.post_key：主頻道的貼文為訊息 ID，其他頻道為 "<channel>:<訊息 ID>"。
+
+import json
+import os
+import zlib
+
+from post_store import post_key
+
+SEARCH_INDEX_FILE = "search-index.json"
+INDEX_FORMAT_VERSION = 1
+
+# 已刪除或已被新版本取代的文件比例超過此值時，重新編號壓縮索引以回收空間
+COMPACT_RATIO = 0.2
+
+
+def normalize(text: str) -> str:
+    """與前端相同的正規化：只做小寫轉換 (對應 JavaScript 的 toLowerCase)。"""
+    return (text or "").lower()
+
+
+def split_keywords(q: str):
+    """與前端相同的關鍵字切分：以空白分隔，多個關鍵字之間為 AND。"""
+    return [kw for kw in normalize(q).strip().split() if kw]
+
+
+def bigrams(text: str) -> set:
+    """文字中 (不跨越空白) 的所有字元二元組。"""
+    grams = set()
+    for segment in normalize(text).split():
+        for i in range(len(segment) - 1):
+            grams.add(segment[i:i + 2])
+    return grams
+
+
+def _message_id(key) -> int:
+    """post_key 中的訊息 ID (排序用)。"""
+    return key if isinstance(key, int) else int(str(key).rsplit(":", 1)[-1])
+
+
+def doc_signature(post) -> int:
+    """貼文內容的指紋，用於增量更新時判斷貼文是否被編輯過。"""
+    return zlib.crc32(f"{post.get('date') or ''}\n{post.get('text') or ''}".encode("utf-8"))
+
+
+# --- 差分編碼 ---
+def _encode(ordinals):
+    out, prev = [], -1
+    for ordinal in ordinals:
+        out.append(ordinal - prev)
+        prev = ordinal
+    return out
+
+
+def _decode(deltas):
+    out, prev = [], -1
+    for delta in deltas:
+        prev += delta
+        out.append(prev)
+    return out
+
+
+class SearchIndex:
+    """記憶體中的倒排索引。磁碟上的格式見模組說明。"""
+
+    def __init__(self):
+        self.docs = [] # 序號 → (post_key, date, signature) 或 None
+        self.terms = {} # bigram → 遞增的序號列表
+        self.dates = {} # 日期 → 遞增的序號列表
+        self._ordinal_by_id = {}
+
+    # --- 建立與增量更新 ---
+    @classmethod
+    def build(cls, posts):
+        index = cls()
+        for post in posts:
+            index._add(post)
+        return index
+
+    def _add(self, post):
+        ordinal = len(self.docs)
+        key = post_key(post)
+        self.docs.append((key, post.get("date") or "", doc_signature(post)))
+        self._ordinal_by_id[key] = ordinal
+        for gram in bigrams(post.get("text")):
+            self.terms.setdefault(gram, []).append(ordinal)
+        if post.get("date"):
+            self.dates.setdefault(post["date"], []).append(ordinal)
+
+    def update(self, posts) -> dict:
+        """以目前完整的貼文集合增量更新索引：只對新增或內容有變的貼文做分詞。
+
+        posts 可以是串流 (例如 PostStore.iter_posts())，只會走訪一次，且只保留有變化的貼文。
+        返回統計資訊 {"added": n, "updated": n, "removed": n, "rebuilt": bool}。
+        """
+        current_ids = set()
+        changed = []
+        for post in posts:
+            if post.get("id") is None:
+                continue
+            key = post_key(post)
+            current_ids.add(key)
+            ordinal = self._ordinal_by_id.get(key)
+            if ordinal is None or self.docs[ordinal][2] != doc_signature(post):
+                changed.append(post)
+
+        removed_ordinals = set()
+        stats = {"added": 0, "updated": 0, "removed": 0, "rebuilt": False}
+
+        for post_id, ordinal in list(self._ordinal_by_id.items()):
+            if post_id not in current_ids:
+                removed_ordinals.add(ordinal)
+                del self._ordinal_by_id[post_id]
+                stats["removed"] += 1
+
+        # 新貼文依由舊到新的順序加入，讓新序號與時間順序一致
+        for post in sorted(changed, key=lambda p: (p.get("date") or "", p["id"])):
+            ordinal = self._ordinal_by_id.get(post_key(post))
+            if ordinal is None:
+                stats["added"] += 1
+            else:
+                removed_ordinals.add(ordinal)
+                stats["updated"] += 1
+            self._add(post)
+
+        if removed_ordinals:
+            for ordinal in removed_ordinals:
+                self.docs[ordinal] = None
+            dead = sum(1 for doc in self.docs if doc is None)
+            if dead > len(self.docs) * COMPACT_RATIO:
+                self._compact()
+                stats["rebuilt"] = True
+            else:
+                for table in (self.terms, self.dates):
+                    for key in list(table):
+                        kept = [o for o in table[key] if o not in removed_ordinals]
+                        if kept:
+                            table[key] = kept
+                        else:
+                            del table[key]
+        return stats
+
+    def _compact(self):
+        """移除已刪除的文件並重新編號 (不需要重新分詞)。"""
+        remap = {}
+        docs = []
+        for ordinal, doc in enumerate(self.docs):
+            if doc is not None:
+                remap[ordinal] = len(docs)
+                docs.append(doc)
+        self.docs = docs
+        self._ordinal_by_id = {doc[0]: ordinal for ordinal, doc in enumerate(docs)}
+        for table in (self.terms, self.dates):
+            for key in list(table):
+                kept = [remap[o] for o in table[key] if o in remap]
+                if kept:
+                    table[key] = kept
+                else:
+                    del table[key]
+
+    # --- 查詢 ---
+    def query(self, q: str, date: str = None, posts_by_id=None, rank: bool = False):
+        """返回符合條件的貼文 post_key 列表。
+
+        預設依「日期降序、ID 降序」排列 (與頁面顯示順序相同)。
+        posts_by_id (以 post_key 為鍵) 提供完整貼文時會以子字串比對確認候選結果，並可用 rank=True 依關鍵字出現次數排序；
+        未提供時只以 bigram 交集過濾 (單一字元的關鍵字無法以 bigram 過濾)。
+        """
+        keywords = split_keywords(q)
+        candidates = None
+
+        if date:
+            candidates = set(self.dates.get(date, []))
+        for keyword in keywords:
+            grams = {keyword[i:i + 2] for i in range(len(keyword) - 1)}
+            # 從最短的 postings 開始取交集
+            for gram in sorted(grams, key=lambda g: len(self.terms.get(g, []))):
+                postings = self.terms.get(gram)
+                if not postings:
+                    return []
+                candidates = set(postings) if candidates is None else candidates.intersection(postings)
+                if not candidates:
+                    return []
+        if candidates is None:
+            candidates = range(len(self.docs))
+
+        results = []
+        for ordinal in candidates:
+            doc = self.docs[ordinal]
+            if doc is None:
+                continue
+            score = 0
+            if posts_by_id is not None:
+                post = posts_by_id.get(doc[0])
+                if post is None:
+                    continue
+                text = normalize(post.get("text"))
+                if not all(keyword in text for keyword in keywords):
+                    continue
+                if rank:
+                    score = sum(text.count(keyword) for keyword in keywords)
+            results.append((score, doc[1], _message_id(doc[0]), doc[0]))
+
+        results.sort(key=lambda result: result[:3], reverse=True)
+        return [key for _, _, _, key in results]
+
+    # --- 序列化 ---
+    def to_json(self) -> dict:
+        return {
+            "version": INDEX_FORMAT_VERSION,
+            "docs": [list(doc) if doc else None for doc in self.docs],
+            "terms": {gram: _encode(ordinals) for gram, ordinals in self.terms.items()},
+            "dates": {date: _encode(ordinals) for date, ordinals in self.dates.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data: dict):
+        if data.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"不支援的搜尋索引版本：{data.get('version')}")
+        index = cls()
+        index.docs = [tuple(doc) if doc else None for doc in data["docs"]]
+        index.terms = {gram: _decode(deltas) for gram, deltas in data["terms"].items()}
+        index.dates = {date: _decode(deltas) for date, deltas in data["dates"].items()}
+        index._ordinal_by_id = {doc[0]: ordinal for ordinal, doc in enumerate(index.docs) if doc}
+        return index
+
+
+def load_index(path: str = SEARCH_INDEX_FILE):
+    """讀取索引檔，不存在或格式不符時返回 None (呼叫端應改為完整建立)。"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return SearchIndex.from_json(json.load(f))
+    except (json.JSONDecodeError, ValueError, KeyError, TypeError) as e:
+        print(f"警告：{path} 無法使用 ({e})，將重新建立搜尋索引。")
+        return None
+
+
+def save_index(index: SearchIndex, path: str = SEARCH_INDEX_FILE) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index.to_json(), f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def update_index_file(posts, path: str = SEARCH_INDEX_FILE) -> dict:
+    """匯出流程使用：讀取既有索引並增量更新；沒有既有索引時完整建立。"""
+    index = load_index(path)
+    if index is None:
+        index = SearchIndex()
+        stats = index.update(posts)
+        stats["rebuilt"] = True
+    else:
+        stats = index.update(posts)
+    save_index(index, path)
+    return stats
+
+
+def linear_scan(posts, q: str, date: str = None):
+    """頁面原本的搜尋方式 (filterAndRender) 的 Python 版本，作為正確性與效能的比較基準。"""
+    keywords = split_keywords(q)
+    results = []
+    for post in posts:
+        text = normalize(post.get("text"))
+        if all(keyword in text for keyword in keywords) and (not date or post.get("date") == date):
+            results.append(post_key(post))
+    return results
@@ -1,32 +1,41 @@
 import json
+import os
 
-file_path = 'posts.json'
+import config
+import post_store
 
-try:
-    with open(file_path, 'r', encoding='utf-8') as f:
-        posts = json.load(f)
-except FileNotFoundError:
-    print(f"錯誤：找不到檔案 {file_path}")
-    exit()
-except json.JSONDecodeError:
-    print(f"錯誤：無法解析檔案 {file_path} 的 JSON 內容")
-    exit()
-except Exception as e:
-    print(f"讀取檔案時發生錯誤：{e}")
-    exit()
 
-if isinstance(posts, list):
+def main(cfg=None):
+    """以貼文資料庫為準重新輸出 posts.json，格式與排序與 everypy.py 完全相同
+    (indent=2，日期降序、ID 降序)；資料庫不存在時先從 posts.json 匯入。失敗時返回 1。
+    """
+    config.load_env()
+    cfg = cfg or config.ImporterConfig()
+    file_path = cfg.output_json_file
+    # 兩者都不存在時不開啟資料庫，避免留下一個空的 posts.db
+    if not os.path.exists(cfg.post_store_file) and not os.path.exists(file_path):
+        print(f"錯誤：找不到檔案 {file_path}")
+        return 1
     try:
-        posts.sort(key=lambda x: x.get('id', 0), reverse=True)
+        with post_store.PostStore(cfg.post_store_file) as store:
+            if store.count() == 0:
+                if not os.path.exists(file_path):
+                    print(f"錯誤：找不到檔案 {file_path}")
+                    return 1
+                store.import_json(file_path)
+            count = store.export_json(file_path, indent=2)
+        print(f"檔案 {file_path} 已成功排序並更新 (共 {count} 筆)。")
+    except json.JSONDecodeError:
+        print(f"錯誤：無法解析檔案 {file_path} 的 JSON 內容")
+        return 1
+    except ValueError:
+        print(f"檔案 {file_path} 的內容不是一個 JSON 陣列。")
+        return 1
     except Exception as e:
-        print(f"排序時發生錯誤：{e}")
-        exit()
+        print(f"處理檔案時發生錯誤：{e}")
+        return 1
+    return 0
 
-    try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(posts, f, indent=4, ensure_ascii=False)
-        print(f"檔案 {file_path} 已成功排序並更新。")
-    except Exception as e:
-        print(f"寫入檔案時發生錯誤：{e}")
-else:
-    print(f"檔案 {file_path} 的內容不是一個 JSON 陣列。")
\ No newline at end of file
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,160 @@
+# state_sync.py
+# 把匯入程式的狀態檔保存在 Cloud Storage，讓每次運行都從上一次的進度繼續：
+# Cloud Run Job 每次都在全新的容器中執行，寫在本地磁碟的貼文資料庫、watermark、圖片索引等不會留到下一次，
+# 沒有它們時每次運行都會從訊息 ID 0 重新抓取整個頻道、重新上傳所有圖片並完整重建搜尋索引。
+#   - 運行開始時 (開啟資料庫之前) 下載 bucket 中的狀態檔；本地檔案的 MD5 與遠端相同時不下載
+#   - 每次 checkpoint (最多每 STATE_SYNC_INTERVAL_SECONDS 秒一次) 與運行結束時上傳有變化的狀態檔，
+#     工作被執行時限終止時，下一次運行從最後上傳的 watermark 繼續
+#   - 依序上傳資料庫、圖片索引，最後才是 watermark：遠端的 watermark 不會超前於遠端的資料庫
+#   - 每次上傳都帶 ifGenerationMatch 前置條件 (下載時看到的版本，物件不存在時為 0)，
+#     兩個重疊的運行不會互相覆寫；條件不符時本次運行不再上傳任何狀態
+#   - SQLite 資料庫以 backup API 取得一致的快照後才上傳
+# 沒有使用 Cloud Storage 的 volume 掛載：SQLite 需要檔案鎖定與隨機寫入，在 gcsfuse 上並不可靠。
+# google-cloud-storage 只在實際同步時才載入 (透過 gcs_sync.make_client)。
+
+import os
+import posixpath
+import sqlite3
+import time
+
+import gcs_sync
+
+STATE_OBJECT_PREFIX = "importer-state"
+DEFAULT_SYNC_INTERVAL_SECONDS = 60.0
+_LIST_FIELDS = "items(name,md5Hash,generation),nextPageToken"
+
+
+def state_files(cfg) -> list:
+    """列出要保存的狀態檔 [(本地路徑, 遠端相對名稱)]，依上傳順序排列 (資料庫 → 索引 → watermark)。"""
+    files = []
+    for channel in cfg.channels:
+        remote_dir = "" if channel.primary else posixpath.join("channels", channel.slug)
+        files.append((channel.post_store_file, posixpath.join(remote_dir, "posts.db")))
+    files.append((cfg.image_index_file, "image_index.json"))
+    # 搜尋索引是增量更新的基準；沒有它時每次運行都會完整重建
+    files.append((cfg.search_index_file, "search-index.json"))
+    files.append((cfg.delta_state_file, "delta_state.json"))
+    files.append((cfg.firestore_sync_state_file, "firestore_sync_state.json"))
+    for channel in cfg.channels:
+        remote_dir = "" if channel.primary else posixpath.join("channels", channel.slug)
+        files.append((channel.import_state_file, posixpath.join(remote_dir, "import_state.json")))
+    return files
+
+
+def _snapshot(path: str) -> str:
+    """以 SQLite backup API 把資料庫複製成一致的快照檔 (即使另一個連線仍開著)，返回快照路徑。"""
+    snapshot_path = f"{path}.snapshot"
+    source = sqlite3.connect(path)
+    try:
+        target = sqlite3.connect(snapshot_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return snapshot_path
+
+
+class StateSync:
+    """一次運行中的狀態檔同步：restore() 在開始時呼叫一次，checkpoint() 在每次提交後呼叫，save() 在結束時呼叫。"""
+
+    def __init__(self, files, bucket_name: str, prefix: str = STATE_OBJECT_PREFIX, client=None,
+                 interval: float = DEFAULT_SYNC_INTERVAL_SECONDS):
+        self.files = [(path, posixpath.join(prefix.strip("/"), name) if prefix else name) for path, name in files]
+        self.bucket_name = bucket_name
+        self.interval = interval
+        self._client = client
+        self.generations = {} # 物件名稱 → 本次運行看到 (或寫入) 的 generation，0 表示不存在
+        self.synced_md5 = {} # 物件名稱 → 遠端目前內容的 MD5
+        self.conflict = False
+        self._last_save = time.monotonic()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = gcs_sync.make_client()
+        return self._client
+
+    def restore(self) -> dict:
+        """下載遠端的狀態檔 (覆蓋本地檔案)。返回 {"downloaded": [...], "unchanged": n, "missing": [...]}。"""
+        bucket = self.client.bucket(self.bucket_name)
+        remote = {}
+        for prefix in sorted({posixpath.dirname(name) for _, name in self.files}):
+            for blob in self.client.list_blobs(bucket, prefix=f"{prefix}/" if prefix else None, delimiter="/",
+                                               fields=_LIST_FIELDS):
+                remote[blob.name] = blob
+        stats = {"downloaded": [], "unchanged": 0, "missing": []}
+        for path, name in self.files:
+            blob = remote.get(name)
+            if blob is None:
+                self.generations[name] = 0
+                stats["missing"].append(name)
+                continue
+            self.generations[name] = blob.generation
+            self.synced_md5[name] = blob.md5_hash
+            if os.path.exists(path) and gcs_sync.file_md5(path) == blob.md5_hash:
+                stats["unchanged"] += 1
+                continue
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            blob.download_to_filename(tmp_path, if_generation_match=blob.generation)
+            os.replace(tmp_path, path)
+            stats["downloaded"].append(name)
+        self._last_save = time.monotonic()
+        return stats
+
+    def save(self, skip=()) -> dict:
+        """上傳內容有變化的狀態檔。返回 {"uploaded": [...], "bytes": n, "conflict": bool, "skipped": [...]}。
+
+        skip 為這次不上傳的本地路徑 (遠端保留上一次的版本)。
+        任一物件已被其他運行修改時停止上傳 (之後的呼叫也不再上傳)，遠端維持另一個運行的狀態。
+        """
+        from google.api_core.exceptions import PreconditionFailed
+
+        stats = {"uploaded": [], "bytes": 0, "conflict": self.conflict, "skipped": []}
+        if self.conflict:
+            return stats
+        bucket = self.client.bucket(self.bucket_name)
+        for path, name in self.files:
+            if not os.path.exists(path):
+                continue
+            if path in skip:
+                stats["skipped"].append(name)
+                continue
+            upload_path = _snapshot(path) if name.endswith(".db") else path
+            try:
+                md5 = gcs_sync.file_md5(upload_path)
+                if md5 == self.synced_md5.get(name):
+                    continue
+                size = os.path.getsize(upload_path)
+                blob = bucket.blob(name, chunk_size=gcs_sync.UPLOAD_CHUNK_SIZE if size > gcs_sync.UPLOAD_CHUNK_SIZE else None)
+                blob.cache_control = "no-store"
+                try:
+                    blob.upload_from_filename(upload_path, content_type="application/octet-stream",
+                                              if_generation_match=self.generations.get(name, 0))
+                except PreconditionFailed:
+                    print(f"警告：gs://{self.bucket_name}/{name} 已被另一個運行更新，本次運行不再上傳狀態檔。")
+                    self.conflict = stats["conflict"] = True
+                    break
+                self.generations[name] = blob.generation
+                self.synced_md5[name] = md5
+                stats["uploaded"].append(name)
+                stats["bytes"] += size
+            finally:
+                if upload_path != path and os.path.exists(upload_path):
+                    os.remove(upload_path)
+        self._last_save = time.monotonic()
+        return stats
+
+    def checkpoint(self):
+        """距離上一次上傳超過 interval 秒時上傳狀態檔；失敗只印出警告 (結束時的 save() 會再試一次)。"""
+        if self.conflict or time.monotonic() - self._last_save < self.interval:
+            return None
+        try:
+            return self.save()
+        except Exception as e:
+            print(f"\n警告：上傳狀態檔到 gs://{self.bucket_name}/ 失敗: {e}")
+            self._last_save = time.monotonic()
+            return None
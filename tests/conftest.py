@@ -0,0 +1,5 @@
+# 讓測試可以直接 import 專案根目錄下的模組 (本專案是一組平面的腳本，沒有套件結構)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,147 @@
+# 記憶體中的 Cloud Storage 替身：只實作 gcs_sync.py 與 state_sync.py 用到的 google-cloud-storage API，
+# 並且與真正的 GCS 一樣檢查 ifGenerationMatch / ifMetagenerationMatch 前置條件。
+
+import base64
+import hashlib
+import threading
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+
+def md5_base64(data: bytes) -> str:
+    return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+class FakeBlob:
+    def __init__(self, bucket, name, chunk_size=None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+        self.cache_control = None
+        self.content_type = None
+        self.content_encoding = None
+        self.generation = None
+        self.metageneration = None
+        self.md5_hash = None
+        self.time_created = None
+
+    def _stored(self):
+        return self.bucket.objects.get(self.name)
+
+    def upload_from_filename(self, path, content_type=None, if_generation_match=None):
+        with open(path, "rb") as f:
+            data = f.read()
+        self.bucket.put(self, data, content_type, if_generation_match)
+
+    def download_to_filename(self, path, if_generation_match=None):
+        data = self.bucket.read(self.name, if_generation_match)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def download_as_bytes(self):
+        return self.bucket.read(self.name)
+
+    def patch(self, if_metageneration_match=None):
+        self.bucket.patch(self, if_metageneration_match)
+
+    def delete(self, if_generation_match=None):
+        self.bucket.delete(self.name, if_generation_match)
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.objects = {} # 物件名稱 → {"data", "generation", "metageneration", "cache_control", ...}
+        self.lock = threading.Lock()
+        self.log = [] # 依序記錄的寫入操作 ("upload" / "patch" / "delete", 物件名稱)
+        self.fail = set() # 上傳時拋出錯誤的物件名稱
+        self._generation = 0
+
+    def blob(self, name, chunk_size=None):
+        return FakeBlob(self, name, chunk_size)
+
+    def put(self, blob, data, content_type, if_generation_match):
+        if blob.name in self.fail:
+            raise OSError(f"無法上傳 {blob.name}")
+        with self.lock:
+            current = self.objects.get(blob.name)
+            if if_generation_match is not None and if_generation_match != (current["generation"] if current else 0):
+                raise PreconditionFailed(f"{blob.name} generation 不符")
+            self._generation += 1
+            self.objects[blob.name] = {
+                "data": data, "generation": self._generation, "metageneration": 1,
+                "cache_control": blob.cache_control, "content_type": content_type,
+                "content_encoding": blob.content_encoding, "time_created": self.client.now,
+            }
+            self.log.append(("upload", blob.name))
+            blob.generation = self._generation
+
+    def read(self, name, if_generation_match=None):
+        with self.lock:
+            current = self.objects.get(name)
+            if current is None:
+                raise NotFound(name)
+            if if_generation_match is not None and if_generation_match != current["generation"]:
+                raise PreconditionFailed(f"{name} generation 不符")
+            return current["data"]
+
+    def patch(self, blob, if_metageneration_match):
+        with self.lock:
+            current = self.objects[blob.name]
+            if if_metageneration_match is not None and if_metageneration_match != current["metageneration"]:
+                raise PreconditionFailed(f"{blob.name} metageneration 不符")
+            current.update(cache_control=blob.cache_control, content_type=blob.content_type,
+                           content_encoding=blob.content_encoding)
+            current["metageneration"] += 1
+            self.log.append(("patch", blob.name))
+
+    def delete(self, name, if_generation_match=None):
+        with self.lock:
+            current = self.objects.get(name)
+            if current is None:
+                raise NotFound(name)
+            if if_generation_match is not None and if_generation_match != current["generation"]:
+                raise PreconditionFailed(f"{name} generation 不符")
+            del self.objects[name]
+            self.log.append(("delete", name))
+
+    def listed_blob(self, name):
+        stored = self.objects[name]
+        blob = FakeBlob(self, name)
+        blob.md5_hash = md5_base64(stored["data"])
+        blob.generation = stored["generation"]
+        blob.metageneration = stored["metageneration"]
+        blob.cache_control = stored["cache_control"]
+        blob.content_type = stored["content_type"]
+        blob.content_encoding = stored["content_encoding"]
+        blob.time_created = stored["time_created"]
+        return blob
+
+    def uploaded(self):
+        return [name for action, name in self.log if action == "upload"]
+
+
+class FakeStorageClient:
+    """client.bucket(name) 每次返回同一個 FakeBucket；now 為新物件的建立時間 (datetime 或 None)。"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.now = None
+
+    def bucket(self, name):
+        if name not in self.buckets:
+            self.buckets[name] = FakeBucket(self, name)
+        return self.buckets[name]
+
+    def list_blobs(self, bucket, prefix=None, delimiter=None, fields=None):
+        bucket = self.bucket(bucket if isinstance(bucket, str) else bucket.name)
+        with bucket.lock:
+            names = sorted(bucket.objects)
+        for name in names:
+            if prefix and not name.startswith(prefix):
+                continue
+            rest = name[len(prefix or ""):]
+            if delimiter and delimiter in rest:
+                continue
+            yield bucket.listed_blob(name)
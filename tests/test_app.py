@@ -0,0 +1,116 @@
+# 觸發服務 (app.py)：import 沒有副作用、同時的觸發併入同一次運行、失敗後丟棄 Telegram 連線
+
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("flask")
+
+import app as service
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeClient:
+    def __init__(self):
+        self.disconnected = False
+
+    def is_connected(self):
+        return not self.disconnected
+
+    async def disconnect(self):
+        self.disconnected = True
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    runner = service.ImportRunner()
+    clients = []
+
+    async def ensure_client(cfg):
+        if runner._client is None:
+            runner._client = FakeClient()
+            clients.append(runner._client)
+        return runner._client
+    monkeypatch.setattr(runner, "_ensure_client", ensure_client)
+    runner.clients = clients
+    yield runner
+    runner.loop.call_soon_threadsafe(runner.loop.stop)
+
+
+def wait_for(runner, run_id):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        status = runner.status()
+        if not status["running"] and status["last_run"] and status["last_run"]["run_id"] == run_id:
+            return status["last_run"]
+        time.sleep(0.01)
+    raise AssertionError("運行沒有在 5 秒內結束")
+
+
+def test_import_has_no_side_effects():
+    # 在全新的直譯器中 import：背景事件迴圈與執行緒在第一次收到請求時才建立
+    probe = ("import threading, app; "
+             "print(app._runner is None, [t.name for t in threading.enumerate() if t.name == 'import-loop'])")
+    proc = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, cwd=ROOT)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip() == "True []"
+
+
+def test_concurrent_triggers_start_one_run(runner, monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    async def fake_main(client, cfg=None, entities=None):
+        calls.append(client)
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        return {"ok": True, "stages": {}, "counters": {}}
+    monkeypatch.setattr(service.everypy, "main", fake_main)
+
+    barrier = threading.Barrier(2)
+
+    def trigger():
+        barrier.wait()
+        return runner.trigger()
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = list(pool.map(lambda _: trigger(), range(2)))
+    assert sorted(started for _, started in results) == [False, True]
+    assert {run_id for run_id, _ in results} == {1}
+    assert runner.status()["current"]["merged_triggers"] == 1
+
+    release.set()
+    last_run = wait_for(runner, 1)
+    assert last_run["ok"] and last_run["merged_triggers"] == 1
+    assert runner.runs_started == 1 and len(calls) == 1
+
+    # 運行結束後的觸發開始新的運行，沿用同一個連線
+    run_id, started = runner.trigger()
+    assert (run_id, started) == (2, True)
+    assert wait_for(runner, 2)["ok"]
+    assert len(runner.clients) == 1
+
+
+def test_failed_run_drops_the_telegram_client(runner, monkeypatch):
+    async def failing_main(client, cfg=None, entities=None):
+        entities["channel"] = object()
+        raise ConnectionError("連線中斷")
+    monkeypatch.setattr(service.everypy, "main", failing_main)
+
+    runner.trigger()
+    last_run = wait_for(runner, 1)
+    assert not last_run["ok"] and "ConnectionError" in last_run["error"]
+    assert runner.clients[0].disconnected
+    assert runner._client is None and runner.status()["channels_resolved"] == []
+
+    # 下一次觸發建立新的客戶端
+    runner.trigger()
+    wait_for(runner, 2)
+    assert len(runner.clients) == 2
@@ -0,0 +1,222 @@
+# 分區回補：每個分區只處理自己的訊息 ID 範圍並輸出部分分片與完成標記，
+# 合併後的資料庫與 watermark 必須與單一分區 (一次處理整個範圍) 的結果相同
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import backfill
+import config
+import everypy
+import import_state
+import post_store
+from bench_import import FakeTelegramClient, ImgbbStandIn
+from publish_artifacts import file_digest
+
+TOTAL = 48
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("first_id, last_id, count", [
+    (1, 100, 4), (1, 10, 3), (7, 23, 5), (1, 3, 5), (1, 1, 2), (5, 4, 3), (10, 10, 1),
+])
+def test_partitions_cover_the_range_exactly_once(first_id, last_id, count):
+    ranges = [backfill.partition_range(first_id, last_id, count, index) for index in range(count)]
+    ids = [msg_id for lo, hi in ranges for msg_id in range(lo, hi + 1)]
+    assert ids == list(range(first_id, last_id + 1))
+    # 連續且大小最多相差 1
+    assert all(ranges[i + 1][0] == ranges[i][1] + 1 for i in range(count - 1))
+    sizes = [hi - lo + 1 for lo, hi in ranges]
+    assert max(sizes) - min(sizes) <= 1
+
+
+def test_partition_range_examples():
+    assert [backfill.partition_range(1, 10, 3, i) for i in range(3)] == [(1, 3), (4, 6), (7, 10)]
+    # 分區數多於訊息數：部分分區沒有訊息 (終點小於起點)
+    assert [backfill.partition_range(1, 3, 5, i) for i in range(5)] == [(1, 0), (1, 1), (2, 1), (2, 2), (3, 3)]
+    # 空的範圍
+    assert [backfill.partition_range(5, 4, 2, i) for i in range(2)] == [(5, 4), (5, 4)]
+
+
+def settings(root, upload_url):
+    """root 之下的一組設定 (與 --fake-messages 相同：不同步到 bucket 或 Firestore)。"""
+    os.makedirs(root, exist_ok=True)
+    names = {"POST_STORE_FILE": "posts.db", "IMPORT_STATE_FILE": "import_state.json",
+             "IMAGE_INDEX_FILE": "image_index.json", "SEARCH_INDEX_FILE": "search-index.json",
+             "DELTA_STATE_FILE": "delta_state.json", "FIRESTORE_SYNC_STATE_FILE": "firestore_sync_state.json",
+             "CHANNELS_DIR": "channels", "VERSION_JSON_FILE": "version.json", "DELTA_DIR": "deltas",
+             "LATEST_JSON_FILE": "latest.json", "SHARDS_DIR": "posts", "PUBLISH_DIR": "publish",
+             "BACKFILL_DIR": "backfill", "BACKFILL_WORK_DIR": "backfill_work",
+             "RUN_METRICS_FILE": "run_metrics.jsonl", "RUN_METRICS_OPENMETRICS_FILE": "metrics.prom"}
+    env = {key: os.path.join(root, name) for key, name in names.items()}
+    env.update(CHANNEL_USERNAME=FakeTelegramClient.primary_channel, IMGBB_API_KEY="key", IMGBB_UPLOAD_URL=upload_url,
+               TELEGRAM_REQUESTS_PER_SECOND="0", IMGBB_REQUESTS_PER_SECOND="0", STATE_BUCKET_NAME="",
+               STORAGE_BUCKET_NAME="", FIRESTORE_SYNC="0", IMAGE_DERIVATIVES="0")
+    cfg = config.ImporterConfig(env)
+    cfg.output_json_file = os.path.join(root, "posts.json")
+    return cfg
+
+
+def backfill_range(cfg, client, count, first_id=1, last_id=TOTAL, order=None):
+    """依 order 的順序執行每個分區，再合併。返回合併的結束碼。"""
+    for index in order or range(count):
+        assert asyncio.run(backfill.run_partition(client, cfg, index, count, first_id, last_id))
+    return backfill.merge_partitions(cfg, count)
+
+
+def stored_posts(cfg):
+    """資料庫中的貼文；圖片 URL 取決於替身的上傳順序，只比較有沒有圖片。"""
+    with post_store.PostStore(cfg.post_store_file) as store:
+        return [dict(post, image=bool(post.get("image"))) for post in store.iter_posts(by_id=True)]
+
+
+@pytest.fixture
+def stand_in():
+    with ImgbbStandIn() as server:
+        yield server
+
+
+@pytest.fixture
+def client():
+    return FakeTelegramClient(TOTAL, photo_ratio=0.5, image_bytes=2000)
+
+
+def test_merged_partitions_match_a_single_partition_run(tmp_path, monkeypatch, stand_in, client):
+    monkeypatch.chdir(tmp_path)
+    single = settings(str(tmp_path / "single"), stand_in.url)
+    assert backfill_range(single, client, 1) == 0
+    # 分區完成的順序不影響結果
+    parted = settings(str(tmp_path / "parted"), stand_in.url)
+    assert backfill_range(parted, client, 3, order=[2, 0, 1]) == 0
+
+    expected = stored_posts(single)
+    assert [post["id"] for post in expected] == list(range(1, TOTAL + 1))
+    assert any(post["image"] for post in expected)
+    assert stored_posts(parted) == expected
+    for cfg in (single, parted):
+        state = import_state.load_state(cfg.import_state_file)
+        assert state["last_message_id"] == TOTAL
+        assert import_state.pending_image_ids(state) == []
+    with open(single.output_json_file, encoding="utf-8") as f:
+        single_ids = [post["id"] for post in json.load(f)]
+    with open(parted.output_json_file, encoding="utf-8") as f:
+        assert [post["id"] for post in json.load(f)] == single_ids
+
+
+def test_completed_partition_is_skipped(tmp_path, monkeypatch, stand_in, client):
+    monkeypatch.chdir(tmp_path)
+    cfg = settings(str(tmp_path / "run"), stand_in.url)
+    assert asyncio.run(backfill.run_partition(client, cfg, 0, 2, 1, TOTAL))
+    uploads = stand_in.uploads
+
+    async def must_not_run(*args, **kwargs):
+        raise AssertionError("已完成的分區不應重新處理")
+    monkeypatch.setattr(everypy, "main", must_not_run)
+    assert asyncio.run(backfill.run_partition(client, cfg, 0, 2, 1, TOTAL))
+    assert stand_in.uploads == uploads
+    # 範圍不同的完成標記不算完成
+    with pytest.raises(AssertionError, match="不應重新處理"):
+        asyncio.run(backfill.run_partition(client, cfg, 0, 2, 1, TOTAL + 10))
+
+
+def write_partition(cfg, index, count, posts, first_id, last_id, pending=()):
+    """直接寫出一個分區的部分分片與完成標記 (與 run_partition 的輸出格式相同)。"""
+    output_dir = os.path.join(cfg.backfill_dir, FakeTelegramClient.primary_channel)
+    os.makedirs(output_dir, exist_ok=True)
+    base = os.path.join(output_dir, backfill.partition_name(index, count))
+    with open(f"{base}.jsonl", "w", encoding="utf-8") as f:
+        for post in posts:
+            f.write(json.dumps(post, ensure_ascii=False) + "\n")
+    with open(f"{base}.json", "w", encoding="utf-8") as f:
+        json.dump({"version": backfill.PARTIAL_FORMAT_VERSION, "index": index, "count": count,
+                   "first_id": first_id, "last_id": last_id, "posts": len(posts),
+                   "sha256": file_digest(f"{base}.jsonl"), "images": None,
+                   "pending_image_ids": list(pending)}, f)
+    return base
+
+
+def post(post_id, text):
+    return {"id": post_id, "date": "2025-08-01T08:00:00+08:00", "text": text, "image": None}
+
+
+def test_highest_partition_wins_for_duplicate_ids(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cfg = settings(str(tmp_path), "http://127.0.0.1:9/1/upload")
+    write_partition(cfg, 0, 3, [post(1, "一"), post(3, "分區 0"), post(5, "分區 0")], 1, 4)
+    write_partition(cfg, 1, 3, [post(3, "分區 1"), post(5, "分區 1"), post(6, "六")], 5, 8)
+    write_partition(cfg, 2, 3, [post(5, "分區 2"), post(9, "九")], 9, 12, pending=[9])
+    assert backfill.merge_partitions(cfg) == 0
+
+    with post_store.PostStore(cfg.post_store_file) as store:
+        assert [(p["id"], p["text"]) for p in store.iter_posts(by_id=True)] == [
+            (1, "一"), (3, "分區 1"), (5, "分區 2"), (6, "六"), (9, "九")]
+    state = import_state.load_state(cfg.import_state_file)
+    assert state["last_message_id"] == 12
+    assert import_state.pending_image_ids(state) == [9]
+    report = json.loads(open(cfg.run_metrics_file, encoding="utf-8").read().splitlines()[-1])
+    assert report["counters"]["backfill_duplicates"] == 3
+
+
+def test_merge_advances_but_never_rewinds_the_watermark(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cfg = settings(str(tmp_path), "http://127.0.0.1:9/1/upload")
+    write_partition(cfg, 0, 1, [post(1, "一")], 1, 20)
+    import_state.save_state({"last_message_id": 5}, cfg.import_state_file)
+    assert backfill.merge_partitions(cfg) == 0
+    assert import_state.load_state(cfg.import_state_file)["last_message_id"] == 20
+
+    # 回補較舊的範圍時 watermark 不會倒退
+    import_state.save_state({"last_message_id": 500}, cfg.import_state_file)
+    assert backfill.merge_partitions(cfg) == 0
+    assert import_state.load_state(cfg.import_state_file)["last_message_id"] == 500
+
+
+def test_merge_refuses_partials_that_do_not_match_their_marker(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    cfg = settings(str(tmp_path), "http://127.0.0.1:9/1/upload")
+    write_partition(cfg, 0, 2, [post(1, "一")], 1, 2)
+    base = write_partition(cfg, 1, 2, [post(2, "二")], 3, 4)
+    with open(f"{base}.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps(post(4, "被截斷後又補上")) + "\n")
+
+    assert backfill.merge_partitions(cfg) == 1
+    assert "part-0001-of-0002 的部分分片與完成標記不符" in capsys.readouterr().out
+    assert not os.path.exists(cfg.post_store_file)
+
+
+def test_merge_requires_every_partition(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    cfg = settings(str(tmp_path), "http://127.0.0.1:9/1/upload")
+    write_partition(cfg, 0, 3, [post(1, "一")], 1, 2)
+    write_partition(cfg, 2, 3, [post(5, "五")], 5, 6)
+    assert backfill.merge_partitions(cfg) == 1
+    assert "以下分區尚未完成：1" in capsys.readouterr().out
+    assert not os.path.exists(cfg.post_store_file)
+
+
+def cli_backfill(cwd, *args):
+    env = {key: value for key, value in os.environ.items()
+           if not key.startswith(("STORAGE_", "STATE_", "FIRESTORE_", "CHANNEL_", "BACKFILL_"))}
+    return subprocess.run([sys.executable, os.path.join(REPO, "cli.py"), "backfill", "--fake-messages", "30",
+                           "--to-id", "30", *args], cwd=cwd, env=env, capture_output=True, text=True, timeout=120)
+
+
+def test_local_workers_match_a_single_worker(tmp_path):
+    # 本地模式：每個分區在自己的 worker process 中執行，全部完成後合併
+    results = {}
+    for workers in (1, 3):
+        cwd = tmp_path / f"workers-{workers}"
+        cwd.mkdir()
+        result = cli_backfill(cwd, "--workers", str(workers))
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert f"{workers}/{workers} 個分區完成" in result.stdout
+        cfg = config.ImporterConfig({"POST_STORE_FILE": str(cwd / "posts.db")})
+        results[workers] = stored_posts(cfg)
+        assert import_state.load_state(str(cwd / "import_state.json"))["last_message_id"] == 30
+    assert [post["id"] for post in results[1]] == list(range(1, 31))
+    assert results[3] == results[1]
+    assert len(os.listdir(tmp_path / "workers-3" / "backfill" / FakeTelegramClient.primary_channel)) >= 6
@@ -0,0 +1,108 @@
+# 持有舊版本的客戶端依序套用 deltas/ 後，必須得到與完整匯出 (posts.json) 完全相同的內容
+
+import json
+
+import pytest
+
+import delta_feed
+import post_store
+
+
+def post(post_id, date, text, image=None):
+    return {"id": post_id, "date": date, "text": text, "image": image}
+
+
+# 每一步是 (要新增或修改的貼文, 要刪除的 ID)，依序發布成版本 1、2、3 ...
+STEPS = [
+    ([post(1, "2025-08-01", "第一篇"), post(2, "2025-08-01", "第二篇"), post(3, "2025-08-02", "第三篇")], []),
+    ([post(4, "2025-08-03", "新的一篇", "https://i.ibb.co/a.jpg")], []),
+    ([post(2, "2025-08-01", "第二篇 (已編輯)")], []),
+    ([], [1]),
+    ([post(3, "2025-08-04", "日期被修改"), post(5, "2025-08-04", "同一天 🙏")], [4]),
+    ([post(6, "2025-08-05", "再一篇")], [2, 5]),
+]
+
+
+class Archive:
+    """以貼文資料庫模擬匯入程式：每一步之後發布版本並寫出完整匯出。"""
+
+    def __init__(self, root):
+        self.root = root
+        self.store = post_store.PostStore(str(root / "posts.db"))
+        self.paths = {"version_path": str(root / "version.json"), "delta_dir": str(root / "deltas"),
+                      "state_path": str(root / "delta_state.json")}
+
+    def step(self, upserts, removed, **kwargs):
+        self.store.upsert(upserts)
+        self.store.delete(removed)
+        return delta_feed.publish(self.store.iter_posts(), **self.paths, **kwargs)
+
+    def full_export(self):
+        path = self.root / "posts.json"
+        post_store.write_posts_json(self.store.iter_posts(), str(path))
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def apply(self, posts, from_version):
+        return delta_feed.apply_deltas(posts, from_version, self.paths["delta_dir"], self.paths["version_path"])
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = Archive(tmp_path)
+    yield archive
+    archive.store.close()
+
+
+def test_apply_deltas_reproduces_full_export_from_every_version(archive):
+    exports = {}
+    for upserts, removed in STEPS:
+        stats = archive.step(upserts, removed)
+        assert stats["changed"]
+        exports[stats["version"]] = archive.full_export()
+
+    latest = max(exports)
+    for version, old in exports.items():
+        posts, to_version = archive.apply(old, version)
+        assert to_version == latest
+        assert posts == exports[latest]
+
+
+def test_unchanged_content_keeps_the_version(archive):
+    first = archive.step(*STEPS[0])
+    again = archive.step([], [])
+    assert not again["changed"]
+    assert again["version"] == first["version"]
+
+
+def test_lost_state_never_republishes_an_older_version(archive, tmp_path):
+    for upserts, removed in STEPS[:3]:
+        archive.step(upserts, removed)
+    old = archive.full_export()
+
+    # 全新的容器：delta_state.json、version.json 與 deltas/ 都不在本地，只知道 bucket 中已發布的版本
+    for path in (tmp_path / "delta_state.json", tmp_path / "version.json"):
+        path.unlink()
+    for path in (tmp_path / "deltas").iterdir():
+        path.unlink()
+    stats = archive.step(*STEPS[3], remote_version=3)
+    assert stats["version"] == 4 and stats["baseline_lost"]
+    # 沒有可靠的基準時不產生 delta，持有舊版本的客戶端必須下載完整歸檔
+    assert not (tmp_path / "deltas" / "4.json").exists()
+    with pytest.raises(ValueError):
+        archive.apply(old, 3)
+
+    # 之後的版本照常產生 delta
+    after_reset = archive.full_export()
+    stats = archive.step(*STEPS[4])
+    assert stats["version"] == 5 and not stats["baseline_lost"]
+    posts, _ = archive.apply(after_reset, 4)
+    assert posts == archive.full_export()
+
+
+def test_remote_version_ahead_of_local_state(archive):
+    for upserts, removed in STEPS[:2]:
+        archive.step(upserts, removed)
+    # 另一個運行已經發布了更新的版本：本地的比對基準不能再用來產生 delta
+    stats = archive.step(*STEPS[2], remote_version=7)
+    assert stats["version"] == 8 and stats["baseline_lost"]
+    assert json.loads(open(archive.paths["version_path"], encoding="utf-8").read())["min_delta_version"] is None
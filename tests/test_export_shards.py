@@ -0,0 +1,125 @@
+# 按月分片、manifest.json 與 latest.json 的內容，以及未改變的匯出不改寫任何檔案
+
+import hashlib
+import json
+import os
+
+import pytest
+
+import export_shards
+
+
+def post(post_id, date, text="內容"):
+    return {"id": post_id, "date": date, "text": text, "image": None}
+
+
+# 依輸出順序 (日期降序、ID 降序) 排列
+POSTS = [
+    post(6, "2025-09-02", "九月 🙏"),
+    post(5, "2025-09-01"),
+    post(4, "2025-08-31"),
+    post(3, "2025-08-01"),
+    post(2, "2025-08-01"),
+    post(1, "2025-07-15"),
+]
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return {"shards_dir": str(tmp_path / "posts"), "latest_path": str(tmp_path / "latest.json")}
+
+
+def read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_manifest_is_unchanged_for_an_identical_export(paths):
+    export_shards.write_shards(POSTS, **paths)
+    manifest_path = os.path.join(paths["shards_dir"], export_shards.MANIFEST_FILE_NAME)
+    with open(manifest_path, "rb") as f:
+        first = f.read()
+    mtime = os.stat(manifest_path).st_mtime_ns
+
+    stats = export_shards.write_shards(POSTS, **paths)
+    assert not stats["manifest_written"]
+    assert stats["written"] == [] and stats["unchanged"] == 3
+    with open(manifest_path, "rb") as f:
+        assert f.read() == first
+    assert os.stat(manifest_path).st_mtime_ns == mtime
+    assert "generated_at" not in read_json(manifest_path)
+
+
+def test_one_shard_per_month_in_output_order(paths):
+    stats = export_shards.write_shards(POSTS, latest_count=2, **paths)
+    assert stats["written"] == ["2025-09.json", "2025-08.json", "2025-07.json"]
+    assert stats["unchanged"] == 0 and stats["removed"] == []
+    assert stats["latest_written"] and stats["manifest_written"]
+
+    shards_dir = paths["shards_dir"]
+    assert sorted(os.listdir(shards_dir)) == ["2025-07.json", "2025-08.json", "2025-09.json", "manifest.json"]
+    assert read_json(os.path.join(shards_dir, "2025-09.json")) == POSTS[:2]
+    assert read_json(os.path.join(shards_dir, "2025-08.json")) == POSTS[2:5]
+    assert read_json(os.path.join(shards_dir, "2025-07.json")) == POSTS[5:]
+    # 分片為緊湊格式並保留中文與表情符號
+    with open(os.path.join(shards_dir, "2025-09.json"), "rb") as f:
+        assert f.read() == export_shards.serialize_posts(POSTS[:2])
+    assert "九月 🙏".encode("utf-8") in export_shards.serialize_posts(POSTS[:1])
+
+
+def test_manifest_lists_shards_with_hash_and_count(paths):
+    export_shards.write_shards(POSTS, **paths)
+    manifest = read_json(os.path.join(paths["shards_dir"], export_shards.MANIFEST_FILE_NAME))
+    assert manifest["version"] == export_shards.MANIFEST_FORMAT_VERSION
+    assert manifest["total"] == 6
+    assert manifest["latest"] == "latest.json"
+    assert [(shard["month"], shard["file"], shard["count"]) for shard in manifest["shards"]] == [
+        ("2025-09", "2025-09.json", 2), ("2025-08", "2025-08.json", 3), ("2025-07", "2025-07.json", 1)]
+    for shard in manifest["shards"]:
+        with open(os.path.join(paths["shards_dir"], shard["file"]), "rb") as f:
+            assert hashlib.sha256(f.read()).hexdigest() == shard["sha256"]
+
+
+def test_latest_json_holds_the_newest_posts(paths):
+    export_shards.write_shards(POSTS, latest_count=4, **paths)
+    assert read_json(paths["latest_path"]) == POSTS[:4]
+    # 貼文比 latest_count 少時全部寫入
+    export_shards.write_shards(POSTS[:2], latest_count=4, **paths)
+    assert read_json(paths["latest_path"]) == POSTS[:2]
+
+
+def test_only_changed_months_are_rewritten(paths):
+    export_shards.write_shards(POSTS, latest_count=2, **paths)
+    edited = [dict(p, text="已編輯") if p["id"] == 1 else p for p in POSTS]
+    stats = export_shards.write_shards(edited, latest_count=2, **paths)
+    assert stats["written"] == ["2025-07.json"] and stats["unchanged"] == 2
+    assert not stats["latest_written"] and stats["manifest_written"]
+
+
+def test_months_without_posts_are_removed(paths):
+    export_shards.write_shards(POSTS, **paths)
+    stats = export_shards.write_shards(POSTS[:2] + POSTS[5:], **paths)
+    assert stats["removed"] == ["2025-08.json"]
+    assert not os.path.exists(os.path.join(paths["shards_dir"], "2025-08.json"))
+    manifest = read_json(os.path.join(paths["shards_dir"], export_shards.MANIFEST_FILE_NAME))
+    assert [shard["month"] for shard in manifest["shards"]] == ["2025-09", "2025-07"]
+    assert manifest["total"] == 3
+
+
+def test_undated_posts_get_their_own_shard(paths):
+    posts = POSTS[:1] + [post(9, None), post(8, "")]
+    export_shards.write_shards(posts, **paths)
+    assert read_json(os.path.join(paths["shards_dir"], "undated.json")) == posts[1:]
+
+
+def test_missing_shard_file_is_rewritten(paths):
+    export_shards.write_shards(POSTS, **paths)
+    os.remove(os.path.join(paths["shards_dir"], "2025-08.json"))
+    stats = export_shards.write_shards(POSTS, **paths)
+    assert stats["written"] == ["2025-08.json"]
+
+
+def test_read_shards_reassembles_the_full_list(paths):
+    assert export_shards.read_shards(paths["shards_dir"]) == []
+    export_shards.write_shards(iter(POSTS), **paths)
+    assert export_shards.read_shards(paths["shards_dir"]) == POSTS
@@ -0,0 +1,108 @@
+# 測試 firestore_sync.sync_posts 只刪除自己同步過的文件 (以記憶體中的假 Firestore 客戶端執行)。
+
+import types
+
+import pytest
+
+import firestore_sync
+
+
+class FakeFirestore:
+    """只實作 sync_posts 用到的 API：collection().document()/select().stream() 與 bulk_writer()。"""
+
+    def __init__(self, docs=None):
+        self.docs = dict(docs or {})
+        self.deleted = []
+
+    def collection(self, name):
+        client = self
+
+        class Collection:
+            def document(self, doc_id):
+                return types.SimpleNamespace(id=doc_id)
+
+            def select(self, fields):
+                return self
+
+            def stream(self):
+                for doc_id, data in list(client.docs.items()):
+                    yield types.SimpleNamespace(id=doc_id, to_dict=lambda data=data: dict(data))
+        return Collection()
+
+    def bulk_writer(self, options=None):
+        client = self
+
+        class Writer:
+            def on_write_result(self, callback):
+                self.on_result = callback
+
+            def on_write_error(self, callback):
+                self.on_error = callback
+
+            def set(self, reference, data):
+                client.docs[reference.id] = dict(data)
+                self.on_result(reference, None, self)
+
+            def delete(self, reference):
+                client.docs.pop(reference.id, None)
+                client.deleted.append(reference.id)
+                self.on_result(reference, None, self)
+
+            def flush(self):
+                pass
+
+            def close(self):
+                pass
+        return Writer()
+
+
+def post(post_id, text="內容"):
+    return {"id": post_id, "date": "2025-08-01", "text": text, "image": None}
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    return str(tmp_path / "firestore_sync_state.json")
+
+
+def test_bootstrap_never_deletes_existing_documents(state_path):
+    # 集合中有其他來源寫入的文件，狀態檔不存在
+    client = FakeFirestore({"manual-doc": {"text": "人工新增"}})
+    stats = firestore_sync.sync_posts([post(1), post(2)], client=client, state_path=state_path)
+    assert stats["bootstrapped"]
+    assert stats["written"] == 2 and stats["deleted"] == 0
+    assert "manual-doc" in client.docs
+
+    # 之後的運行也不會刪除沒有記錄在狀態檔中的文件
+    stats = firestore_sync.sync_posts([post(1)], client=client, state_path=state_path)
+    assert stats["deleted"] == 1
+    assert client.deleted == ["2025-08-01_00002"]
+    assert "manual-doc" in client.docs
+
+
+def test_deletes_only_documents_recorded_in_state(state_path):
+    client = FakeFirestore()
+    firestore_sync.sync_posts([post(1), post(2), post(3)], client=client, state_path=state_path)
+    client.docs["other-writer"] = {"text": "其他程式寫入"}
+
+    stats = firestore_sync.sync_posts([post(1), post(3, "已編輯")], client=client, state_path=state_path)
+    assert stats["written"] == 1 and stats["deleted"] == 1 and stats["unchanged"] == 1
+    assert sorted(client.docs) == ["2025-08-01_00001", "2025-08-01_00003", "other-writer"]
+
+
+def test_deletes_are_deferred_when_not_allowed(state_path):
+    client = FakeFirestore()
+    firestore_sync.sync_posts([post(1), post(2)], client=client, state_path=state_path)
+
+    # 匯入失敗 (資料庫可能不完整)：不刪除，待刪除的文件留在狀態檔中
+    stats = firestore_sync.sync_posts([post(1)], client=client, state_path=state_path, allow_deletes=False)
+    assert stats["deleted"] == 0 and stats["deletes_deferred"] == 1
+    assert "2025-08-01_00002" in client.docs
+    assert "2025-08-01_00002" in firestore_sync.load_state(state_path, firestore_sync.FIRESTORE_COLLECTION)
+
+    # 下一次成功的運行再刪除
+    stats = firestore_sync.sync_posts([post(1)], client=client, state_path=state_path)
+    assert stats["deleted"] == 1 and stats["deletes_deferred"] == 0
+    assert "2025-08-01_00002" not in client.docs
+    assert firestore_sync.load_state(state_path, firestore_sync.FIRESTORE_COLLECTION) == {
+        "2025-08-01_00001": client.docs["2025-08-01_00001"]["content_hash"]}
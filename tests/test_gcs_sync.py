@@ -0,0 +1,165 @@
+# 輸出同步到 bucket：MD5 相同的物件不重新上傳、generation 前置條件不符時回報衝突而不覆寫、
+# 指標檔 (latest.json、version.json、manifest.json、current.json 等) 在它們引用的物件之後才上傳
+
+import os
+
+import pytest
+
+import config
+import gcs_sync
+from fake_storage import FakeStorageClient, md5_base64
+
+BUCKET = "out-bkt"
+POINTERS = {"posts.json", "latest.json", "search-index.json", "version.json", "posts/manifest.json",
+            "publish/current.json"}
+
+
+@pytest.fixture
+def client():
+    return FakeStorageClient()
+
+
+@pytest.fixture
+def cfg(tmp_path):
+    root = str(tmp_path)
+    cfg = config.ImporterConfig({
+        "CHANNEL_USERNAME": "main", "STORAGE_BUCKET_NAME": BUCKET,
+        "SHARDS_DIR": os.path.join(root, "posts"), "LATEST_JSON_FILE": os.path.join(root, "latest.json"),
+        "SEARCH_INDEX_FILE": os.path.join(root, "search-index.json"),
+        "VERSION_JSON_FILE": os.path.join(root, "version.json"), "DELTA_DIR": os.path.join(root, "deltas"),
+        "PUBLISH_DIR": os.path.join(root, "publish"),
+    })
+    cfg.output_json_file = os.path.join(root, "posts.json")
+    files = {
+        "posts.json": "[]", "latest.json": "[]", "search-index.json": "{}", "version.json": '{"version":2}',
+        "posts/2025-08.json": "[1]", "posts/2025-07.json": "[2]", "posts/manifest.json": '{"shards":[]}',
+        "deltas/2.json": "{}", "publish/posts.0123456789abcdef.json": "[]",
+        "publish/posts.0123456789abcdef.json.gz": "gz", "publish/current.json": "{}",
+    }
+    for name, content in files.items():
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+    cfg.root = root
+    return cfg
+
+
+def write(cfg, name, content):
+    with open(os.path.join(cfg.root, name), "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def sync(cfg, client, workers=4):
+    return gcs_sync.sync_outputs(gcs_sync.collect_outputs(cfg), BUCKET, client=client, workers=workers)
+
+
+def test_collect_outputs_marks_pointer_files(cfg):
+    items = {item["name"]: item for item in gcs_sync.collect_outputs(cfg)}
+    assert {name for name, item in items.items() if item["pointer"]} == POINTERS
+    assert items["publish/posts.0123456789abcdef.json"]["cache_control"] == gcs_sync.IMMUTABLE_CACHE_CONTROL
+    assert items["publish/posts.0123456789abcdef.json.gz"]["content_encoding"] == "gzip"
+    assert items["posts/2025-08.json"]["cache_control"] == gcs_sync.REVALIDATE_CACHE_CONTROL
+    prefixed = gcs_sync.collect_outputs(cfg, prefix="/site/")
+    assert all(item["name"].startswith("site/") for item in prefixed)
+
+
+def test_pointers_are_uploaded_after_the_objects_they_reference(cfg, client):
+    stats = sync(cfg, client)
+    uploaded = client.bucket(BUCKET).uploaded()
+    assert set(uploaded) == set(stats["uploaded"]) and len(uploaded) == 11
+    first_pointer = min(uploaded.index(name) for name in POINTERS)
+    assert set(uploaded[first_pointer:]) == POINTERS
+    assert not stats["pointers_skipped"]
+
+
+def test_unchanged_objects_are_not_uploaded_again(cfg, client):
+    sync(cfg, client)
+    bucket = client.bucket(BUCKET)
+    bucket.log.clear()
+
+    stats = sync(cfg, client)
+    assert stats["uploaded"] == [] and stats["metadata"] == [] and stats["unchanged"] == 11
+    assert bucket.log == []
+
+    write(cfg, "posts/2025-08.json", "[1,3]")
+    write(cfg, "posts/manifest.json", '{"shards":[1]}')
+    stats = sync(cfg, client)
+    assert stats["uploaded"] == ["posts/2025-08.json", "posts/manifest.json"]
+    assert stats["unchanged"] == 9 and stats["bytes"] == len("[1,3]") + len('{"shards":[1]}')
+    assert bucket.objects["posts/2025-08.json"]["data"] == b"[1,3]"
+
+
+def test_metadata_only_changes_are_patched(cfg, client):
+    sync(cfg, client)
+    bucket = client.bucket(BUCKET)
+    bucket.objects["posts/2025-07.json"]["cache_control"] = "public, max-age=3600"
+    bucket.log.clear()
+    stats = sync(cfg, client)
+    assert stats["metadata"] == ["posts/2025-07.json"] and stats["uploaded"] == []
+    assert bucket.log == [("patch", "posts/2025-07.json")]
+    assert bucket.objects["posts/2025-07.json"]["cache_control"] == gcs_sync.REVALIDATE_CACHE_CONTROL
+
+
+def test_precondition_failure_is_reported_instead_of_overwriting(cfg, client, tmp_path, monkeypatch):
+    sync(cfg, client)
+    bucket = client.bucket(BUCKET)
+    write(cfg, "posts/2025-08.json", "[1,3]")
+    write(cfg, "version.json", '{"version":3}')
+
+    # 另一個運行在列出物件之後、上傳之前寫入了同一個分片
+    other = tmp_path / "other.json"
+    other.write_text("[9]", encoding="utf-8")
+    list_remote = gcs_sync._list_remote
+
+    def list_then_race(*args):
+        remote = list_remote(*args)
+        bucket.blob("posts/2025-08.json").upload_from_filename(str(other))
+        return remote
+    monkeypatch.setattr(gcs_sync, "_list_remote", list_then_race)
+    bucket.log.clear()
+
+    stats = sync(cfg, client)
+    assert stats["conflicts"] == ["posts/2025-08.json"]
+    assert stats["failed"] == []
+    # 另一個運行的內容保留，指標檔不更新
+    assert bucket.objects["posts/2025-08.json"]["data"] == b"[9]"
+    assert stats["pointers_skipped"]
+    assert bucket.objects["version.json"]["data"] == b'{"version":2}'
+    assert bucket.uploaded() == ["posts/2025-08.json"]
+
+
+def test_new_object_created_by_another_run_is_not_overwritten(cfg, client, tmp_path):
+    bucket = client.bucket(BUCKET)
+    items = [item for item in gcs_sync.collect_outputs(cfg) if item["name"] == "deltas/2.json"]
+    remote = gcs_sync._list_remote(client, bucket, items)
+    other = tmp_path / "other.json"
+    other.write_text('{"other":1}', encoding="utf-8")
+    bucket.blob("deltas/2.json").upload_from_filename(str(other))
+    # 列出時物件還不存在：ifGenerationMatch=0 只允許建立
+    with pytest.raises(Exception) as excinfo:
+        gcs_sync._sync_one(bucket, items[0], remote.get("deltas/2.json"))
+    assert type(excinfo.value).__name__ == "PreconditionFailed"
+    assert bucket.objects["deltas/2.json"]["data"] == b'{"other":1}'
+
+
+def test_failed_upload_skips_pointers(cfg, client):
+    bucket = client.bucket(BUCKET)
+    bucket.fail = {"deltas/2.json"}
+    stats = sync(cfg, client)
+    assert stats["failed"] == ["deltas/2.json"] and stats["pointers_skipped"]
+    assert not POINTERS & set(bucket.objects)
+
+    bucket.fail = set()
+    stats = sync(cfg, client)
+    assert not stats["pointers_skipped"]
+    assert POINTERS <= set(bucket.objects)
+    # 第一次已成功上傳的物件不再上傳
+    assert "posts/2025-08.json" not in stats["uploaded"]
+
+
+def test_file_md5_matches_gcs_format(tmp_path):
+    path = tmp_path / "data.bin"
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    path.write_bytes(data)
+    assert gcs_sync.file_md5(str(path)) == md5_base64(data)
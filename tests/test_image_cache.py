@@ -0,0 +1,151 @@
+# 圖片索引：photo id 命中時跳過下載與上傳、內容 SHA-256 命中時跳過上傳，
+# 索引依最後使用時間淘汰，保存後在下一次運行 (或另一個容器) 中仍然有效
+
+import asyncio
+import os
+import shutil
+import types
+
+import pytest
+
+import everypy
+import image_cache
+from bench_import import FakeTelegramClient, ImgbbStandIn
+from test_import_state import settings
+
+DAY = 86400
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(image_cache, "time", types.SimpleNamespace(time=fake.time))
+    return fake
+
+
+def test_photo_id_and_content_hits(tmp_path, clock):
+    cache = image_cache.ImageCache(str(tmp_path / "image_index.json"))
+    data = b"\xff\xd8jpeg"
+    url, digest = cache.lookup_content(data)
+    assert url is None and digest == image_cache.content_hash(data)
+    assert cache.lookup_photo(123) is None
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    cache.record("https://i.ibb.co/a.jpg", photo_id=123, digest=digest, size=len(data))
+    assert cache.changed
+    assert cache.lookup_photo(123) == "https://i.ibb.co/a.jpg"
+    assert cache.lookup_photo("123") == "https://i.ibb.co/a.jpg"
+    # 另一個 photo id 但內容相同 (轉貼)：下載後以內容雜湊命中
+    assert cache.lookup_photo(456) is None
+    assert cache.lookup_content(data) == ("https://i.ibb.co/a.jpg", digest)
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+def test_record_without_url_is_ignored(tmp_path):
+    cache = image_cache.ImageCache(str(tmp_path / "image_index.json"))
+    cache.record(None, photo_id=1, digest="abc")
+    assert cache.photos == {} and cache.hashes == {} and not cache.changed
+
+
+def test_meta_is_shared_between_photo_and_content(tmp_path):
+    cache = image_cache.ImageCache(str(tmp_path / "image_index.json"))
+    meta = {"width": 800, "height": 600}
+    cache.record("https://i.ibb.co/a.jpg", digest="d1", meta=meta)
+    # 之後以 photo id 記錄同一份內容時沿用內容雜湊的 meta
+    cache.record("https://i.ibb.co/a.jpg", photo_id=7, digest="d1")
+    assert cache.meta_for(photo_id=7) == meta
+    assert cache.meta_for(digest="d1") == meta
+    assert cache.meta_for(photo_id=8) is None
+
+
+def test_save_and_load_roundtrip(tmp_path, clock):
+    path = str(tmp_path / "image_index.json")
+    cache = image_cache.ImageCache(path)
+    cache.record("https://i.ibb.co/a.jpg", photo_id=1, digest="d1", size=10)
+    cache.save()
+    assert not cache.changed and not os.path.exists(f"{path}.tmp")
+
+    loaded = image_cache.ImageCache(path).load()
+    assert loaded.photos == cache.photos and loaded.hashes == cache.hashes
+    assert loaded.lookup_photo(1) == "https://i.ibb.co/a.jpg"
+
+
+@pytest.mark.parametrize("content", ['{"version": 0, "photos": {"1": {}}}', "[1, 2]", "{"])
+def test_unusable_index_starts_empty(tmp_path, content, capsys):
+    path = tmp_path / "image_index.json"
+    path.write_text(content, encoding="utf-8")
+    cache = image_cache.ImageCache(str(path)).load()
+    assert cache.photos == {} and cache.hashes == {}
+    assert "警告" in capsys.readouterr().out
+
+
+def test_evicts_by_age_then_by_count(tmp_path, clock):
+    cache = image_cache.ImageCache(str(tmp_path / "image_index.json"), max_entries=2, max_age_days=30)
+    for photo_id in range(1, 5):
+        cache.record(f"https://i.ibb.co/{photo_id}.jpg", photo_id=photo_id, digest=f"d{photo_id}")
+        clock.now += DAY
+    # 最早的一筆剛才被使用過，不會因為數量上限被淘汰
+    cache.lookup_photo(1)
+    cache.evict()
+    assert sorted(cache.photos) == ["1", "4"]
+    assert sorted(cache.hashes) == ["d1", "d4"]
+
+    clock.now += 31 * DAY
+    cache.record("https://i.ibb.co/5.jpg", photo_id=5, digest="d5")
+    cache.save()
+    loaded = image_cache.ImageCache(cache.path).load()
+    assert sorted(loaded.photos) == ["5"] and sorted(loaded.hashes) == ["d5"]
+
+
+def test_merge_keeps_the_most_recently_used_entry(tmp_path, clock):
+    ours = image_cache.ImageCache(str(tmp_path / "ours.json"))
+    theirs = image_cache.ImageCache(str(tmp_path / "theirs.json"))
+    ours.record("https://i.ibb.co/old.jpg", photo_id=1, digest="d1")
+    theirs.record("https://i.ibb.co/only-theirs.jpg", photo_id=2)
+    clock.now += DAY
+    theirs.record("https://i.ibb.co/new.jpg", photo_id=1, digest="d1")
+    clock.now += DAY
+    ours.record("https://i.ibb.co/ours-newer.jpg", digest="d1")
+    ours.changed = False
+
+    ours.merge(theirs)
+    assert ours.changed
+    assert ours.photos["1"]["url"] == "https://i.ibb.co/new.jpg"
+    assert ours.photos["2"]["url"] == "https://i.ibb.co/only-theirs.jpg"
+    assert ours.hashes["d1"]["url"] == "https://i.ibb.co/ours-newer.jpg"
+
+
+def test_saved_index_skips_downloads_and_uploads_in_a_fresh_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ("first", "second"):
+        (tmp_path / name).mkdir()
+    client = FakeTelegramClient(60, photo_ratio=0.5, duplicate_ratio=0.3, image_bytes=2000)
+    photos = [client.make_message(msg_id).photo for msg_id in range(1, 61)]
+    photos = [photo for photo in photos if photo]
+    with ImgbbStandIn() as stand_in:
+        first = settings(str(tmp_path / "first"), lookback=5)
+        first.imgbb_upload_url = stand_in.url
+        # 單一上傳 worker：同一份內容不會同時在途，第二次必定以內容雜湊命中
+        first.upload_concurrency = 1
+        assert asyncio.run(everypy.main(client, cfg=first))["ok"]
+        # 內容相同的轉貼只上傳一次
+        assert client.downloads == len(photos)
+        assert stand_in.uploads == len({photo.content_key for photo in photos})
+
+        # 全新的資料庫，沿用圖片索引：所有圖片都以 photo id 命中
+        second = settings(str(tmp_path / "second"), lookback=5)
+        second.imgbb_upload_url = stand_in.url
+        shutil.copyfile(first.image_index_file, second.image_index_file)
+        downloads, uploads = client.downloads, stand_in.uploads
+        report = asyncio.run(everypy.main(client, cfg=second))
+        assert report["ok"]
+        assert report["counters"]["image_cache_photo_hits"] == len(photos)
+        assert (client.downloads, stand_in.uploads) == (downloads, uploads)
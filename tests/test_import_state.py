@@ -0,0 +1,163 @@
+# 匯入進度：watermark 只前進、回看窗口只保留最近的 edit_date，
+# 下一次運行從 watermark 繼續，並重新處理回看窗口中被編輯過的訊息
+
+import asyncio
+import datetime
+import json
+import os
+
+import pytest
+
+import config
+import everypy
+import import_state
+import post_store
+from bench_import import FakeTelegramClient
+
+EDITED = datetime.datetime(2025, 8, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def test_missing_state_falls_back_to_the_store(tmp_path):
+    path = str(tmp_path / "import_state.json")
+    state = import_state.load_state(path, fallback_last_id=42)
+    assert state == {"last_message_id": 42, "edit_dates": {}, "pending_image_ids": {}, "updated_at": None}
+
+
+def test_corrupt_state_falls_back_to_the_store(tmp_path, capsys):
+    path = tmp_path / "import_state.json"
+    path.write_text('{"last_message_id": ', encoding="utf-8")
+    assert import_state.load_state(str(path), fallback_last_id=7)["last_message_id"] == 7
+    assert "格式不正確" in capsys.readouterr().out
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    path = str(tmp_path / "import_state.json")
+    state = import_state.advance(import_state.empty_state(), [(3, None), (5, EDITED)], lookback=10)
+    import_state.update_pending(state, [4], [], max_attempts=3)
+    import_state.save_state(state, path)
+    loaded = import_state.load_state(path, fallback_last_id=999)
+    assert loaded["last_message_id"] == 5
+    assert loaded["edit_dates"] == {"3": None, "5": EDITED.isoformat()}
+    assert loaded["pending_image_ids"] == {"4": 1}
+    assert loaded["updated_at"]
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_advance_keeps_only_the_lookback_window():
+    state = import_state.empty_state()
+    state = import_state.advance(state, [(msg_id, None) for msg_id in range(1, 11)], lookback=3)
+    assert state["last_message_id"] == 10
+    assert sorted(state["edit_dates"], key=int) == ["8", "9", "10"]
+    # 只重新處理了較舊的訊息時 watermark 不倒退
+    state = import_state.advance(state, [(9, EDITED)], lookback=3)
+    assert state["last_message_id"] == 10
+    assert state["edit_dates"]["9"] == EDITED.isoformat()
+
+
+def test_is_unchanged():
+    state = import_state.advance(import_state.empty_state(), [(9, None), (10, EDITED)], lookback=5)
+    assert import_state.is_unchanged(state, 9, None)
+    assert import_state.is_unchanged(state, 10, EDITED)
+    assert not import_state.is_unchanged(state, 9, EDITED) # 被編輯過
+    assert not import_state.is_unchanged(state, 11, None) # 超過 watermark 的新訊息
+    # 不在回看窗口中的訊息沒有記錄：只有從未被編輯過的才算未變動 (呼叫端另外確認資料庫中已有這則貼文)
+    assert import_state.is_unchanged(state, 3, None)
+    assert not import_state.is_unchanged(state, 3, EDITED)
+
+
+def test_update_pending_counts_attempts_and_abandons():
+    state = import_state.empty_state()
+    assert import_state.update_pending(state, [5, 6], [], max_attempts=2) == []
+    assert import_state.pending_image_ids(state) == [5, 6]
+    assert import_state.update_pending(state, [5], [6], max_attempts=2) == [5]
+    assert import_state.pending_image_ids(state) == []
+
+
+class EditingClient(FakeTelegramClient):
+    """可以編輯既有訊息的假客戶端 (編輯後的文字與 edit_date)。"""
+
+    def __init__(self, total):
+        super().__init__(total, photo_ratio=0)
+        self.edits = {}
+
+    def make_message(self, msg_id, entity=None):
+        msg = super().make_message(msg_id, entity)
+        if msg_id in self.edits:
+            msg.text = self.edits[msg_id]
+            msg.edit_date = EDITED
+        return msg
+
+
+def settings(root, lookback):
+    names = {"POST_STORE_FILE": "posts.db", "IMPORT_STATE_FILE": "import_state.json",
+             "IMAGE_INDEX_FILE": "image_index.json", "SEARCH_INDEX_FILE": "search-index.json",
+             "DELTA_STATE_FILE": "delta_state.json", "CHANNELS_DIR": "channels", "VERSION_JSON_FILE": "version.json",
+             "DELTA_DIR": "deltas", "LATEST_JSON_FILE": "latest.json", "SHARDS_DIR": "posts", "PUBLISH_DIR": "publish",
+             "RUN_METRICS_FILE": "run_metrics.jsonl", "RUN_METRICS_OPENMETRICS_FILE": "metrics.prom"}
+    env = {key: os.path.join(root, name) for key, name in names.items()}
+    env.update(CHANNEL_USERNAME=FakeTelegramClient.primary_channel, IMGBB_API_KEY="key",
+               TELEGRAM_REQUESTS_PER_SECOND="0", IMGBB_REQUESTS_PER_SECOND="0", IMAGE_DERIVATIVES="0",
+               STATE_BUCKET_NAME="", STORAGE_BUCKET_NAME="", FIRESTORE_SYNC="0", EDIT_LOOKBACK_MESSAGES=str(lookback))
+    cfg = config.ImporterConfig(env)
+    cfg.output_json_file = os.path.join(root, "posts.json")
+    return cfg
+
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return settings(str(tmp_path), lookback=5)
+
+
+def test_next_run_resumes_from_the_watermark_and_picks_up_recent_edits(cfg):
+    client = EditingClient(30)
+    report = asyncio.run(everypy.main(client, cfg=cfg))
+    assert report["ok"] and report["counters"]["messages_fetched"] == 30
+    state = import_state.load_state(cfg.import_state_file)
+    assert state["last_message_id"] == 30
+    assert sorted(state["edit_dates"], key=int) == ["26", "27", "28", "29", "30"]
+
+    # 回看窗口內的編輯會被處理；窗口外的編輯不會被重新抓取
+    client.edits = {28: "第 28 則 (已編輯)", 10: "第 10 則 (已編輯)"}
+    client.total = 33
+    report = asyncio.run(everypy.main(client, cfg=cfg))
+    assert report["ok"]
+    assert report["counters"]["messages_fetched"] == 5 + 3
+    assert report["counters"]["messages_skipped_unchanged"] == 4
+    with post_store.PostStore(cfg.post_store_file) as store:
+        assert store.count() == 33
+        assert store.get(28)["text"] == "第 28 則 (已編輯)"
+        assert store.get(10)["text"] != "第 10 則 (已編輯)"
+    state = import_state.load_state(cfg.import_state_file)
+    assert state["last_message_id"] == 33
+    assert sorted(state["edit_dates"], key=int) == ["29", "30", "31", "32", "33"]
+    with open(cfg.output_json_file, encoding="utf-8") as f:
+        assert next(post for post in json.load(f) if post["id"] == 28)["text"] == "第 28 則 (已編輯)"
+
+    # 沒有新訊息也沒有編輯時，回看窗口中的訊息全部跳過
+    report = asyncio.run(everypy.main(client, cfg=cfg))
+    assert report["counters"]["messages_fetched"] == 5
+    assert report["counters"]["messages_skipped_unchanged"] == 5
+
+
+def test_interrupted_run_resumes_after_the_last_checkpoint(cfg):
+    class FailingClient(EditingClient):
+        async def iter_messages(self, *args, **kwargs):
+            async for msg in super().iter_messages(*args, **kwargs):
+                if msg.id == 26:
+                    raise ConnectionError("連線中斷")
+                yield msg
+
+    cfg.checkpoint_every = 10
+    report = asyncio.run(everypy.main(FailingClient(40), cfg=cfg))
+    assert not report["ok"]
+    # 只有已提交的批次推進 watermark
+    state = import_state.load_state(cfg.import_state_file)
+    assert state["last_message_id"] == 20
+    with post_store.PostStore(cfg.post_store_file) as store:
+        assert store.max_id() >= 20
+
+    report = asyncio.run(everypy.main(EditingClient(40), cfg=cfg))
+    assert report["ok"]
+    assert report["counters"]["messages_fetched"] == 5 + 20
+    assert import_state.load_state(cfg.import_state_file)["last_message_id"] == 40
@@ -0,0 +1,146 @@
+# 媒體處理管線：經由本地的 ImgBB 替身 (/1/upload) 真正走 HTTP 上傳，
+# 提交順序必須與讀入順序相同、同時在途的上傳不超過上限，worker 失敗時整個管線立即中止而不是卡住
+
+import asyncio
+import io
+import random
+
+import pytest
+
+import media_pipeline
+from bench_import import ImgbbStandIn
+
+
+async def aiter_messages(ids):
+    for msg_id in ids:
+        yield msg_id
+
+
+def plan(msg_id):
+    """每三則訊息中有一則沒有圖片。"""
+    post_item = {"id": msg_id, "text": f"訊息 {msg_id}", "image": None}
+    return post_item, (None if msg_id % 3 == 0 else msg_id)
+
+
+class Recorder:
+    """記錄提交的批次與同時在途的上傳數。"""
+
+    def __init__(self, stand_in, seed=7):
+        self.stand_in = stand_in
+        self.rng = random.Random(seed)
+        self.batches = []
+        self.uploading = 0
+        self.max_uploading = 0
+
+    async def download(self, media_job):
+        # 隨機延遲讓下載完成的順序與讀入順序不同
+        await asyncio.sleep(self.rng.random() * 0.01)
+        return io.BytesIO(b"\xff\xd8" + str(media_job).encode() * 64)
+
+    async def upload(self, media_job, file_bytes_io):
+        self.uploading += 1
+        self.max_uploading = max(self.max_uploading, self.uploading)
+        try:
+            return await media_pipeline.upload_to_imgbb(file_bytes_io, f"{media_job}.jpg", "image/jpeg", "key",
+                                                        upload_url=self.stand_in.url, timeout=10)
+        finally:
+            self.uploading -= 1
+
+    def commit(self, posts):
+        self.batches.append([item["id"] for item in posts])
+
+
+def run(recorder, ids, **kwargs):
+    kwargs.setdefault("download_workers", 3)
+    kwargs.setdefault("upload_workers", 2)
+    return asyncio.run(asyncio.wait_for(media_pipeline.run_media_pipeline(
+        aiter_messages(ids), plan, recorder.download, recorder.upload, recorder.commit, **kwargs), timeout=30))
+
+
+@pytest.fixture
+def stand_in():
+    with ImgbbStandIn(latency=0.005) as server:
+        yield server
+
+
+def test_posts_are_committed_in_input_order(stand_in):
+    recorder = Recorder(stand_in)
+    committed = []
+    ids = list(range(1, 61))
+    real_commit = recorder.commit
+
+    def commit(posts):
+        real_commit(posts)
+        committed.extend(posts)
+    recorder.commit = commit
+
+    assert run(recorder, ids, commit_every=7) == 60
+    assert [item["id"] for item in committed] == ids
+    assert len(recorder.batches) > 1
+    assert stand_in.uploads == 40
+    assert all(item["image"].startswith("https://i.ibb.co/") for item in committed if item["id"] % 3)
+    assert all(item["image"] is None for item in committed if item["id"] % 3 == 0)
+
+
+@pytest.mark.parametrize("upload_workers", [1, 3])
+def test_uploads_in_flight_never_exceed_the_limit(stand_in, upload_workers):
+    recorder = Recorder(stand_in)
+    run(recorder, range(1, 41), download_workers=6, upload_workers=upload_workers)
+    assert stand_in.uploads == 27
+    assert 1 <= recorder.max_uploading <= upload_workers
+
+
+def test_upload_failure_is_reported_and_the_post_is_still_committed(stand_in):
+    recorder = Recorder(stand_in)
+    upload = recorder.upload
+    failures = []
+
+    async def flaky_upload(media_job, file_bytes_io):
+        if media_job == 5:
+            raise media_pipeline.UploadError("格式錯誤")
+        return await upload(media_job, file_bytes_io)
+    recorder.upload = flaky_upload
+
+    run(recorder, range(1, 11), on_failure=lambda item, error: failures.append((item["id"], str(error))))
+    assert failures == [(5, "格式錯誤")]
+    assert [i for batch in recorder.batches for i in batch] == list(range(1, 11))
+
+
+def test_worker_exception_aborts_the_pipeline(stand_in):
+    # 訊息數遠多於佇列容量：worker 停止取用後 producer 會卡在已滿的佇列上，必須由 FIRST_EXCEPTION 中止
+    recorder = Recorder(stand_in)
+
+    def on_failure(post_item, error):
+        raise RuntimeError(f"無法處理 {post_item['id']}")
+
+    async def broken_download(media_job):
+        if media_job == 4:
+            raise OSError("下載中斷")
+        return await Recorder.download(recorder, media_job)
+    recorder.download = broken_download
+
+    with pytest.raises(RuntimeError, match="無法處理 4"):
+        run(recorder, range(1, 1001), download_workers=2, upload_workers=1, on_failure=on_failure)
+    committed = [i for batch in recorder.batches for i in batch]
+    assert 4 not in committed and len(committed) < 1000
+
+
+def test_commit_exception_aborts_the_pipeline(stand_in):
+    recorder = Recorder(stand_in)
+
+    def commit(posts):
+        raise OSError("磁碟已滿")
+    recorder.commit = commit
+
+    with pytest.raises(OSError, match="磁碟已滿"):
+        run(recorder, range(1, 201), commit_every=5)
+
+
+def test_upload_to_imgbb_classifies_throttling():
+    import rate_control
+    with ImgbbStandIn(throttle_ratio=1.0) as server:
+        with pytest.raises(rate_control.ThrottledError) as excinfo:
+            asyncio.run(media_pipeline.upload_to_imgbb(io.BytesIO(b"x"), "a.jpg", "image/jpeg", "key",
+                                                       upload_url=server.url, timeout=10))
+    assert excinfo.value.retry_after == 1.0
+    assert server.throttled == 1
@@ -0,0 +1,130 @@
+# 貼文資料庫：串流輸出的 posts.json 必須與原本以 json.dump 一次寫出的檔案逐位元組相同，
+# upsert 只改寫真的有變化的貼文，輸出順序為日期降序、ID 降序
+
+import json
+import os
+
+import pytest
+
+import config
+import post_store
+import sort_posts
+
+
+def post(post_id, date, text, image=None, **extra):
+    return dict({"id": post_id, "date": date, "text": text, "image": image}, **extra)
+
+
+POSTS = [
+    post(12, "2025-08-02", "多行\n文字與 \"引號\"、反斜線 \\ 以及 🙏"),
+    post(11, "2025-08-02", "", "https://i.ibb.co/a.jpg",
+         # 資料庫以 sort_keys 保存 image_meta，輸出時鍵依字母順序
+         image_meta={"height": 600, "srcset": [{"url": "https://i.ibb.co/a-400.webp", "w": 400}], "width": 800}),
+    post(3, "2025-08-01", "濟公活佛慈悲"),
+    post(7, "2025-07-31", "\t前後空白 "),
+]
+
+
+def old_dump(posts, path, **kwargs):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(list(posts), f, ensure_ascii=False, **kwargs)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("posts", [POSTS, POSTS[:1], []], ids=["many", "one", "empty"])
+@pytest.mark.parametrize("indent", [2, 4])
+def test_streamed_export_matches_json_dump(tmp_path, posts, indent):
+    expected = old_dump(posts, str(tmp_path / "old.json"), indent=indent)
+    path = str(tmp_path / "posts.json")
+    assert post_store.write_posts_json(iter(posts), path, indent=indent) == len(posts)
+    assert read_bytes(path) == expected
+    assert not os.path.exists(f"{path}.tmp")
+
+
+@pytest.mark.parametrize("posts", [POSTS, []], ids=["many", "empty"])
+def test_minified_export_matches_compact_json_dump(tmp_path, posts):
+    expected = old_dump(posts, str(tmp_path / "old.json"), separators=(",", ":"))
+    path = str(tmp_path / "posts.min.json")
+    post_store.write_posts_json(iter(posts), path, indent=None)
+    assert read_bytes(path) == expected
+
+
+def test_store_export_matches_the_old_posts_json(tmp_path):
+    # 舊的 posts.json：依日期降序、ID 降序排序後以 indent=2 一次寫出
+    expected = old_dump(sorted(POSTS, key=lambda p: (p["date"], p["id"]), reverse=True),
+                        str(tmp_path / "old.json"), indent=2)
+    with post_store.PostStore(str(tmp_path / "posts.db")) as store:
+        store.upsert(reversed(POSTS))
+        assert store.export_json(str(tmp_path / "posts.json")) == len(POSTS)
+    assert read_bytes(str(tmp_path / "posts.json")) == expected
+
+
+def test_upsert_counts_only_real_changes(tmp_path):
+    with post_store.PostStore(str(tmp_path / "posts.db")) as store:
+        assert store.upsert(POSTS) == 4
+        assert store.upsert(POSTS) == 0
+        edited = [dict(POSTS[2], text="已編輯"), dict(POSTS[3], image="https://i.ibb.co/b.jpg"),
+                  post(20, "2025-08-03", "新")]
+        assert store.upsert(edited) == 3
+        # 沒有 ID 或日期的貼文不寫入
+        assert store.upsert([post(None, "2025-08-03", "x"), post(21, "", "x")]) == 0
+        assert store.count() == 5 and store.max_id() == 20
+        assert store.get(3)["text"] == "已編輯"
+        assert store.get(11)["image_meta"] == POSTS[1]["image_meta"]
+        assert "image_meta" not in store.get(12)
+        assert store.delete([20, 99]) == 1 and not store.has(20)
+
+
+def test_queries_follow_the_output_order(tmp_path):
+    with post_store.PostStore(str(tmp_path / "posts.db")) as store:
+        store.upsert(POSTS)
+        assert [p["id"] for p in store.iter_posts(batch_size=1)] == [12, 11, 3, 7]
+        assert [p["id"] for p in store.iter_posts(by_id=True)] == [3, 7, 11, 12]
+        assert [p["id"] for p in store.latest(2)] == [12, 11]
+        assert [p["id"] for p in store.date_range("2025-08-01", "2025-08-01")] == [3]
+        assert all(p["channel"] == "second" for p in store.iter_posts(channel="second"))
+
+
+def test_merge_posts_interleaves_channels_in_output_order():
+    main = [post(5, "2025-08-03", "a"), post(4, "2025-08-01", "b")]
+    second = [post(9, "2025-08-02", "c", channel="second"), post(4, "2025-08-01", "d", channel="second")]
+    merged = list(post_store.merge_posts(main, second))
+    assert [post_store.post_key(p) for p in merged] == [5, "second:9", "second:4", 4]
+    assert list(post_store.merge_posts(main)) == main
+
+
+def test_import_json_skips_posts_from_other_channels(tmp_path):
+    path = tmp_path / "posts.json"
+    path.write_text(json.dumps(POSTS + [post(1, "2025-01-01", "x", channel="second")], ensure_ascii=False),
+                    encoding="utf-8")
+    with post_store.PostStore(str(tmp_path / "posts.db")) as store:
+        assert store.import_json(str(path)) == 4
+    path.write_text('{"id": 1}', encoding="utf-8")
+    with post_store.PostStore(str(tmp_path / "posts.db")) as store, pytest.raises(ValueError):
+        store.import_json(str(path))
+
+
+def sort_config(root):
+    return config.ImporterConfig({"POST_STORE_FILE": str(root / "posts.db")})
+
+
+def test_sort_posts_rewrites_posts_json_from_the_store(tmp_path):
+    cfg = sort_config(tmp_path)
+    cfg.output_json_file = str(tmp_path / "posts.json")
+    old_dump(reversed(POSTS), cfg.output_json_file, indent=4)
+    assert sort_posts.main(cfg) == 0
+    assert read_bytes(cfg.output_json_file) == old_dump(POSTS, str(tmp_path / "old.json"), indent=2)
+
+
+def test_sort_posts_without_any_input_leaves_no_database(tmp_path, capsys):
+    cfg = sort_config(tmp_path)
+    cfg.output_json_file = str(tmp_path / "posts.json")
+    assert sort_posts.main(cfg) == 1
+    assert "找不到檔案" in capsys.readouterr().out
+    assert not os.path.exists(cfg.post_store_file)
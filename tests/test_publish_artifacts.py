@@ -0,0 +1,106 @@
+# 內容雜湊的發布產物：全新的容器以 bucket 中的 current.json 為比對基準，
+# 位元組相同的匯出不產生新產物也不改寫 current.json，舊版本從 bucket 刪除
+
+import datetime
+import json
+import os
+
+import pytest
+
+import config
+import gcs_sync
+import publish_artifacts
+from fake_storage import FakeStorageClient
+
+BUCKET = "out-bkt"
+
+
+def container(root):
+    os.makedirs(root, exist_ok=True)
+    cfg = config.ImporterConfig({"CHANNEL_USERNAME": "main", "STORAGE_BUCKET_NAME": BUCKET,
+                                 "PUBLISH_DIR": os.path.join(root, "publish"), "PUBLISH_RETENTION": "1",
+                                 "SHARDS_DIR": os.path.join(root, "posts"), "DELTA_DIR": os.path.join(root, "deltas")})
+    cfg.output_json_file = os.path.join(root, "posts.json")
+    cfg.latest_json_file = os.path.join(root, "latest.json")
+    cfg.search_index_file = os.path.join(root, "search-index.json")
+    cfg.version_json_file = os.path.join(root, "version.json")
+    cfg.root = root
+    return cfg
+
+
+def run(cfg, client, posts):
+    """一次運行的發布與上傳 (與 everypy.export_outputs 的順序相同)。"""
+    source = os.path.join(cfg.root, "posts.min.json")
+    with open(source, "w", encoding="utf-8") as f:
+        json.dump(posts, f, ensure_ascii=False, separators=(",", ":"))
+    stats = publish_artifacts.publish({"posts": source}, publish_dir=cfg.publish_dir, retention=cfg.publish_retention,
+                                      remote_pointer=gcs_sync.remote_pointer(cfg, client))
+    upload = gcs_sync.sync_outputs(gcs_sync.collect_outputs(cfg), BUCKET, client=client)
+    assert not upload["failed"] and not upload["conflicts"]
+    deleted = gcs_sync.delete_stale_artifacts(cfg, publish_artifacts.load_pointer(cfg.publish_dir), client=client)
+    return stats, upload, deleted
+
+
+@pytest.fixture
+def client():
+    return FakeStorageClient()
+
+
+def remote_publish_files(client):
+    return sorted(name.split("/", 1)[1] for name in client.bucket(BUCKET).objects if name.startswith("publish/"))
+
+
+def test_identical_export_in_a_fresh_container_publishes_nothing(tmp_path, client):
+    posts = [{"id": 1, "date": "2025-08-01", "text": "第一篇"}]
+    first, upload, _ = run(container(str(tmp_path / "run1")), client, posts)
+    assert first["published"] == ["posts"] and first["pointer_written"]
+    assert "publish/current.json" in upload["uploaded"]
+
+    second, upload, deleted = run(container(str(tmp_path / "run2")), client, posts)
+    assert second["published"] == [] and not second["pointer_written"]
+    assert upload["uploaded"] == [] and deleted == []
+    # 沿用的指標檔與 bucket 中的位元組相同
+    with open(os.path.join(str(tmp_path / "run2"), "publish", "current.json"), "rb") as f:
+        assert f.read() == client.bucket(BUCKET).objects["publish/current.json"]["data"]
+
+
+def test_stale_remote_artifacts_are_deleted_beyond_retention(tmp_path, client):
+    files_by_run = []
+    for i in range(4):
+        # 每次都在全新的容器中執行，本地沒有任何舊產物
+        stats, _, deleted = run(container(str(tmp_path / f"run{i}")), client,
+                                [{"id": i, "date": "2025-08-01", "text": f"版本 {i}"}])
+        files_by_run.append(stats["artifacts"]["posts"]["file"])
+        pointer = json.loads(client.bucket(BUCKET).objects["publish/current.json"]["data"])
+        assert pointer["artifacts"]["posts"]["file"] == files_by_run[-1]
+        # 保留目前的版本與 1 個舊版本
+        assert pointer["artifacts"]["posts"]["previous"] == files_by_run[-2:-1]
+        assert remote_publish_files(client) == sorted(publish_artifacts.referenced_files(pointer))
+        if i >= 2:
+            assert f"publish/{files_by_run[i - 2]}" in deleted
+
+
+def test_recent_unreferenced_artifacts_are_kept(tmp_path, client):
+    cfg = container(str(tmp_path / "run"))
+    run(cfg, client, [{"id": 1, "date": "2025-08-01", "text": "一"}])
+    # 重疊的運行剛上傳、還沒寫入 current.json 的產物
+    client.now = datetime.datetime.now(datetime.timezone.utc)
+    orphan = tmp_path / "orphan.json"
+    orphan.write_text("[]", encoding="utf-8")
+    client.bucket(BUCKET).blob("publish/posts.0123456789abcdef.json").upload_from_filename(str(orphan))
+    assert gcs_sync.delete_stale_artifacts(cfg, publish_artifacts.load_pointer(cfg.publish_dir), client=client) == []
+    assert gcs_sync.delete_stale_artifacts(cfg, publish_artifacts.load_pointer(cfg.publish_dir), client=client,
+                                           grace_seconds=-60) == ["publish/posts.0123456789abcdef.json"]
+
+
+def test_uploaded_artifacts_carry_cache_headers(tmp_path, client):
+    # publish/ 只上傳到 bucket (不在 Hosting 的 public/ 中)，快取標頭必須設在物件上
+    stats, _, _ = run(container(str(tmp_path / "run")), client, [{"id": 1, "date": "2025-08-01", "text": "一"}])
+    objects = client.bucket(BUCKET).objects
+    posts_file = "publish/" + stats["artifacts"]["posts"]["file"]
+    assert objects[posts_file]["cache_control"] == gcs_sync.IMMUTABLE_CACHE_CONTROL
+    assert objects[posts_file]["content_type"] == "application/json"
+    assert objects[posts_file + ".gz"]["cache_control"] == gcs_sync.IMMUTABLE_CACHE_CONTROL
+    assert objects[posts_file + ".gz"]["content_encoding"] == "gzip"
+    assert objects[posts_file + ".gz"]["content_type"] == "application/json"
+    assert objects["publish/current.json"]["cache_control"] == gcs_sync.REVALIDATE_CACHE_CONTROL
@@ -0,0 +1,88 @@
+# 測試 rate_control.call_with_retry 對 FloodWait / Retry-After 的處理。
+
+import asyncio
+import types
+
+import pytest
+
+import rate_control
+from rate_control import RateController, ThrottledError, call_with_retry
+
+
+class FakeClock:
+    """取代 rate_control 使用的 time.monotonic 與 asyncio.sleep：sleep 只推進時間，不實際等待。"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.slept.append(delay)
+        self.now += delay
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_control, "time", types.SimpleNamespace(monotonic=fake.monotonic))
+    monkeypatch.setattr(rate_control, "asyncio", types.SimpleNamespace(sleep=fake.sleep, Lock=asyncio.Lock,
+                                                                       TimeoutError=asyncio.TimeoutError))
+    return fake
+
+
+def failing_then(errors, result="ok"):
+    calls = []
+
+    async def func():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return func, calls
+
+
+def test_retry_after_longer_than_max_wait_does_not_block_controller(clock):
+    controller = RateController("test", rate=10)
+    func, calls = failing_then([ThrottledError("429", retry_after=3600)])
+    with pytest.raises(ThrottledError):
+        asyncio.run(call_with_retry(controller, func, max_wait=60))
+    assert len(calls) == 1
+    # 其他 worker 不會被暫停一小時，但速率仍然減半
+    assert controller.blocked_until <= clock.now
+    assert controller.rate == 5
+    assert controller.throttles == 1
+
+
+def test_retry_after_within_max_wait_pauses_and_retries(clock):
+    controller = RateController("test", rate=10)
+    func, calls = failing_then([ThrottledError("429", retry_after=30)])
+    assert asyncio.run(call_with_retry(controller, func, max_wait=60)) == "ok"
+    assert len(calls) == 2
+    # 重試前等到 controller 的暫停結束
+    assert clock.now >= 1030
+    assert controller.waited_seconds >= 29
+    assert controller.throttles == 1
+
+
+def test_flood_wait_is_classified_by_name(clock):
+    class FloodWaitError(Exception):
+        def __init__(self, seconds):
+            super().__init__(f"wait {seconds}")
+            self.seconds = seconds
+
+    controller = RateController("test", rate=0)
+    func, calls = failing_then([FloodWaitError(7200)])
+    with pytest.raises(FloodWaitError):
+        asyncio.run(call_with_retry(controller, func, max_wait=600))
+    assert controller.blocked_until <= clock.now
+
+
+def test_fatal_error_is_not_retried():
+    controller = RateController("test", rate=10)
+    func, calls = failing_then([ValueError("bad")])
+    with pytest.raises(ValueError):
+        asyncio.run(call_with_retry(controller, func))
+    assert len(calls) == 1
@@ -0,0 +1,78 @@
+# search_index 的索引查詢必須與頁面原本的逐篇線性掃描 (linear_scan) 結果完全一致
+
+import pytest
+
+import search_index
+from post_store import post_key
+
+POSTS = [
+    {"id": 1, "date": "2025-08-10", "text": "聖賢語錄：修心養性"},
+    {"id": 2, "date": "2025-08-10", "text": "濟公活佛慈語 聖賢 語錄"},
+    {"id": 3, "date": "2025-08-11", "text": "Daily Wisdom from Jigong, wisdom wisdom"},
+    {"id": 4, "date": "2025-08-11", "text": "今日🙏感恩🙏感恩 🌸花開見佛"},
+    {"id": 5, "date": "2025-08-12", "text": "感恩🙏 聖賢語錄 🙏🙏"},
+    {"id": 6, "date": "2025-08-12", "text": "😀😃 emoji only 😀😃😀😃"},
+    {"id": 7, "date": "2025-08-12", "text": ""},
+    {"id": 8, "date": "2025-08-13", "text": "修心 Wisdom 修心修心", "channel": "other"},
+    {"id": 2, "date": "2025-08-13", "text": "另一個頻道的同一個 ID：感恩🙏", "channel": "other"},
+]
+
+QUERIES = [
+    "聖賢", "聖賢語錄", "語錄 修心", "修心", "賢語", "不存在的詞",
+    "wisdom", "WISDOM", "daily wisdom", "jigong,", "w",
+    "🙏", "感恩🙏", "🙏感恩", "😀😃", "😃😀😃", "🌸花", "emoji 😀",
+    "聖", "", "   ",
+]
+
+
+def expected_order(keys, posts_by_key):
+    """與 SearchIndex.query() 相同的預設排序：日期降序、訊息 ID 降序。"""
+    return sorted(keys, key=lambda key: (posts_by_key[key]["date"], posts_by_key[key]["id"]), reverse=True)
+
+
+@pytest.fixture(params=["build", "update", "json"])
+def index(request):
+    if request.param == "build":
+        return search_index.SearchIndex.build(POSTS)
+    if request.param == "update":
+        # 先建立部分貼文的索引，再以完整集合增量更新
+        index = search_index.SearchIndex.build(POSTS[:4])
+        index.update(POSTS)
+        return index
+    return search_index.SearchIndex.from_json(search_index.SearchIndex.build(POSTS).to_json())
+
+
+@pytest.fixture
+def posts_by_key():
+    return {post_key(post): post for post in POSTS}
+
+
+@pytest.mark.parametrize("q", QUERIES)
+@pytest.mark.parametrize("date", [None, "2025-08-12"])
+def test_query_matches_linear_scan(index, posts_by_key, q, date):
+    expected = expected_order(search_index.linear_scan(POSTS, q, date), posts_by_key)
+    assert index.query(q, date=date, posts_by_id=posts_by_key) == expected
+
+
+@pytest.mark.parametrize("q", [q for q in QUERIES if all(len(kw) > 1 for kw in search_index.split_keywords(q))])
+def test_bigram_filter_never_drops_matches(index, q):
+    # 只以 bigram 交集過濾 (前端的作法) 時，候選集合必須包含所有真正符合的貼文，包括 emoji 等 BMP 以外的字元
+    assert set(search_index.linear_scan(POSTS, q)) <= set(index.query(q))
+
+
+@pytest.mark.parametrize("q", ["wisdom", "修心", "🙏", "感恩🙏", "聖賢 語錄", "😀😃"])
+def test_ranked_query_orders_by_keyword_count(index, posts_by_key, q):
+    keywords = search_index.split_keywords(q)
+    matches = search_index.linear_scan(POSTS, q)
+
+    def score(key):
+        text = search_index.normalize(posts_by_key[key]["text"])
+        return sum(text.count(kw) for kw in keywords), posts_by_key[key]["date"], posts_by_key[key]["id"]
+
+    assert index.query(q, posts_by_id=posts_by_key, rank=True) == sorted(matches, key=score, reverse=True)
+
+
+def test_bigrams_are_code_points():
+    # 與前端的 Array.from(keyword) 相同：以 code point 而不是 UTF-16 單位切分
+    assert search_index.bigrams("感恩🙏") == {"感恩", "恩🙏"}
+    assert search_index.bigrams("😀😃😀") == {"😀😃", "😃😀"}
@@ -0,0 +1,36 @@
+# 每個工作的啟動時間預算與延後載入：在全新的直譯器中 import 工作模組，不能載入 Telethon、Cloud SDK 等重量級套件
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import cli
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 不需要 Flask 的批次工作 (app.py 另外檢查)
+JOB_TARGETS = [name for name, (_, allowed) in cli.STARTUP_TARGETS.items() if not allowed]
+
+
+def loaded_heavy_modules(module):
+    probe = ("import json, sys, cli; cli.prepare(%r); "
+             "print(json.dumps([name for name in cli.HEAVY_MODULES if name in sys.modules]))" % module)
+    proc = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, cwd=ROOT)
+    assert proc.returncode == 0, proc.stderr
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("target", list(cli.STARTUP_TARGETS))
+def test_job_modules_import_no_unexpected_heavy_modules(target):
+    module, allowed = cli.STARTUP_TARGETS[target]
+    for name in allowed:
+        pytest.importorskip(name)
+    assert [name for name in loaded_heavy_modules(module) if name not in allowed] == []
+
+
+def test_startup_check_passes_within_budget(capsys):
+    assert cli.startup_check(targets=JOB_TARGETS) == 0
+    report = json.loads([line for line in capsys.readouterr().out.splitlines() if line.startswith("{")][-1])
+    assert set(report["results"]) == set(JOB_TARGETS)
@@ -0,0 +1,104 @@
+# 狀態檔保存在 bucket 中：全新的容器 (空的工作目錄) 下載上一次運行的狀態後，從上一次的進度繼續
+
+import os
+
+import pytest
+
+import config
+import delta_feed
+import everypy
+import gcs_sync
+import run_metrics
+import search_index
+import state_sync
+from fake_storage import FakeStorageClient
+
+
+def post(post_id, date, text):
+    return {"id": post_id, "date": date, "text": text, "image": None}
+
+
+def container(root):
+    """一個全新容器的設定：所有狀態檔都在 root 之下。"""
+    os.makedirs(root, exist_ok=True)
+    names = {"POST_STORE_FILE": "posts.db", "IMPORT_STATE_FILE": "import_state.json",
+             "IMAGE_INDEX_FILE": "image_index.json", "SEARCH_INDEX_FILE": "search-index.json",
+             "DELTA_STATE_FILE": "delta_state.json", "FIRESTORE_SYNC_STATE_FILE": "firestore_sync_state.json",
+             "CHANNELS_DIR": "channels", "VERSION_JSON_FILE": "version.json", "DELTA_DIR": "deltas",
+             "LATEST_JSON_FILE": "latest.json", "SHARDS_DIR": "posts"}
+    env = {key: os.path.join(root, name) for key, name in names.items()}
+    env.update(CHANNEL_USERNAMES="main,second", STORAGE_BUCKET_NAME="out-bkt", PUBLISH_DIR="")
+    cfg = config.ImporterConfig(env)
+    cfg.output_json_file = os.path.join(root, "posts.json")
+    return cfg
+
+
+@pytest.fixture
+def client():
+    return FakeStorageClient()
+
+
+def sync(cfg, client):
+    return state_sync.StateSync(state_sync.state_files(cfg), "state-bkt", client=client)
+
+
+def test_state_files_upload_watermarks_last():
+    cfg = container("/nonexistent")
+    names = [name for _, name in state_sync.state_files(cfg)]
+    assert names == ["posts.db", "channels/second/posts.db", "image_index.json", "search-index.json",
+                     "delta_state.json", "firestore_sync_state.json",
+                     "import_state.json", "channels/second/import_state.json"]
+
+
+def test_search_index_is_updated_incrementally_in_a_fresh_container(tmp_path, client):
+    posts = [post(2, "2025-08-02", "聖賢語錄"), post(1, "2025-08-01", "濟公活佛")]
+    first = container(str(tmp_path / "run1"))
+    stats = search_index.update_index_file(posts, first.search_index_file)
+    assert stats["rebuilt"]
+    saved = sync(first, client).save()
+    assert "importer-state/search-index.json" in saved["uploaded"]
+
+    second = container(str(tmp_path / "run2"))
+    restored = sync(second, client).restore()
+    assert "importer-state/search-index.json" in restored["downloaded"]
+    stats = search_index.update_index_file([post(3, "2025-08-03", "新的語錄")] + posts, second.search_index_file)
+    assert not stats["rebuilt"]
+    assert stats["added"] == 1
+    index = search_index.load_index(second.search_index_file)
+    assert index.query("語錄") == [3, 2]
+
+
+def publish_run(cfg, client, posts, failing_objects=()):
+    """一次運行的 delta 發布、上傳與狀態保存 (與 everypy.main 的順序相同)，返回 (delta 統計, outputs_ok)。"""
+    synced = sync(cfg, client)
+    synced.restore()
+    os.makedirs(cfg.delta_dir, exist_ok=True)
+    stats = delta_feed.publish(posts, version_path=cfg.version_json_file, delta_dir=cfg.delta_dir,
+                               state_path=cfg.delta_state_file, remote_version=gcs_sync.remote_version(cfg, client))
+    client.bucket("out-bkt").fail = set(failing_objects)
+    upload = gcs_sync.sync_outputs(gcs_sync.collect_outputs(cfg), "out-bkt", client=client)
+    client.bucket("out-bkt").fail = set()
+    outputs_ok = not upload["failed"]
+    assert everypy.save_state(synced, run_metrics.RunMetrics(), cfg, outputs_ok=outputs_ok)
+    return stats, outputs_ok
+
+
+def test_delta_state_is_not_saved_when_the_outputs_were_not_published(tmp_path, client):
+    v1 = [post(1, "2025-08-01", "第一篇")]
+    v2 = [post(2, "2025-08-02", "第二篇")] + v1
+    stats, ok = publish_run(container(str(tmp_path / "run1")), client, v1)
+    assert ok and stats["version"] == 1
+
+    # deltas/2.json 上傳失敗：version.json 不更新，本地記錄的版本 2 不能保存到 bucket
+    stats, ok = publish_run(container(str(tmp_path / "run2")), client, v2, failing_objects={"deltas/2.json"})
+    assert not ok and stats["version"] == 2
+    assert gcs_sync.remote_version(container(str(tmp_path / "run2")), client) == 1
+
+    # 下一次運行從已發布的版本 1 重新發布版本 2 與它的 delta
+    cfg = container(str(tmp_path / "run3"))
+    stats, ok = publish_run(cfg, client, v2)
+    assert ok and stats["changed"] and stats["version"] == 2 and not stats["baseline_lost"]
+    assert gcs_sync.remote_version(cfg, client) == 2
+    assert "deltas/2.json" in client.bucket("out-bkt").objects
+    posts, version = delta_feed.apply_deltas(v1, 1, cfg.delta_dir, cfg.version_json_file)
+    assert version == 2 and posts == v2